@@ -0,0 +1,234 @@
+"""
+离线批量推理：从 JSONL 文件流式读取提问，按提示词长度分组为左侧补齐的批次生成回复，结果逐批追加写入输出 JSONL
+
+输入每行为一个 JSON 对象，可选的 id 字段原样写入输出：
+- {"messages": [{"role": "user", "content": "..."}]}：完整的聊天记录，最后一条为用户提问
+- {"prompt": "...", "history": [...]}：用户提问与可选的 ChatGLM3 格式聊天记录
+
+输出每行为 {"line", "id", "response", "finish_reason", "prompt_tokens", "completion_tokens"}，该行出错时为
+{"line", "id", "error"}，line 为输入中从 1 开始的行号
+
+输出文件即为检查点：每个批次写入后刷新到磁盘，中断后以相同的参数重新运行时跳过输出中已有的行，并丢弃末尾写了一半的行
+
+例如 CPU 推理：python batch_inference.py prompts.jsonl results.jsonl --cpu
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 仓库根目录，用于导入 common 模块
+from common.backends import ModelBackend, create_backend  # pylint: disable=C0413
+
+# 待生成的行：(行号, id, 提示词 token id)
+PendingRow = tuple[int, Any, list[int]]
+
+
+def load_completed(output: Path) -> set[int]:
+    """
+    读取输出文件中已完成的行号，并截掉末尾写了一半的行
+
+    :param output: 输出文件
+    :return: 已完成的输入行号
+    """
+    if not output.exists():
+        return set()
+    with output.open("rb+") as f:
+        data: bytes = f.read()
+        end: int = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    return {json.loads(line)["line"] for line in data[:end].splitlines() if line.strip()}
+
+
+def parse_row(row: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    将输入的一行转换为 ChatGLM3 格式的完整聊天记录
+
+    :raises ValueError: 缺少提问
+    """
+    if "messages" in row:
+        messages: list[dict[str, Any]] = row["messages"]
+    elif "prompt" in row:
+        messages = [*row.get("history", []), {"role": "user", "content": row["prompt"]}]
+    else:
+        raise ValueError("缺少 messages 或 prompt 字段")
+    if not messages or messages[-1].get("role") != "user":
+        raise ValueError("最后一条消息必须是用户提问")
+    # 与 ChatGLM3 的聊天记录一致，助手消息带有 metadata
+    return [{"metadata": "", **message} if message["role"] == "assistant" else message for message in messages]
+
+
+def read_rows(
+    path: Path, completed: set[int], backend: ModelBackend, max_length: int
+) -> Iterator[PendingRow | dict[str, Any]]:
+    """
+    流式读取尚未完成的行并分词
+
+    :return: 待生成的行，或该行出错时直接写入输出的结果
+    """
+    with path.open(encoding="utf-8") as f:
+        for line, text in enumerate(f, start=1):
+            if line in completed or not text.strip():
+                continue
+            row_id: Any = None
+            try:
+                row: dict[str, Any] = json.loads(text)
+                row_id = row.get("id")
+                prompt_ids: list[int] = backend.tokenize_messages(parse_row(row))
+                if len(prompt_ids) >= max_length:
+                    raise ValueError(f"提示词的长度 {len(prompt_ids)} 超出最大长度 {max_length}")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                yield {"line": line, "id": row_id, "error": f"{type(e).__name__}: {e}"}
+                continue
+            yield line, row_id, prompt_ids
+
+
+def make_batches(rows: list[PendingRow], batch_size: int, max_batch_tokens: int) -> Iterator[list[PendingRow]]:
+    """
+    按提示词长度排序后分组，同一批次的提示词长度相近，左侧补齐的 token 较少
+
+    :param rows: 待生成的行
+    :param batch_size: 每个批次的最大行数
+    :param max_batch_tokens: 每个批次补齐后的提示词 token 总数上限，至少包含一行
+    """
+    batch: list[PendingRow] = []
+    for row in sorted(rows, key=lambda row: len(row[2])):
+        # 已按长度升序排列，新的一行即为批次中最长的提示词
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * len(row[2]) > max_batch_tokens):
+            yield batch
+            batch = []
+        batch.append(row)
+    if batch:
+        yield batch
+
+
+def generate(
+    backend: ModelBackend, batch: list[PendingRow], args: argparse.Namespace
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    生成一个批次的回复
+
+    :return: 输出的行与补齐后的提示词 token 总数
+    """
+    max_new_tokens: list[int] = [min(args.max_new_tokens, args.max_length - len(prompt)) for _, _, prompt in batch]
+    outputs: list[list[int]] = backend.generate_batch(
+        [prompt for _, _, prompt in batch], args.top_p, args.temperature, max_new_tokens
+    )
+    results: list[dict[str, Any]] = []
+    for (line, row_id, prompt), output_ids, limit in zip(batch, outputs, max_new_tokens):
+        response, _ = backend.process_response(backend.decode(output_ids), [])
+        results.append(
+            {
+                "line": line,
+                "id": row_id,
+                "response": response,
+                "finish_reason": "length" if len(output_ids) >= limit else "stop",
+                "prompt_tokens": len(prompt),
+                "completion_tokens": len(output_ids),
+            }
+        )
+    return results, len(batch) * max(len(prompt) for _, _, prompt in batch)
+
+
+def write_results(f: Any, results: list[dict[str, Any]]) -> None:
+    """
+    追加写入结果并刷新到磁盘，写入后这些行即视为已完成
+    """
+    for result in results:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def main(args: argparse.Namespace) -> None:
+    """
+    批量推理主流程
+    """
+    torch.manual_seed(args.seed)
+    completed: set[int] = load_completed(args.output)
+    with args.input.open(encoding="utf-8") as f:
+        total: int = sum(1 for line in f if line.strip())
+    print(f"共 {total} 行，已完成 {len(completed)} 行")
+    if len(completed) >= total:
+        return
+
+    kwargs: dict[str, Any] = {}
+    if args.backend == "chatglm3":
+        kwargs = {"is_quantize": args.quantize, "is_cpu": args.cpu}
+    elif args.backend == "minicpm":
+        kwargs = {"is_cpu": args.cpu}
+    start: float = time.perf_counter()
+    backend: ModelBackend = create_backend(args.backend, load=True, **kwargs)
+    print(f"模型加载耗时 {time.perf_counter() - start:.1f} 秒")
+
+    done: int = len(completed)
+    rows: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    padded_tokens: int = 0
+    completion_tokens: int = 0
+    start = time.perf_counter()
+    reader: Iterator[PendingRow | dict[str, Any]] = read_rows(args.input, completed, backend, args.max_length)
+    with args.output.open("a", encoding="utf-8") as output:
+        while True:
+            # 每次读取一个窗口的行，在窗口内按长度分组；窗口越大分组越均匀，但中断时未写入的行也越多
+            window: list[PendingRow] = []
+            failed: list[dict[str, Any]] = []
+            for item in reader:
+                if isinstance(item, dict):
+                    failed.append(item)
+                else:
+                    window.append(item)
+                if len(window) + len(failed) >= args.sort_window:
+                    break
+            if not window and not failed:
+                break
+            write_results(output, failed)
+            done, errors = done + len(failed), errors + len(failed)
+            for batch in make_batches(window, args.batch_size, args.max_batch_tokens):
+                results, padded = generate(backend, batch, args)
+                write_results(output, results)
+                done, rows = done + len(results), rows + len(results)
+                prompt_tokens += sum(result["prompt_tokens"] for result in results)
+                completion_tokens += sum(result["completion_tokens"] for result in results)
+                padded_tokens += padded
+                elapsed: float = time.perf_counter() - start
+                print(
+                    f"{done}/{total} 行，{rows / elapsed:.2f} 行/秒，生成 {completion_tokens / elapsed:.1f} token/秒，"
+                    f"批次 {len(batch)} 行 × {padded // len(batch)} token"
+                )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"本次完成 {rows} 行（{errors} 行出错），耗时 {elapsed:.1f} 秒，{rows / max(elapsed, 1e-9):.2f} 行/秒，"
+        f"提示词 {prompt_tokens / max(elapsed, 1e-9):.1f} token/秒，生成 {completion_tokens / max(elapsed, 1e-9):.1f} "
+        f"token/秒，补齐后有效 token 占比 {prompt_tokens / max(padded_tokens, 1):.1%}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", type=Path, help="输入 JSONL 文件")
+    parser.add_argument("output", type=Path, help="输出 JSONL 文件，已存在时从中断处继续")
+    parser.add_argument("--backend", default="chatglm3", help="模型后端，见 common.backends.BACKENDS")
+    parser.add_argument("--cpu", action="store_true", help="CPU 推理（is_cpu=True），要求 32GB 内存空间")
+    parser.add_argument("--quantize", action="store_true", help="模型 4-bit 量化，6GB 显存即可")
+    parser.add_argument("--batch-size", type=int, default=8, help="每个批次的最大行数")
+    parser.add_argument("--max-batch-tokens", type=int, default=16384, help="每个批次补齐后的提示词 token 总数上限")
+    parser.add_argument("--sort-window", type=int, default=512, help="按长度分组的窗口行数")
+    parser.add_argument("--max-new-tokens", type=int, default=512, help="每行最多生成的 token 数量")
+    parser.add_argument("--max-length", type=int, default=8192, help="提示词与回复的最大总长度")
+    parser.add_argument("--top-p", type=float, default=0.8)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    try:
+        main(parser.parse_args())
+    except KeyboardInterrupt:
+        # 已写入的批次不会丢失，重新运行即可继续
+        raise SystemExit("已中断，重新运行相同的命令即可从中断处继续") from None
@@ -3,45 +3,50 @@
 """
 import os
 import platform
+import sys
+from pathlib import Path
 
-from modelscope import AutoModel, AutoTokenizer, snapshot_download
+from transformers import LogitsProcessorList
 
-TOKENIZER = None
-MODEL = None
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 仓库根目录，用于导入 common 模块
+from common.backends import create_backend  # pylint: disable=C0413
+from common.bad_words import BlocklistLogitsProcessor, TokenTrie  # pylint: disable=C0413
+from common.moderation import AhoCorasick, StreamModerator  # pylint: disable=C0413
+
+# GPU 推理，默认 FP16 精度加载，需要 13GB 显存
+# is_quantize=True：模型 4-bit 量化，减少显存压力，6GB 显存即可；is_cpu=True：CPU 推理，要求 32GB 内存空间
+BACKEND = create_backend("chatglm3")
 BAD_WORDS: list[str] = ["你好"]
-BAD_WORDS_IDS: list | None = None
+# 敏感词编译后的 token 字典树，缓存到磁盘，词表不变时启动无需重新分词
+BAD_WORDS_TRIE: TokenTrie | None = None
+BAD_WORDS_CACHE_PATH: str = str(Path.home() / ".cache" / "llm_demo" / "chatglm3_bad_words.json")
+# 敏感词自动机，流式输出时只检查新生成的文本
+BAD_WORDS_AUTOMATON = AhoCorasick(BAD_WORDS)
 
 
 def init_model():
     """
     初始化 ChatGLM3 模型
     """
-    global TOKENIZER, MODEL, BAD_WORDS_IDS  # pylint: disable=W0603
-
-    model_dir: str = snapshot_download("ZhipuAI/chatglm3-6b", revision="master", local_files_only=True)
+    global BAD_WORDS_TRIE  # pylint: disable=W0603
 
-    if TOKENIZER is None:
-        TOKENIZER = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+    if not BACKEND.loaded:
+        BACKEND.load()
 
-    if MODEL is None:
-        # GPU 推理，默认 FP16 精度加载，需要 13GB 显存
-        MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).cuda()
-        # MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).half().cuda()
-        # 模型 4-bit 量化，减少显存压力，6GB 显存即可
-        # MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).quantize(4).cuda()
-        # CPU 推理，要求 32GB 内存空间
-        # MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).float()
-        MODEL = MODEL.eval()
-
-    if BAD_WORDS_IDS is None:
-        BAD_WORDS_IDS = [TOKENIZER.encode(bad_word, add_special_tokens=False) for bad_word in BAD_WORDS]
+    if BAD_WORDS_TRIE is None:
+        BAD_WORDS_TRIE = TokenTrie.from_words(
+            BACKEND.tokenizer,
+            BAD_WORDS,
+            eos_token_ids=[BACKEND.tokenizer.eos_token_id],
+            cache_path=BAD_WORDS_CACHE_PATH,
+        )
 
 
 def main():
     """
     命令行内对话，流式输出回复
     """
-    if (MODEL is None) or (TOKENIZER is None):
+    if not BACKEND.loaded:
         raise RuntimeError("模型未初始化！")
 
     clear_cmd: str = "cls" if platform.system() == "Windows" else "clear"
@@ -63,25 +68,26 @@ def main():
 
         print("\nChatGLM3-6B：", end="")
         current_length: int = 0
+        moderator = StreamModerator(BAD_WORDS_AUTOMATON, mode="stop")
 
         try:
-            for response, history, past_key_values in MODEL.stream_chat(
-                TOKENIZER,
+            for response, history, past_key_values in BACKEND.stream(
                 query,
-                history=history,
+                history,
                 top_p=1,
                 temperature=0.01,
                 past_key_values=past_key_values,
-                return_past_key_values=True,
-                bad_words_ids=BAD_WORDS_IDS,
+                # 单 token 敏感词一次掩码操作即可禁止，多 token 敏感词每步只更新一次字典树状态
+                logits_processor=LogitsProcessorList([BlocklistLogitsProcessor(BAD_WORDS_TRIE)]),
             ):
-                # Check if the response contains any bad words
-                # if any(bad_word in response for bad_word in BAD_WORDS):
-                #     print("我的回答涉嫌了 bad word")
-                #     break  # Break the loop if a bad word is detected
-
-                print(response[current_length:], end="", flush=True)
+                # 只审核新生成的文本，可能构成敏感词的文本暂缓输出
+                print(moderator.feed(response[current_length:]), end="", flush=True)
                 current_length = len(response)
+                if moderator.blocked:
+                    print("\n我的回答涉嫌了 bad word")
+                    break  # Break the loop if a bad word is detected
+            else:
+                print(moderator.flush(), end="", flush=True)
         except RuntimeError:
             print("生成文本时发生错误，这可能是涉及到设定的敏感词汇。")
 
@@ -3,40 +3,30 @@
 """
 import os
 import platform
+import sys
+from pathlib import Path
 
-from modelscope import AutoModel, AutoTokenizer, snapshot_download
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 仓库根目录，用于导入 common 模块
+from common.backends import create_backend  # pylint: disable=C0413
 
-TOKENIZER = None
-MODEL = None
+# GPU 推理，默认 FP16 精度加载，需要 13GB 显存
+# is_quantize=True：模型 4-bit 量化，减少显存压力，6GB 显存即可；is_cpu=True：CPU 推理，要求 32GB 内存空间
+BACKEND = create_backend("chatglm3")
 
 
 def init_model():
     """
     初始化 ChatGLM3 模型
     """
-    global TOKENIZER, MODEL  # pylint: disable=W0603
-
-    model_dir: str = snapshot_download("ZhipuAI/chatglm3-6b", revision="master", local_files_only=True)
-
-    if TOKENIZER is None:
-        TOKENIZER = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
-
-    if MODEL is None:
-        # GPU 推理，默认 FP16 精度加载，需要 13GB 显存
-        MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).cuda()
-        # MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).half().cuda()
-        # 模型 4-bit 量化，减少显存压力，6GB 显存即可
-        # MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).quantize(4).cuda()
-        # CPU 推理，要求 32GB 内存空间
-        # MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).float()
-        MODEL = MODEL.eval()
+    if not BACKEND.loaded:
+        BACKEND.load()
 
 
 def main():
     """
     命令行内对话，流式输出回复
     """
-    if (MODEL is None) or (TOKENIZER is None):
+    if not BACKEND.loaded:
         raise RuntimeError("模型未初始化！")
 
     clear_cmd: str = "cls" if platform.system() == "Windows" else "clear"
@@ -62,14 +52,12 @@ def main():
         # top_p: 在生成下一个 token 时，从概率分布的前几个最高概率的 token 中进行随机选择的精度阈值。
         # temperature: 控制模型生成文本的随机性和创造性的参数。
         # past_key_values: 一个包含模型过去状态的元组，用于加速生成。
-        for response, history, past_key_values in MODEL.stream_chat(
-            TOKENIZER,
+        for response, history, past_key_values in BACKEND.stream(
             query,
-            history=history,
+            history,
             top_p=1,
             temperature=0.01,
             past_key_values=past_key_values,
-            return_past_key_values=True,
         ):
             print(response[current_length:], end="", flush=True)
             current_length = len(response)
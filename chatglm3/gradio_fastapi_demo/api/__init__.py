@@ -1,4 +1,12 @@
 """
 FastAPI 构建 LLM 模块
 """
-from .main import app
+
+
+def __getattr__(name: str):
+    # 延迟导入 app，避免仅使用子模块（如基准测试）时也加载模型
+    if name == "app":
+        from .main import app  # pylint: disable=C0415
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,411 @@
+"""
+连续批处理（iteration-level batching）推理引擎
+
+每个解码步骤之间接纳新的请求并移除已结束的请求，多个请求共享同一次前向计算
+"""
+
+import queue
+import threading
+from typing import Any, Iterator
+
+import torch
+
+from .prefix_cache import PrefixCache, PrefixNode
+
+_SEQUENCE_END = object()  # 序列生成结束标记
+_SHUTDOWN = object()  # 引擎关闭标记
+
+
+class Sequence:
+    """
+    引擎中的单个生成序列
+    """
+
+    def __init__(
+        self,
+        prompt_ids: list[int],
+        top_p: float,
+        temperature: float,
+        max_new_tokens: int,
+        eos_token_ids: set[int],
+        cancel_event: threading.Event | None = None,
+    ) -> None:
+        self.prompt_ids: list[int] = prompt_ids
+        self.top_p: float = top_p
+        self.temperature: float = temperature
+        self.max_new_tokens: int = max_new_tokens
+        self.eos_token_ids: set[int] = eos_token_ids
+        self.generated: list[int] = []
+        self.length: int = len(prompt_ids)  # KV 缓存中属于该序列的有效 token 数量
+        self.outputs: queue.Queue = queue.Queue()
+        self.cancel_event: threading.Event | None = cancel_event  # 调用方的取消事件
+        self._stopped = threading.Event()  # 调用方不再读取输出
+        self.prefix_nodes: list[PrefixNode] = []  # 引用的前缀缓存节点
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        序列是否已被取消
+        """
+        return self._stopped.is_set() or (self.cancel_event is not None and self.cancel_event.is_set())
+
+    def is_finished(self) -> bool:
+        """
+        序列是否已经结束生成
+        """
+        if self.cancelled or len(self.generated) >= self.max_new_tokens:
+            return True
+        return bool(self.generated) and self.generated[-1] in self.eos_token_ids
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        依次返回生成的 token id
+        """
+        try:
+            while True:
+                item = self.outputs.get()
+                if item is _SEQUENCE_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self._stopped.set()  # 调用方提前停止迭代时通知引擎移除该序列
+
+    def cancel(self) -> None:
+        """
+        取消生成，引擎会在下一个解码步骤移除该序列
+        """
+        self._stopped.set()
+
+
+def sample_next_tokens(logits: torch.Tensor, temperatures: torch.Tensor, top_ps: torch.Tensor) -> torch.Tensor:
+    """
+    按每个序列各自的 temperature 与 top p 参数采样下一个 token
+
+    :param logits: [batch, vocab] 最后一个位置的 logits
+    :param temperatures: [batch] 每个序列的 temperature
+    :param top_ps: [batch] 每个序列的 top p
+    :return: [batch] 采样得到的 token id
+    """
+    logits = torch.nan_to_num(logits.float(), nan=0.0, posinf=1e4, neginf=-1e4)
+    probs = torch.softmax(logits / temperatures.clamp(min=1e-5).unsqueeze(1), dim=-1)
+    sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+    # 累计概率超过 top p 的 token 不参与采样，概率最高的 token 始终保留
+    sorted_probs[(sorted_probs.cumsum(dim=-1) - sorted_probs) > top_ps.unsqueeze(1)] = 0.0
+    choices = torch.multinomial(sorted_probs, num_samples=1)
+    return sorted_ids.gather(-1, choices).squeeze(-1)
+
+
+def _pad_left(tensor: torch.Tensor, dim: int, size: int) -> torch.Tensor:
+    """
+    在指定维度的左侧补零
+    """
+    if size == 0:
+        return tensor
+    shape: list[int] = list(tensor.shape)
+    shape[dim] = size
+    return torch.cat((tensor.new_zeros(shape), tensor), dim=dim)
+
+
+class ContinuousBatchingEngine:
+    """
+    连续批处理推理引擎，独占模型并在后台线程中循环执行解码步骤
+
+    不同长度的序列在 KV 缓存中左侧补齐，通过 attention mask 屏蔽补齐的位置
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        max_batch_size: int = 8,
+        kv_seq_dim: int = 0,
+        kv_batch_dim: int = 1,
+        prefix_cache: PrefixCache | None = None,
+    ) -> None:
+        """
+        :param model: HuggingFace 风格的因果语言模型
+        :param max_batch_size: 同时解码的最大序列数量
+        :param kv_seq_dim: past_key_values 中序列长度所在维度，ChatGLM3 为 0，多数 HuggingFace 模型为 2
+        :param kv_batch_dim: past_key_values 中 batch 所在维度，ChatGLM3 为 1，多数 HuggingFace 模型为 0
+        :param prefix_cache: 跨会话共享的前缀 KV 缓存，命中时只需 prefill 提示词剩余的部分
+        """
+        self.model = model
+        self.prefix_cache: PrefixCache | None = prefix_cache
+        self.max_batch_size: int = max_batch_size
+        self.kv_seq_dim: int = kv_seq_dim
+        self.kv_batch_dim: int = kv_batch_dim
+        self.device = next(model.parameters()).device
+        self.steps: int = 0  # 已执行的解码步骤数量
+        self.generated_tokens: int = 0
+
+        self._waiting: queue.Queue = queue.Queue()
+        self._running: list[Sequence] = []
+        self._past_key_values: Any = None
+        self._attention_mask: torch.Tensor | None = None  # [batch, kv_len]
+        self._closed: bool = False
+        self._thread = threading.Thread(target=self._loop, name="continuous-batching", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        prompt_ids: list[int],
+        top_p: float,
+        temperature: float,
+        max_new_tokens: int,
+        eos_token_ids: list[int],
+        cancel_event: threading.Event | None = None,
+    ) -> Sequence:
+        """
+        提交生成请求
+
+        :param prompt_ids: 提示词 token id
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param max_new_tokens: 最多生成的 token 数量
+        :param eos_token_ids: 结束 token id
+        :param cancel_event: 取消事件，被设置后序列在下一个解码步骤被移除
+        :return: 可迭代的生成序列，迭代得到新生成的 token id（包含结束 token）
+        """
+        sequence = Sequence(prompt_ids, top_p, temperature, max_new_tokens, set(eos_token_ids), cancel_event)
+        self._waiting.put(sequence)
+        return sequence
+
+    def submit_group(
+        self,
+        prompt_ids: list[int],
+        top_p: float,
+        temperature: float,
+        max_new_tokens: int,
+        eos_token_ids: list[int],
+        cancel_events: list[threading.Event],
+    ) -> list[Sequence]:
+        """
+        对同一提示词提交多个生成请求，只 prefill 一次，KV 缓存沿 batch 维复制后各序列独立采样与解码
+
+        一组序列整体接纳，批次可能暂时超出 max_batch_size
+
+        :param prompt_ids: 提示词 token id
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param max_new_tokens: 每个序列最多生成的 token 数量
+        :param eos_token_ids: 结束 token id
+        :param cancel_events: 每个序列的取消事件，数量即为生成的序列数量
+        :return: 与 cancel_events 一一对应的生成序列
+        """
+        eos: set[int] = set(eos_token_ids)
+        group: list[Sequence] = [
+            Sequence(prompt_ids, top_p, temperature, max_new_tokens, eos, cancel_event)
+            for cancel_event in cancel_events
+        ]
+        self._waiting.put(group)
+        return group
+
+    def shutdown(self) -> None:
+        """
+        关闭引擎，正在解码的序列生成完毕后后台线程退出
+        """
+        self._waiting.put(_SHUTDOWN)
+        self._thread.join()
+
+    @property
+    def batch_size(self) -> int:
+        """
+        当前正在解码的序列数量
+        """
+        return len(self._running)
+
+    def _loop(self) -> None:
+        """
+        引擎主循环：接纳新序列、执行一个解码步骤、移除已结束的序列
+        """
+        while not self._closed or self._running:
+            try:
+                with torch.inference_mode():
+                    self._admit(block=not self._running)  # 空闲时阻塞等待新请求
+                    self._retire()  # prefill 后即结束的序列不参与解码
+                    if self._running:
+                        self._step()
+                        self._retire()
+            except Exception as e:  # pylint: disable=W0718
+                self._fail(self._running, e)
+                self._running, self._past_key_values, self._attention_mask = [], None, None
+
+    def _forward(self, input_ids: torch.Tensor, position_ids: torch.Tensor, attention_mask: torch.Tensor, past: Any):
+        """
+        执行一次前向计算，返回最后一个位置的 logits 与新的 past_key_values
+        """
+        outputs = self.model(
+            input_ids=input_ids,
+            position_ids=position_ids,
+            attention_mask=attention_mask,
+            past_key_values=past,
+            use_cache=True,
+        )
+        return outputs.logits[:, -1, :], outputs.past_key_values
+
+    def _admit(self, block: bool) -> None:
+        """
+        对等待中的序列逐个 prefill，并将其 KV 缓存合并进正在解码的批次
+
+        :param block: 没有等待中的序列时是否阻塞，只在第一个序列上阻塞
+        """
+        while len(self._running) < self.max_batch_size:
+            try:
+                item: Sequence | list[Sequence] = self._waiting.get(block=block)
+            except queue.Empty:
+                break
+            block = False
+            if item is _SHUTDOWN:
+                self._closed = True
+                break
+            group: list[Sequence] = []
+            for sequence in item if isinstance(item, list) else [item]:
+                if sequence.cancelled:
+                    sequence.outputs.put(_SEQUENCE_END)
+                else:
+                    group.append(sequence)
+            if not group:
+                continue
+
+            try:
+                logits, past = self._prefill(group[0])  # 同一组序列的提示词相同，共享一次 prefill
+            except Exception as e:  # pylint: disable=W0718
+                self._fail(group, e)  # 单个请求 prefill 失败不影响正在解码的批次
+                continue
+            for sequence, token_id in zip(group, self._sample(logits.expand(len(group), -1), group)):
+                self._emit(sequence, token_id)
+            if len(group) > 1:
+                index = torch.zeros(len(group), dtype=torch.long, device=self.device)
+                past = tuple(tuple(tensor.index_select(self.kv_batch_dim, index) for tensor in layer) for layer in past)
+            length: int = group[0].length
+            self._merge(group, past, torch.ones(len(group), length, dtype=torch.long, device=self.device))
+
+    def _prefill(self, sequence: Sequence):
+        """
+        对单个序列执行 prefill，命中前缀缓存的部分直接复用缓存的 KV
+        """
+        cached: int = 0
+        past: Any = None
+        if self.prefix_cache is not None:
+            sequence.prefix_nodes, past = self.prefix_cache.lookup(sequence.prompt_ids)
+            cached = len(sequence.prefix_nodes) * self.prefix_cache.block_size
+
+        length: int = len(sequence.prompt_ids)
+        input_ids = torch.tensor([sequence.prompt_ids[cached:]], dtype=torch.long, device=self.device)
+        position_ids = torch.arange(cached, length, dtype=torch.long, device=self.device).unsqueeze(0)
+        attention_mask = torch.ones(1, length, dtype=torch.long, device=self.device)
+        logits, past = self._forward(input_ids, position_ids, attention_mask, past)
+        if self.prefix_cache is not None:
+            sequence.prefix_nodes = self.prefix_cache.insert(sequence.prompt_ids, past, sequence.prefix_nodes)
+        return logits, past
+
+    def _merge(self, sequences: list[Sequence], past: Any, attention_mask: torch.Tensor) -> None:
+        """
+        将新序列的 KV 缓存左侧补齐后拼接到批次中
+        """
+        if self._past_key_values is None:
+            self._running = list(sequences)
+            self._past_key_values, self._attention_mask = past, attention_mask
+            return
+
+        old_length: int = self._attention_mask.shape[1]
+        new_length: int = attention_mask.shape[1]
+        target: int = max(old_length, new_length)
+        self._past_key_values = tuple(
+            tuple(
+                torch.cat(
+                    (
+                        _pad_left(old, self.kv_seq_dim, target - old_length),
+                        _pad_left(new, self.kv_seq_dim, target - new_length),
+                    ),
+                    dim=self.kv_batch_dim,
+                )
+                for old, new in zip(old_layer, new_layer)
+            )
+            for old_layer, new_layer in zip(self._past_key_values, past)
+        )
+        self._attention_mask = torch.cat(
+            (_pad_left(self._attention_mask, 1, target - old_length), _pad_left(attention_mask, 1, target - new_length))
+        )
+        self._running.extend(sequences)
+
+    def _step(self) -> None:
+        """
+        对批次内所有序列执行一个解码步骤
+        """
+        input_ids = torch.tensor([[sequence.generated[-1]] for sequence in self._running], device=self.device)
+        position_ids = torch.tensor([[sequence.length] for sequence in self._running], device=self.device)
+        self._attention_mask = torch.cat(
+            (self._attention_mask, self._attention_mask.new_ones(len(self._running), 1)), 1
+        )
+        logits, self._past_key_values = self._forward(
+            input_ids, position_ids, self._attention_mask, self._past_key_values
+        )
+        for sequence, token_id in zip(self._running, self._sample(logits, self._running)):
+            sequence.length += 1
+            self._emit(sequence, token_id)
+        self.steps += 1
+
+    def _sample(self, logits: torch.Tensor, sequences: list[Sequence]) -> list[int]:
+        """
+        按序列各自的采样参数采样
+        """
+        temperatures = torch.tensor([sequence.temperature for sequence in sequences], device=logits.device)
+        top_ps = torch.tensor([sequence.top_p for sequence in sequences], device=logits.device)
+        return sample_next_tokens(logits, temperatures, top_ps).tolist()
+
+    def _emit(self, sequence: Sequence, token_id: int) -> None:
+        """
+        记录并输出新生成的 token
+        """
+        sequence.generated.append(token_id)
+        sequence.outputs.put(token_id)
+        self.generated_tokens += 1
+
+    def _fail(self, sequences: list[Sequence], error: Exception) -> None:
+        """
+        将异常传递给序列的调用方并结束序列
+        """
+        for sequence in sequences:
+            sequence.outputs.put(error)
+            self._finish(sequence)
+
+    def _finish(self, sequence: Sequence) -> None:
+        """
+        结束序列并释放其引用的前缀缓存节点
+        """
+        if self.prefix_cache is not None:
+            self.prefix_cache.release(sequence.prefix_nodes)
+            sequence.prefix_nodes = []
+        sequence.outputs.put(_SEQUENCE_END)
+
+    def _retire(self) -> None:
+        """
+        移除已结束的序列，并裁掉所有序列都不再使用的左侧补齐部分
+        """
+        keep: list[int] = [i for i, sequence in enumerate(self._running) if not sequence.is_finished()]
+        if len(keep) == len(self._running):
+            return
+        for i, sequence in enumerate(self._running):
+            if i not in keep:
+                self._finish(sequence)
+        if not keep:
+            self._running, self._past_key_values, self._attention_mask = [], None, None
+            return
+
+        self._running = [self._running[i] for i in keep]
+        index = torch.tensor(keep, device=self.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        # 左侧所有序列都为补齐的列可以直接丢弃
+        start: int = attention_mask.shape[1] - max(sequence.length for sequence in self._running)
+        self._attention_mask = attention_mask[:, start:]
+        self._past_key_values = tuple(
+            tuple(
+                tensor.index_select(self.kv_batch_dim, index).narrow(
+                    self.kv_seq_dim, start, tensor.shape[self.kv_seq_dim] - start
+                )
+                for tensor in layer
+            )
+            for layer in self._past_key_values
+        )
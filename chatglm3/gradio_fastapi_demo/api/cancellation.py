@@ -0,0 +1,80 @@
+"""
+生成请求的取消：客户端断开、显式取消或同一会话发送新消息时尽快停止生成
+"""
+
+import threading
+
+import torch
+from transformers import StoppingCriteria
+
+from .session import DEFAULT_SESSION_ID
+
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """
+    取消事件被设置后，在下一个解码步骤停止生成
+    """
+
+    def __init__(self, cancel_event: threading.Event) -> None:
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class CancellationRegistry:
+    """
+    记录进行中的请求，按请求 ID 取消，同一会话的新请求会取消该会话仍在生成的旧请求
+
+    未指定会话 ID 的请求共用默认会话，彼此之间不会互相取消
+    """
+
+    def __init__(self) -> None:
+        self._events: dict[str, threading.Event] = {}
+        self._session_requests: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def start(self, request_id: str, session_id: str) -> threading.Event:
+        """
+        登记新请求
+
+        :param request_id: 请求 ID
+        :param session_id: 会话 ID
+        :return: 该请求的取消事件
+        """
+        event = threading.Event()
+        with self._lock:
+            self._events[request_id] = event
+            if session_id == DEFAULT_SESSION_ID:
+                return event
+            previous: str | None = self._session_requests.get(session_id)
+            if previous is not None and previous in self._events:
+                self._events[previous].set()
+            self._session_requests[session_id] = request_id
+        return event
+
+    def cancel(self, request_id: str) -> bool:
+        """
+        取消请求
+
+        :param request_id: 请求 ID
+        :return: 请求是否仍在进行中
+        """
+        with self._lock:
+            event: threading.Event | None = self._events.get(request_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def finish(self, request_id: str, session_id: str) -> None:
+        """
+        请求结束后移除登记
+
+        :param request_id: 请求 ID
+        :param session_id: 会话 ID
+        """
+        with self._lock:
+            self._events.pop(request_id, None)
+            if self._session_requests.get(session_id) == request_id:
+                del self._session_requests[session_id]
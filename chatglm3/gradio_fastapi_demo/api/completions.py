@@ -0,0 +1,120 @@
+"""
+对话补全的单个回复：增量解码、停止词截断与敏感词审核
+
+流式输出时，可能是停止词开头的文本暂缓输出，直到确定不构成停止词，因此输出的文本中不会出现停止词的任何部分
+"""
+
+import sys
+from pathlib import Path
+from typing import Any, Callable, Literal
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.detokenizer import IncrementalDetokenizer  # pylint: disable=C0413,C0411
+from common.moderation import StreamModerator  # pylint: disable=C0413,C0411
+
+# 结束原因，与 OpenAI 的取值相同：stop 为生成结束 token、遇到停止词或请求被取消，length 为达到 max_tokens 或
+# 最大长度，content_filter 为 stop 模式的审核出现敏感词
+FinishReason = Literal["stop", "length", "content_filter"]
+
+
+class PromptError(ValueError):
+    """
+    聊天记录不能构成合法的提示词，例如最后一条消息不是用户提问或超出最大长度
+    """
+
+
+class CompletionChoice:
+    """
+    单个回复的输出状态
+    """
+
+    def __init__(
+        self, decode: Callable[[list[int]], str], stop: list[str], moderator: StreamModerator | None = None
+    ) -> None:
+        """
+        :param decode: 将 token id 解码为文本的函数
+        :param stop: 停止词，回复在第一个出现的停止词之前截断
+        :param moderator: 流式审核器，为 None 时不审核
+        """
+        self.detokenizer = IncrementalDetokenizer(decode)
+        self.stop: list[str] = [word for word in stop if word]
+        self.moderator: StreamModerator | None = moderator
+        self.completion_tokens: int = 0
+        self.finish_reason: FinishReason | None = None
+        self.text: str = ""  # 已输出的文本
+        self._pending: str = ""  # 可能是停止词开头、暂缓输出的文本
+
+    def add(self, token_id: int) -> str:
+        """
+        追加一个生成的 token（不含结束 token），遇到停止词时结束回复
+
+        :param token_id: token id
+        :return: 可以输出的新增文本
+        """
+        self.completion_tokens += 1
+        delta: str = self.detokenizer.add(token_id)
+        if not delta:
+            return ""
+        text: str = self._pending + delta
+        positions: list[int] = [position for position in map(text.find, self.stop) if position >= 0]
+        if positions:
+            self._pending, self.finish_reason = "", "stop"
+            return self._output(text[: min(positions)], final=True)
+        held: int = self._held_length(text)
+        self._pending = text[len(text) - held :]
+        return self._output(text[: len(text) - held])
+
+    def finish(self, reason: FinishReason) -> str:
+        """
+        结束回复，已因停止词或审核结束时保留原有的结束原因
+
+        :param reason: 结束原因
+        :return: 暂缓输出的文本
+        """
+        if self.finish_reason is None:
+            self.finish_reason = reason
+        text, self._pending = self._pending, ""
+        return self._output(text, final=True)
+
+    def _held_length(self, text: str) -> int:
+        """
+        文本末尾可能是某个停止词开头的最长部分的长度
+        """
+        for length in range(min(len(text), max(map(len, self.stop), default=1) - 1), 0, -1):
+            suffix: str = text[-length:]
+            if any(word.startswith(suffix) for word in self.stop):
+                return length
+        return 0
+
+    def _output(self, text: str, final: bool = False) -> str:
+        """
+        审核并记录输出的文本
+        """
+        if self.moderator is not None:
+            text = self.moderator.feed(text)
+            if self.moderator.blocked:
+                self.finish_reason = "content_filter"
+            elif final:
+                text += self.moderator.flush()
+        self.text += text
+        return text
+
+
+class CompletionSteps:
+    """
+    判断对话补全的事件是否为新解码步骤的第一个输出，用于按解码步骤记录首 token 延迟与 token 间延迟
+
+    每个解码步骤按回复序号依次处理各个未结束的回复，因此回复序号不大于上一个 delta 的回复序号时说明进入了新的解码
+    步骤；finish 与 usage 事件以及同一步骤中其余回复的 delta 不计
+    """
+
+    def __init__(self) -> None:
+        self._last_index: int | None = None
+
+    def __call__(self, event: tuple[str, int | None, Any]) -> bool:
+        kind, index, _ = event
+        if kind != "delta":
+            return False
+        starts: bool = self._last_index is None or index <= self._last_index
+        self._last_index = index
+        return starts
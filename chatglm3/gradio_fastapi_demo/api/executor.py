@@ -0,0 +1,194 @@
+"""
+推理执行器，在独立的工作线程中运行阻塞的模型推理，避免阻塞 FastAPI 的事件循环
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
+
+_STREAM_END = object()  # 流式结果结束标记
+
+
+class QueueFullError(Exception):
+    """
+    请求队列已满
+    """
+
+
+class ExecutorClosedError(Exception):
+    """
+    执行器已关闭
+    """
+
+
+class InferenceExecutor:
+    """
+    推理执行器，由固定数量的工作线程从有界队列中依次取出推理任务执行
+    """
+
+    def __init__(self, num_workers: int = 1, max_queue_size: int = 32) -> None:
+        """
+        :param num_workers: 工作线程数量
+        :param max_queue_size: 等待中请求的最大数量，超出后拒绝新请求
+        """
+        self.num_workers: int = num_workers
+        self.max_queue_size: int = max_queue_size
+        self.submitted: int = 0
+        self.rejected: int = 0
+        self.completed: int = 0
+        self.running: int = 0
+        self.total_wait_time: float = 0.0  # 所有请求在队列中等待的总时间（秒）
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._closed: bool = False
+        self._stats_lock = threading.Lock()
+        self._workers: list[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"inference-worker-{i}", daemon=True) for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        当前排队等待的请求数量
+        """
+        return self._queue.qsize()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        执行器的排队统计信息
+        """
+        return {
+            "num_workers": self.num_workers,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self.queue_depth,
+            "running": self.running,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_wait_time": self.total_wait_time / self.completed if self.completed else 0.0,
+        }
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        在工作线程中执行阻塞函数并等待结果
+
+        :param fn: 阻塞函数
+        :param args: 函数参数
+        :return: 函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+
+        def job() -> None:
+            try:
+                result = fn(*args)
+            except Exception as e:  # pylint: disable=W0718
+                loop.call_soon_threadsafe(_set_future, future, None, e)
+            else:
+                loop.call_soon_threadsafe(_set_future, future, result, None)
+
+        self._submit(job)
+        return await future
+
+    def stream(self, fn: Callable[..., Iterator[Any]], *args: Any) -> AsyncIterator[Any]:
+        """
+        在工作线程中迭代阻塞的生成器，并以异步迭代器的形式返回结果
+
+        任务在调用时即入队，因此队列已满时会立刻抛出 QueueFullError，而不是等到开始迭代时
+
+        :param fn: 返回迭代器的阻塞函数
+        :param args: 函数参数
+        :return: 异步迭代器
+        """
+        loop = asyncio.get_running_loop()
+        results: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def job() -> None:
+            try:
+                iterator = fn(*args)
+                try:
+                    for item in iterator:
+                        if cancelled.is_set():  # 消费方已放弃，提前结束生成
+                            break
+                        loop.call_soon_threadsafe(results.put_nowait, item)
+                finally:
+                    close = getattr(iterator, "close", None)
+                    if close is not None:
+                        close()
+            except Exception as e:  # pylint: disable=W0718
+                loop.call_soon_threadsafe(results.put_nowait, e)
+            loop.call_soon_threadsafe(results.put_nowait, _STREAM_END)
+
+        self._submit(job)
+
+        async def iterate() -> AsyncIterator[Any]:
+            try:
+                while True:
+                    item = await results.get()
+                    if item is _STREAM_END:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                cancelled.set()
+
+        return iterate()
+
+    def shutdown(self) -> None:
+        """
+        关闭执行器，不再接受新请求，等待中的请求执行完毕后工作线程退出
+        """
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def _submit(self, job: Callable[[], None]) -> None:
+        """
+        将任务放入队列，队列已满时立即拒绝
+        """
+        if self._closed:
+            raise ExecutorClosedError("推理执行器已关闭")
+        try:
+            self._queue.put_nowait((time.perf_counter(), job))
+        except queue.Full as e:
+            with self._stats_lock:
+                self.rejected += 1
+            raise QueueFullError("推理请求队列已满") from e
+        with self._stats_lock:
+            self.submitted += 1
+
+    def _work(self) -> None:
+        """
+        工作线程主循环
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            enqueue_time, job = item
+            with self._stats_lock:
+                self.running += 1
+                self.total_wait_time += time.perf_counter() - enqueue_time
+            try:
+                job()
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+
+
+def _set_future(future: asyncio.Future, result: Any, exception: Exception | None) -> None:
+    """
+    在事件循环线程中设置 Future 的结果，Future 已被取消时忽略
+    """
+    if future.cancelled():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
@@ -0,0 +1,121 @@
+"""
+按会话保存 past_key_values，下一轮对话时直接复用，避免重新 prefill 整段聊天记录
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any
+
+
+def kv_nbytes(past_key_values: Any) -> int:
+    """
+    计算 past_key_values 占用的字节数
+
+    :param past_key_values: 每层 (key, value) 张量组成的元组
+    :return: 字节数
+    """
+    return sum(tensor.numel() * tensor.element_size() for layer in past_key_values for tensor in layer)
+
+
+def kv_length(past_key_values: Any, seq_dim: int = 0) -> int:
+    """
+    past_key_values 对应的 token 数量，ChatGLM3 的形状为 [seq_len, batch, heads, head_dim]
+
+    :param past_key_values: 每层 (key, value) 张量组成的元组
+    :param seq_dim: 序列长度所在维度，多数 HuggingFace 模型为 2
+    """
+    return past_key_values[0][0].shape[seq_dim]
+
+
+class KVCacheEntry:
+    """
+    单个会话缓存的 past_key_values
+    """
+
+    def __init__(self, digest: int, past_key_values: Any) -> None:
+        self.digest: int = digest  # 生成该缓存时聊天记录的摘要
+        self.past_key_values = past_key_values
+        self.nbytes: int = kv_nbytes(past_key_values)
+
+
+class KVCache:
+    """
+    会话级 KV 缓存，总大小超过字节预算时按 LRU 顺序淘汰
+    """
+
+    def __init__(self, max_bytes: int = 2 * 1024**3, kv_seq_dim: int = 0) -> None:
+        """
+        :param max_bytes: 缓存占用的最大字节数
+        :param kv_seq_dim: past_key_values 中序列长度所在维度
+        """
+        self.max_bytes: int = max_bytes
+        self.kv_seq_dim: int = kv_seq_dim
+        self.total_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.prefill_tokens_saved: int = 0  # 因复用缓存而省去 prefill 的 token 总数
+        self._entries: OrderedDict[str, KVCacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        缓存统计信息
+        """
+        return {
+            "sessions": len(self._entries),
+            "total_bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefill_tokens_saved": self.prefill_tokens_saved,
+        }
+
+    def take(self, session_id: str, digest: int) -> Any:
+        """
+        取出会话的缓存，取出后缓存由调用方持有，生成结束后再通过 put 放回
+
+        :param session_id: 会话 ID
+        :param digest: 当前聊天记录的摘要，与缓存时不一致说明聊天记录已改变，缓存作废
+        :return: past_key_values，不可用时返回 None
+        """
+        with self._lock:
+            entry: KVCacheEntry | None = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
+            if entry is None or entry.digest != digest:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.prefill_tokens_saved += kv_length(entry.past_key_values, self.kv_seq_dim)
+            return entry.past_key_values
+
+    def put(self, session_id: str, digest: int, past_key_values: Any) -> None:
+        """
+        保存会话的缓存，超出字节预算时淘汰最久未使用的缓存
+
+        :param session_id: 会话 ID
+        :param digest: 生成该缓存时聊天记录的摘要
+        :param past_key_values: 模型返回的 past_key_values
+        """
+        entry = KVCacheEntry(digest, past_key_values)
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old: KVCacheEntry | None = self._entries.pop(session_id, None)
+            if old is not None:
+                self.total_bytes -= old.nbytes
+            self._entries[session_id] = entry
+            self.total_bytes += entry.nbytes
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+
+    def remove(self, session_id: str) -> None:
+        """
+        删除会话的缓存
+
+        :param session_id: 会话 ID
+        """
+        with self._lock:
+            entry: KVCacheEntry | None = self._entries.pop(session_id, None)
+            if entry is not None:
+                self.total_bytes -= entry.nbytes
@@ -1,10 +1,13 @@
 """
 FastAPI 主文件，创建 API 对象
 """
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, applications
 from fastapi.openapi.docs import get_swagger_ui_html
 
-from .routers import api
+from .openai_api import openai_api
+from .routers import api, executor, model_factory, worker_pool
 
 
 # CDN
@@ -22,7 +25,32 @@ def swagger_monkey_patch(*args, **kwargs):
 
 applications.get_swagger_ui_html = swagger_monkey_patch
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """
+    服务启动后在后台加载模型（多副本模式下启动模型工作进程），不阻塞端口监听与健康检查；服务关闭时停止推理执行器
+    与工作进程
+    """
+    if worker_pool is not None:
+        worker_pool.start()
+    else:
+        model_factory.start_loading()
+    yield
+    if worker_pool is not None:
+        worker_pool.shutdown()
+    else:
+        executor.shutdown()
+
+
 # 创建 FastAPI 对象，并将 swagger 文档从默认 '/docs' 改为 '/'，关闭 redoc 文档
-app = FastAPI(title="ChatGLM3-6B FastAPI Demo", description="A ChatGLM3-6B Chat Server", docs_url="/", redoc_url=None)
+app = FastAPI(
+    title="ChatGLM3-6B FastAPI Demo",
+    description="A ChatGLM3-6B Chat Server",
+    docs_url="/",
+    redoc_url=None,
+    lifespan=lifespan,
+)
 
 app.include_router(router=api)
+app.include_router(router=openai_api)
@@ -0,0 +1,203 @@
+"""
+Prometheus 监控指标
+
+延迟与 token 数量在生成过程中记录，每个 token 只需一次直方图观测；缓存、会话与队列的状态在抓取 /metrics 时
+才读取，不增加推理路径的开销
+"""
+
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# 本服务的指标单独注册，不包含 prometheus_client 默认的进程与 GC 指标
+REGISTRY = CollectorRegistry()
+
+
+class ServingMetrics:
+    """
+    生成请求的延迟与 token 数量指标
+    """
+
+    def __init__(self, registry: CollectorRegistry = REGISTRY, namespace: str = "llm") -> None:
+        """
+        :param registry: 指标注册表
+        :param namespace: 指标名称前缀
+        """
+        self.time_to_first_token = Histogram(
+            "time_to_first_token_seconds",
+            "开始生成到返回第一个 token 的时间",
+            namespace=namespace,
+            registry=registry,
+            buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 30.0),
+        )
+        self.inter_token_latency = Histogram(
+            "inter_token_latency_seconds",
+            "相邻两个 token 之间的时间",
+            namespace=namespace,
+            registry=registry,
+            buckets=(0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0),
+        )
+        self.e2e_latency = Histogram(
+            "e2e_request_latency_seconds",
+            "完整生成一条回复的时间",
+            namespace=namespace,
+            registry=registry,
+            buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0),
+        )
+        self.history_tokens_dropped = Histogram(
+            "history_tokens_dropped",
+            "每个请求按 token 预算裁剪聊天记录时丢弃的 token 数量",
+            namespace=namespace,
+            registry=registry,
+            buckets=(0, 64, 256, 1024, 2048, 4096, 8192),
+        )
+        self.tokenization_seconds = Histogram(
+            "tokenization_seconds",
+            "每个请求的分词耗时，包括构建提示词与写入会话的消息",
+            namespace=namespace,
+            registry=registry,
+            buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+        )
+        self.prompt_tokens = Counter("prompt_tokens", "prefill 的提示词 token 数量", namespace=namespace, registry=registry)
+        self.completion_tokens = Counter("completion_tokens", "生成的 token 数量", namespace=namespace, registry=registry)
+        self.requests = Counter(
+            "generation_requests",
+            "结束的生成请求数量，按结果分为 completed、cancelled 与 error",
+            ["outcome"],
+            namespace=namespace,
+            registry=registry,
+        )
+        self.speculative_draft_tokens = Counter(
+            "speculative_draft_tokens", "投机解码提出的草稿 token 数量", namespace=namespace, registry=registry
+        )
+        self.speculative_accepted_tokens = Counter(
+            "speculative_accepted_tokens", "投机解码被接受的草稿 token 数量", namespace=namespace, registry=registry
+        )
+        self.speculative_steps = Counter("speculative_steps", "投机解码验证草稿的前向计算次数", namespace=namespace, registry=registry)
+        self.in_flight = Gauge("generation_requests_in_flight", "正在生成的请求数量", namespace=namespace, registry=registry)
+
+    def track(
+        self,
+        replies: Iterator[Any],
+        cancel_event: threading.Event | None = None,
+        starts_step: Callable[[Any], bool] | None = None,
+    ) -> Iterator[Any]:
+        """
+        转发模型逐步返回的回复，同时记录首 token 延迟、token 间延迟与端到端延迟
+
+        :param replies: 模型每个解码步骤返回的回复
+        :param cancel_event: 请求的取消事件，被设置时请求记为 cancelled
+        :param starts_step: 一个解码步骤返回多项时，判断某一项是否为新解码步骤的第一项，只有这些项记录延迟；
+            为 None 时每一项都是一个解码步骤
+        :return: 原样返回的回复
+        """
+        outcome: str = "error"
+        start: float = time.perf_counter()
+        last: float | None = None
+        self.in_flight.inc()
+        try:
+            for reply in replies:
+                if starts_step is None or starts_step(reply):
+                    now: float = time.perf_counter()
+                    if last is None:
+                        self.time_to_first_token.observe(now - start)
+                    else:
+                        self.inter_token_latency.observe(now - last)
+                    last = now
+                yield reply
+            if cancel_event is not None and cancel_event.is_set():
+                outcome = "cancelled"
+            else:
+                outcome = "completed"
+                self.e2e_latency.observe(time.perf_counter() - start)
+        except GeneratorExit:  # 客户端断开后回复流被关闭
+            outcome = "cancelled"
+            raise
+        finally:
+            self.in_flight.dec()
+            self.requests.labels(outcome).inc()
+
+    def count_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        累计一次生成的 token 数量
+
+        :param prompt_tokens: prefill 的提示词 token 数量
+        :param completion_tokens: 生成的 token 数量
+        """
+        self.prompt_tokens.inc(max(0, prompt_tokens))
+        self.completion_tokens.inc(max(0, completion_tokens))
+
+    def count_speculative(self, proposed: int, accepted: int, steps: int) -> None:
+        """
+        累计一次投机解码的草稿接受情况，接受率为 accepted / proposed
+
+        :param proposed: 提出的草稿 token 数量
+        :param accepted: 被接受的草稿 token 数量
+        :param steps: 验证草稿的前向计算次数
+        """
+        self.speculative_draft_tokens.inc(proposed)
+        self.speculative_accepted_tokens.inc(accepted)
+        self.speculative_steps.inc(steps)
+
+
+class ServerStatsCollector(Collector):
+    """
+    抓取时读取模型缓存、会话存储与推理队列的统计信息
+    """
+
+    def __init__(self, get_model: Callable[[], Any], executor: Any, namespace: str = "llm") -> None:
+        """
+        :param get_model: 返回当前模型的函数，模型尚未加载时返回 None
+        :param executor: 推理执行器，多副本模式下为 None，不报告队列指标
+        :param namespace: 指标名称前缀
+        """
+        self.get_model = get_model
+        self.executor = executor
+        self.namespace: str = namespace
+
+    def collect(self) -> Iterator[GaugeMetricFamily | CounterMetricFamily]:
+        def gauge(name: str, documentation: str, value: float) -> GaugeMetricFamily:
+            return GaugeMetricFamily(f"{self.namespace}_{name}", documentation, value=value)
+
+        def counter(name: str, documentation: str, value: float) -> CounterMetricFamily:
+            return CounterMetricFamily(f"{self.namespace}_{name}", documentation, value=value)
+
+        if self.executor is not None:
+            queue: dict[str, Any] = self.executor.stats()
+            yield gauge("queue_depth", "排队等待的请求数量", queue["queue_depth"])
+            yield gauge("queue_running", "工作线程中正在执行的请求数量", queue["running"])
+            yield counter("queue_rejected", "队列已满被拒绝的请求数量", queue["rejected"])
+
+        model = self.get_model()
+        if model is None:
+            return
+        conversations: dict[str, int] = model.conversations.stats()
+        yield gauge("conversations", "保存的会话数量", conversations["sessions"])
+        yield gauge("conversation_messages", "所有会话保存的消息数量", conversations["messages"])
+        yield gauge("conversation_chars", "所有会话保存的消息字符数", conversations["chars"])
+        yield gauge("conversation_tokens", "所有会话保存的消息 token 数", conversations["tokens"])
+
+        stats: dict[str, Any] = model.cache_stats()
+        kv: dict[str, Any] = stats["kv_cache"]
+        yield gauge("kv_cache_bytes", "会话 KV 缓存占用的字节数", kv["total_bytes"])
+        yield gauge("kv_cache_sessions", "持有 KV 缓存的会话数量", kv["sessions"])
+        yield counter("kv_cache_hits", "会话 KV 缓存命中次数", kv["hits"])
+        yield counter("kv_cache_misses", "会话 KV 缓存未命中次数", kv["misses"])
+        yield counter("kv_cache_prefill_tokens_saved", "复用会话 KV 缓存省去 prefill 的 token 数量", kv["prefill_tokens_saved"])
+        if stats["prefix_cache"] is not None:
+            prefix: dict[str, Any] = stats["prefix_cache"]
+            yield gauge("prefix_cache_bytes", "前缀 KV 缓存占用的字节数", prefix["total_bytes"])
+            yield counter("prefix_cache_cached_tokens", "命中前缀缓存的提示词 token 数量", prefix["cached_tokens"])
+        if stats["response_cache"] is not None:
+            response: dict[str, Any] = stats["response_cache"]
+            yield gauge("response_cache_entries", "内存中缓存的回复数量", response["entries"])
+            yield counter("response_cache_hits", "回复缓存命中次数（含磁盘）", response["hits"])
+            yield counter("response_cache_misses", "回复缓存未命中次数", response["misses"])
+
+
+# 默认模型共用的指标
+METRICS = ServingMetrics()
@@ -2,10 +2,66 @@
 ChatGLM3-6B Model
 """
 
+import itertools
+import logging
+import os
+import sys
 import threading
-from typing import Any
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, Literal
 
-from modelscope import AutoModel, AutoTokenizer, snapshot_download
+from transformers import StoppingCriteriaList
+
+from .batching import ContinuousBatchingEngine
+from .cancellation import CancelStoppingCriteria
+from .completions import CompletionChoice, CompletionSteps, PromptError
+from .kv_cache import KVCache
+from .metrics import METRICS, ServingMetrics
+from .prefix_cache import PrefixCache
+from .response_cache import ResponseCache
+from .session import Conversation, ConversationStore
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import ChatGLM3Backend, ModelBackend, backend_name, create_backend  # pylint: disable=C0413,C0411
+from common.detokenizer import IncrementalDetokenizer  # pylint: disable=C0413,C0411
+from common.moderation import (  # pylint: disable=C0413,C0411
+    BLOCKED_NOTICE,
+    AhoCorasick,
+    StreamModerator,
+    moderate_replies,
+)
+from common.speculative import (  # pylint: disable=C0413,C0411
+    DraftModelDrafter,
+    Drafter,
+    PromptLookupDrafter,
+)
+
+logger = logging.getLogger(__name__)
+
+# 预热时依次生成的提示词长度（token）与每次生成的 token 数量，覆盖不同长度的 prefill 与解码
+WARMUP_PROMPT_LENGTHS: tuple[int, ...] = (16, 512, 2048)
+WARMUP_NEW_TOKENS: int = 8
+WARMUP_TEXT: str = "请简要介绍一下大语言模型的推理过程。"
+# 聊天记录超出 token 预算时裁剪到预算的比例，留出余量使之后几轮对话不必再裁剪
+HISTORY_TRIM_RATIO: float = 0.75
+# 大于 0 时逐请求生成使用从聊天记录中查找草稿的投机解码，为每轮最多验证的草稿 token 数量
+SPECULATIVE_TOKENS: int = int(os.environ.get("LLM_SPECULATIVE_TOKENS", "0"))
+# 工厂加载的 ChatGLM3 使用 CPU 推理（LLM_CPU=1）或 4-bit 量化（LLM_QUANTIZE=1），默认 GPU FP16
+IS_CPU: bool = os.environ.get("LLM_CPU", "").lower() in ("1", "true")
+IS_QUANTIZE: bool = os.environ.get("LLM_QUANTIZE", "").lower() in ("1", "true")
+# 工厂加载的模型的连续批处理大小，大于 1 时多个请求经由连续批处理引擎共享解码步骤
+MAX_BATCH_SIZE: int = int(os.environ.get("LLM_MAX_BATCH_SIZE", "1"))
+# 大于 0 时启用跨会话共享的前缀 KV 缓存，为其字节预算；前缀缓存由连续批处理引擎维护，启用后即使批处理大小为 1
+# 也经由引擎生成，不再使用会话 KV 缓存与投机解码
+PREFIX_CACHE_BYTES: int = int(os.environ.get("LLM_PREFIX_CACHE_BYTES", "0"))
+# 敏感词文件（每行一个敏感词），设置后审核所有回复；回复出现敏感词时停止生成（stop）或替换为掩码（redact）
+BLOCKLIST_FILE: str | None = os.environ.get("LLM_BLOCKLIST_FILE") or None
+MODERATION_MODE: str = os.environ.get("LLM_MODERATION_MODE", "redact")
+# 确定性请求的回复缓存的有效时间（秒），默认开启、有效期 24 小时，为 0 时不缓存回复；设置 SQLite 文件路径后
+# 缓存写入磁盘，重启后依旧有效
+RESPONSE_CACHE_TTL: float = float(os.environ.get("LLM_RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_PATH: str | None = os.environ.get("LLM_RESPONSE_CACHE_PATH") or None
 
 
 class ChatGLM3:
@@ -13,117 +69,746 @@ class ChatGLM3:
     ChatGLM3-6B 对话模型
     """
 
-    def __init__(self, is_quantize: bool = False, is_cpu: bool = False) -> None:
-        # TODO: store different histories in db based on different web user requests
-        self.history: list[dict[str, Any]] = []
-
-        model_dir: str = snapshot_download("ZhipuAI/chatglm3-6b", revision="master", local_files_only=True)
+    def __init__(
+        self,
+        is_quantize: bool = False,
+        is_cpu: bool = False,
+        kv_cache_bytes: int = 2 * 1024**3,
+        max_batch_size: int = 1,
+        max_length: int = 8192,
+        max_history_tokens: int | None = 6144,
+        prefix_cache_bytes: int = 0,
+        response_cache: ResponseCache | None = None,
+        blocklist: AhoCorasick | None = None,
+        moderation_mode: Literal["stop", "redact"] = "redact",
+        backend: ModelBackend | None = None,
+        metrics: ServingMetrics | None = None,
+        speculative_tokens: int = 0,
+        draft_backend: ModelBackend | None = None,
+    ) -> None:
+        """
+        :param is_quantize: 是否 4-bit 量化（未传入 backend 时有效）
+        :param is_cpu: 是否使用 CPU 推理（未传入 backend 时有效）
+        :param kv_cache_bytes: 会话 KV 缓存的字节预算
+        :param max_batch_size: 大于 1 时启用连续批处理，多个请求共享解码步骤
+        :param max_length: 提示词与回复的最大总长度
+        :param max_history_tokens: 每个会话聊天记录的 token 预算，超出时丢弃中间的对话，为 None 时不裁剪
+        :param prefix_cache_bytes: 大于 0 时启用跨会话共享的前缀 KV 缓存，前缀缓存由连续批处理引擎维护，启用后即使
+            max_batch_size 为 1 也经由引擎生成
+        :param response_cache: 确定性请求的回复缓存，为 None 时不缓存
+        :param blocklist: 敏感词自动机，为 None 时不审核回复
+        :param moderation_mode: 回复出现敏感词时停止生成（stop）或替换为掩码（redact）
+        :param backend: 模型后端，为 None 时使用 ChatGLM3，未加载时在这里加载
+        :param metrics: 延迟与 token 数量的监控指标，为 None 时不记录
+        :param speculative_tokens: 大于 0 时逐请求生成（未启用连续批处理）使用投机解码，每轮最多验证的草稿 token 数量
+        :param draft_backend: 投机解码的草稿模型（须与 backend 共享词表），为 None 时从聊天记录中查找草稿
+        """
+        self.max_batch_size: int = max_batch_size
+        self.max_length: int = max_length
+        self.max_history_tokens: int | None = max_history_tokens
+        self.backend: ModelBackend = backend or ChatGLM3Backend(is_quantize, is_cpu)
+        if not self.backend.loaded:
+            self.backend.load()
+        # 每个会话上一轮对话结束时的 past_key_values，下一轮只需 prefill 新的提问
+        self.kv_cache = KVCache(max_bytes=kv_cache_bytes, kv_seq_dim=self.backend.kv_seq_dim)
+        self.response_cache: ResponseCache | None = response_cache
+        self.blocklist: AhoCorasick | None = blocklist
+        self.moderation_mode: Literal["stop", "redact"] = moderation_mode
+        self.metrics: ServingMetrics | None = metrics
+        self.speculative_tokens: int = speculative_tokens
+        self.draft_backend: ModelBackend | None = draft_backend
+        if self.draft_backend is not None and not self.draft_backend.loaded:
+            self.draft_backend.load()
+        # 按会话 ID 分别保存不同用户的聊天记录
+        # 每条消息的 token id 在追加时计算一次，用于拼接提示词与按 token 预算裁剪聊天记录
+        self.conversations = ConversationStore(
+            on_evict=self.kv_cache.remove, tokenize_message=self.backend.message_tokens
+        )
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
-        if is_quantize:
-            # 模型 4-bit 量化，减少显存压力，6GB 显存即可
-            self.model = AutoModel.from_pretrained(model_dir, trust_remote_code=True).quantize(4).cuda()
-        elif is_cpu:
-            # CPU 推理，要求 32GB 内存空间
-            self.model = AutoModel.from_pretrained(model_dir, trust_remote_code=True).float()
-        else:
-            # GPU 推理，需要 13GB 显存
-            self.model = AutoModel.from_pretrained(model_dir, trust_remote_code=True).cuda()
-        self.model.eval()
+        self.prefix_cache: PrefixCache | None = None
+        if prefix_cache_bytes > 0:
+            self.prefix_cache = PrefixCache(max_bytes=prefix_cache_bytes, kv_seq_dim=self.backend.kv_seq_dim)
+        self.engine: ContinuousBatchingEngine | None = None
+        if max_batch_size > 1 or self.prefix_cache is not None:
+            self.engine = ContinuousBatchingEngine(
+                self.backend.model,
+                max_batch_size=max_batch_size,
+                kv_seq_dim=self.backend.kv_seq_dim,
+                kv_batch_dim=self.backend.kv_batch_dim,
+                prefix_cache=self.prefix_cache,
+            )
+        self.eos_token_ids: list[int] = self.backend.eos_token_ids
 
-    def format_chat_history(self, chat_history: list[Any]) -> str:
+    @staticmethod
+    def format_chat_history(conversation: Conversation, chat_history: list[Any]) -> str:
         """
         将 Gradio 聊天记录格式转换为 ChatGLM 聊天记录格式
 
+        :param conversation: 当前会话
         :param chat_history: Gradio 格式的聊天记录
         :return: 当前最新的用户提问内容
         """
-        if not self.history:  # ChatGLM3 格式的聊天记录
+        if not conversation.messages:  # ChatGLM3 格式的聊天记录
             for idx, (user_msg, model_msg) in enumerate(chat_history):
                 if idx == len(chat_history) - 1 and not model_msg:
                     user_question: str = user_msg  # 用户最新的提问
                     break
                 if user_msg:
-                    self.history.append({"role": "user", "content": user_msg})
+                    conversation.append({"role": "user", "content": user_msg})
                 if model_msg:
-                    self.history.append({"role": "assistant", "content": model_msg})
+                    conversation.append({"role": "assistant", "content": model_msg})
         else:
             user_question = chat_history[-1][0]
         return user_question
 
-    def chat_reply(self, chat_history: list[Any], top_p: float, temperature: float):
+    def chat_reply(
+        self,
+        session_id: str,
+        chat_history: list[Any],
+        top_p: float,
+        temperature: float,
+        cancel_event: threading.Event | None = None,
+    ):
         """
         完整返回模型的单条回复
 
+        :param session_id: 会话 ID
         :param chat_history: Gradio 格式的聊天记录
         :param top_p: top p 参数
         :param temperature: temperature 参数
+        :param cancel_event: 取消事件，被设置后在下一个解码步骤停止生成
         :return: LLM 单条回复
         """
-        user_question: str = self.format_chat_history(chat_history)
-
-        reply, self.history = self.model.chat(
-            self.tokenizer,
-            user_question,
-            history=self.history,
-            top_p=top_p,
-            temperature=temperature,
-        )
+        # 复用流式生成以便同样利用会话的 KV 缓存
+        reply: str = ""
+        for reply in self.stream_chat_reply(session_id, chat_history, top_p, temperature, cancel_event):
+            pass
         return reply
 
-    def stream_chat_reply(self, chat_history: list[Any], top_p: float, temperature: float):
+    def stream_chat_reply(
+        self,
+        session_id: str,
+        chat_history: list[Any],
+        top_p: float,
+        temperature: float,
+        cancel_event: threading.Event | None = None,
+    ):
         """
         以流的形式返回模型单条回复
 
+        :param session_id: 会话 ID
+        :param chat_history: Gradio 格式的聊天记录
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param cancel_event: 取消事件，被设置后在下一个解码步骤停止生成
+        :return: LLM 单条回复
+        """
+        replies = self.generate_reply(session_id, chat_history, top_p, temperature, cancel_event)
+        if self.blocklist is not None:
+            # 只审核新增的文本，stop 模式下出现敏感词时关闭 replies 以停止生成
+            replies = moderate_replies(replies, self.blocklist, self.moderation_mode, BLOCKED_NOTICE)
+        yield from replies
+
+    def generate_reply(
+        self,
+        session_id: str,
+        chat_history: list[Any],
+        top_p: float,
+        temperature: float,
+        cancel_event: threading.Event | None = None,
+    ):
+        """
+        生成未经审核的单条流式回复，确定性请求优先使用回复缓存
+
+        :param session_id: 会话 ID
         :param chat_history: Gradio 格式的聊天记录
         :param top_p: top p 参数
         :param temperature: temperature 参数
+        :param cancel_event: 取消事件，被设置后在下一个解码步骤停止生成
+        :return: LLM 单条回复
+        """
+        cancel_event = cancel_event or threading.Event()
+        conversation: Conversation = self.conversations.get(session_id)
+        # 同一会话的请求依次生成，并发的请求会交错读写聊天记录；等待的请求在生成器开始迭代时才加锁
+        with conversation.lock:
+            tokenize_seconds: float = conversation.tokenize_seconds
+            try:
+                user_question: str = self.format_chat_history(conversation, chat_history)
+                self.trim_history(conversation)
+
+                cache_key: str | None = None
+                if self.response_cache is not None and self.response_cache.is_cacheable(temperature):
+                    cache_key = self.response_cache.make_key(
+                        self.backend.model_id, conversation.messages, user_question, top_p, temperature
+                    )
+                    cached_reply: str | None = self.response_cache.get(cache_key)
+                    if cached_reply is not None:
+                        yield from self.replay_reply(conversation, user_question, cached_reply)
+                        return
+
+                if self.engine is not None:
+                    generation = self.batched_stream_chat(conversation, user_question, top_p, temperature, cancel_event)
+                else:
+                    generation = self.session_stream_chat(conversation, user_question, top_p, temperature, cancel_event)
+                replies = generation if self.metrics is None else self.metrics.track(generation, cancel_event)
+                reply: str = ""
+                try:
+                    for reply in replies:
+                        # list 不可迭代，在 FastAPI 的 StreamingResponse 中会报错，因此只返回 LLM 回复字符串
+                        # yield reply + "\n"  # requests: response.iter_lines
+                        yield reply  # requests: response.iter_content
+                finally:
+                    # 提前关闭时也在释放会话锁之前结束生成，并将已生成的部分写入聊天记录
+                    replies.close()
+                    generation.close()
+                if cache_key is not None and not cancel_event.is_set():  # 被取消的回复不完整，不缓存
+                    self.response_cache.put(cache_key, reply)
+            finally:
+                # 本次请求的分词耗时：重建的聊天记录、新的提问、拼接提示词与写入会话的回复
+                if self.metrics is not None:
+                    self.metrics.tokenization_seconds.observe(conversation.tokenize_seconds - tokenize_seconds)
+
+    def trim_history(self, conversation: Conversation) -> int:
+        """
+        按 token 预算裁剪会话的聊天记录，并记录本次请求丢弃的 token 数量
+
+        :param conversation: 当前会话
+        :return: 丢弃的 token 数量
+        """
+        if self.max_history_tokens is None:
+            return 0
+        dropped: int = conversation.trim(self.max_history_tokens, int(self.max_history_tokens * HISTORY_TRIM_RATIO))
+        if dropped:
+            logger.info(
+                "会话 %s 的聊天记录超出 %d token，丢弃 %d token",
+                conversation.session_id,
+                self.max_history_tokens,
+                dropped,
+            )
+        if self.metrics is not None:
+            self.metrics.history_tokens_dropped.observe(dropped)
+        return dropped
+
+    def build_prompt(self, conversation: Conversation, user_question: str, continuation: bool = False) -> list[int]:
+        """
+        构建提示词 token id，后端支持时拼接会话中每条消息已缓存的 token id，只对用户最新的提问分词
+
+        :param conversation: 当前会话
+        :param user_question: 用户最新的提问
+        :param continuation: 是否接在会话上一轮的 KV 缓存之后，此时只需要新的提问
+        :return: 提示词 token id
+        """
+        start: float = time.perf_counter()
+        tokenize_seconds: float = conversation.tokenize_seconds
+        if self.backend.incremental_prompt:
+            conversation.tokenize_new_messages()
+            # 提问之后由模型或 batched_stream_chat 追加到会话，预先分词的结果届时直接复用
+            question_ids = conversation.prepare({"role": "user", "content": user_question})
+            history_ids = [] if continuation else conversation.message_ids
+            input_ids: list[int] = self.backend.build_prompt(
+                itertools.chain(history_ids, [question_ids]), continuation=continuation
+            )
+        elif continuation:
+            input_ids = self.backend.tokenize(user_question, [], continuation=True)
+        else:
+            input_ids = self.backend.tokenize(user_question, conversation.messages)
+        # 以整个构建过程的耗时代替其中各条消息分词的耗时，包含拼接的开销
+        conversation.tokenize_seconds = tokenize_seconds + time.perf_counter() - start
+        return input_ids
+
+    def session_stream_chat(
+        self,
+        conversation: Conversation,
+        user_question: str,
+        top_p: float,
+        temperature: float,
+        cancel_event: threading.Event,
+    ):
+        """
+        通过模型后端的流式对话生成回复，并复用会话上一轮的 KV 缓存
+
+        :param conversation: 当前会话
+        :param user_question: 用户最新的提问
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param cancel_event: 取消事件，被设置后在下一个解码步骤停止生成
+        :return: LLM 单条回复
+        """
+        history: list[dict[str, Any]] = conversation.messages
+        # 聊天记录与上一轮结束时一致才能复用 KV 缓存
+        past_key_values = self.kv_cache.take(conversation.session_id, conversation.digest)
+        input_ids: list[int] = self.build_prompt(conversation, user_question, continuation=past_key_values is not None)
+        drafter: Drafter | None = self.make_drafter(conversation, continuation=past_key_values is not None)
+        new_past_key_values = None
+        try:
+            for reply, history, new_past_key_values in self.backend.stream(
+                user_question,
+                conversation.messages,
+                top_p=top_p,
+                temperature=temperature,
+                past_key_values=past_key_values,
+                max_length=self.max_length,
+                stopping_criteria=StoppingCriteriaList([CancelStoppingCriteria(cancel_event)]),
+                input_ids=input_ids,
+                drafter=drafter,
+            ):
+                yield reply
+        finally:
+            # 客户端中途断开时也保存已生成的部分，避免聊天记录中只有用户提问
+            conversation.commit(history)
+            if drafter is not None and self.metrics is not None:
+                self.metrics.count_speculative(drafter.proposed, drafter.accepted, drafter.steps)
+            if new_past_key_values is not None:
+                self.kv_cache.put(conversation.session_id, conversation.digest, new_past_key_values)
+                if self.metrics is not None:
+                    # 返回的 KV 缓存恰好包含本轮 prefill 的提示词与已返回的回复的 token
+                    past_length: int = self.backend.kv_length(past_key_values)
+                    completion_tokens: int = self.backend.kv_length(new_past_key_values) - past_length - len(input_ids)
+                    self.metrics.count_tokens(len(input_ids), completion_tokens)
+
+    def make_drafter(self, conversation: Conversation, continuation: bool) -> Drafter | None:
+        """
+        创建本次生成的投机解码草稿器，未启用投机解码时返回 None
+
+        :param conversation: 当前会话
+        :param continuation: 是否接在会话上一轮的 KV 缓存之后，此时提示词只包含新的提问，之前的聊天记录作为草稿器的上下文
+        :return: 草稿器
+        """
+        if self.speculative_tokens <= 0:
+            return None
+        context_ids: list[int] = []
+        if continuation:
+            conversation.tokenize_new_messages()
+            context_ids = list(itertools.chain.from_iterable(conversation.message_ids))
+        if self.draft_backend is not None:
+            return DraftModelDrafter(self.draft_backend, self.speculative_tokens, context_ids)
+        return PromptLookupDrafter(self.speculative_tokens, context_ids=context_ids)
+
+    def replay_reply(self, conversation: Conversation, user_question: str, reply: str, chunk_size: int = 16):
+        """
+        以流的形式重放缓存的回复，并与正常生成一样写入聊天记录
+
+        :param conversation: 当前会话
+        :param user_question: 用户最新的提问
+        :param reply: 缓存的回复
+        :param chunk_size: 每次新增的字符数量
         :return: LLM 单条回复
         """
-        user_question: str = self.format_chat_history(chat_history)
-
-        past_key_values = None
-        for reply, self.history, past_key_values in self.model.stream_chat(
-            self.tokenizer,
-            user_question,
-            history=self.history,
-            top_p=top_p,
-            temperature=temperature,
-            past_key_values=past_key_values,
-            return_past_key_values=True,
+        conversation.append({"role": "user", "content": user_question})
+        conversation.append({"role": "assistant", "metadata": "", "content": reply})
+        for end in range(chunk_size, len(reply) + chunk_size, chunk_size):
+            yield reply[:end]
+
+    def batched_stream_chat(
+        self,
+        conversation: Conversation,
+        user_question: str,
+        top_p: float,
+        temperature: float,
+        cancel_event: threading.Event,
+    ):
+        """
+        通过连续批处理引擎生成回复，与模型后端的流式对话相同地增量解码并后处理模型输出
+
+        :param conversation: 当前会话
+        :param user_question: 用户最新的提问
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param cancel_event: 取消事件，被设置后引擎在下一个解码步骤移除该序列
+        :return: LLM 单条回复
+        """
+        prompt_ids: list[int] = self.build_prompt(conversation, user_question)
+        conversation.append({"role": "user", "content": user_question})
+
+        # 追加了回复的聊天记录只构建一次，之后每步只替换末尾的助手消息
+        history: list[dict[str, Any]] = list(conversation.messages)
+        output_ids: list[int] = []
+        detokenizer = IncrementalDetokenizer(self.backend.decode)
+        sequence = self.engine.submit(
+            prompt_ids, top_p, temperature, self.max_length - len(prompt_ids), self.eos_token_ids, cancel_event
+        )
+        try:
+            for token_id in sequence:
+                if token_id in self.eos_token_ids:
+                    break
+                output_ids.append(token_id)
+                if detokenizer.add(token_id):
+                    reply, history[len(conversation.messages) :] = self.backend.response_messages(
+                        detokenizer.text, conversation.messages
+                    )
+                    yield reply
+        finally:
+            sequence.cancel()
+            conversation.commit(history)
+            if self.metrics is not None:
+                self.metrics.count_tokens(len(prompt_ids), len(output_ids))
+
+    def completion_prompt(self, messages: list[dict[str, Any]]) -> list[int]:
+        """
+        由完整的 ChatGLM3 格式聊天记录构建提示词 token id，最后一条消息为用户提问
+
+        :param messages: 聊天记录
+        :return: 提示词 token id
+        :raises PromptError: 最后一条消息不是用户提问，或提示词超出最大长度
+        """
+        if not messages or messages[-1]["role"] != "user":
+            raise PromptError("最后一条消息必须是用户提问")
+        prompt_ids: list[int] = self.backend.tokenize_messages(messages)
+        if len(prompt_ids) >= self.max_length:
+            raise PromptError(f"提示词的长度 {len(prompt_ids)} 超出最大长度 {self.max_length}")
+        return prompt_ids
+
+    def stream_complete(
+        self,
+        messages: list[dict[str, Any]],
+        n: int,
+        top_p: float,
+        temperature: float,
+        max_tokens: int | None = None,
+        stop: list[str] | None = None,
+        cancel_event: threading.Event | None = None,
+    ) -> Iterator[tuple[str, int | None, Any]]:
+        """
+        无状态的对话补全，不读写会话与回复缓存：对同一提示词生成 n 个回复，只 prefill 一次，各回复在同一批次中解码
+
+        :param messages: ChatGLM3 格式的完整聊天记录，最后一条消息为用户提问
+        :param n: 回复数量
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param max_tokens: 每个回复最多生成的 token 数量，为 None 时只受最大长度限制
+        :param stop: 停止词，回复在第一个出现的停止词之前截断
+        :param cancel_event: 取消事件，被设置后所有回复在下一个解码步骤停止生成
+        :return: ("delta", 回复序号, 新增文本)、("finish", 回复序号, 结束原因)，最后为 ("usage", None, 用量)
+        :raises PromptError: 提示词不合法，在开始生成前抛出
+        """
+        prompt_ids: list[int] = self.completion_prompt(messages)
+        events = self._generate_completion(
+            prompt_ids, n, top_p, temperature, max_tokens, stop or [], cancel_event or threading.Event()
+        )
+        if self.metrics is not None:
+            events = self.metrics.track(events, cancel_event, CompletionSteps())
+        return events
+
+    def _generate_completion(
+        self,
+        prompt_ids: list[int],
+        n: int,
+        top_p: float,
+        temperature: float,
+        max_tokens: int | None,
+        stop: list[str],
+        cancel_event: threading.Event,
+    ) -> Iterator[tuple[str, int | None, Any]]:
+        """
+        生成对话补全的事件流，参数见 stream_complete
+        """
+        max_new_tokens: int = self.max_length - len(prompt_ids)
+        if max_tokens is not None:
+            max_new_tokens = min(max_new_tokens, max_tokens)
+        choices: list[CompletionChoice] = [
+            CompletionChoice(
+                self.backend.decode,
+                stop,
+                None if self.blocklist is None else StreamModerator(self.blocklist, self.moderation_mode),
+            )
+            for _ in range(n)
+        ]
+        # 每个回复各自的取消事件，回复因停止词结束或请求被取消时设置
+        cancel_events: list[threading.Event] = [threading.Event() for _ in range(n)]
+        eos_token_ids: list[int] = self.eos_token_ids
+        try:
+            for index, token_id in self._choice_tokens(prompt_ids, top_p, temperature, max_new_tokens, cancel_events):
+                choice: CompletionChoice = choices[index]
+                if choice.finish_reason is not None:
+                    continue
+                if token_id in eos_token_ids:
+                    text: str = choice.finish("stop")
+                else:
+                    text = choice.add(token_id)
+                    if choice.completion_tokens >= max_new_tokens:
+                        text += choice.finish("length")
+                if text:
+                    yield "delta", index, text
+                if choice.finish_reason is not None:
+                    cancel_events[index].set()
+                    yield "finish", index, choice.finish_reason
+                if cancel_event.is_set():
+                    for event in cancel_events:
+                        event.set()
+            for index, choice in enumerate(choices):
+                if choice.finish_reason is None:
+                    text = choice.finish("stop" if cancel_event.is_set() else "length")
+                    if text:
+                        yield "delta", index, text
+                    yield "finish", index, choice.finish_reason
+            completion_tokens: int = sum(choice.completion_tokens for choice in choices)
+            yield "usage", None, {
+                "prompt_tokens": len(prompt_ids),
+                "completion_tokens": completion_tokens,
+                "total_tokens": len(prompt_ids) + completion_tokens,
+            }
+        finally:
+            for event in cancel_events:
+                event.set()
+            if self.metrics is not None:
+                self.metrics.count_tokens(len(prompt_ids), sum(choice.completion_tokens for choice in choices))
+
+    def _choice_tokens(
+        self,
+        prompt_ids: list[int],
+        top_p: float,
+        temperature: float,
+        max_new_tokens: int,
+        cancel_events: list[threading.Event],
+    ) -> Iterator[tuple[int, int]]:
+        """
+        对同一提示词生成多个回复，启用连续批处理时经由引擎与其它请求共享解码步骤，否则由模型后端单独批量解码
+
+        :return: (回复序号, token id)，包含结束 token
+        """
+        if self.engine is None:
+            yield from self.backend.stream_choices(prompt_ids, top_p, temperature, max_new_tokens, cancel_events)
+            return
+        sequences = self.engine.submit_group(
+            prompt_ids, top_p, temperature, max_new_tokens, self.eos_token_ids, cancel_events
+        )
+        # 引擎每个解码步骤为组内所有未结束的序列各生成一个 token，因此可以依次轮流读取
+        iterators: list[Iterator[int]] = [iter(sequence) for sequence in sequences]
+        active: list[int] = list(range(len(sequences)))
+        try:
+            while active:
+                for index in list(active):
+                    token_id: int | None = next(iterators[index], None)
+                    if token_id is None or cancel_events[index].is_set():
+                        active.remove(index)
+                    if token_id is not None:
+                        yield index, token_id
+        finally:
+            for sequence in sequences:
+                sequence.cancel()
+
+    def complete(
+        self,
+        messages: list[dict[str, Any]],
+        n: int,
+        top_p: float,
+        temperature: float,
+        max_tokens: int | None = None,
+        stop: list[str] | None = None,
+        cancel_event: threading.Event | None = None,
+    ) -> dict[str, Any]:
+        """
+        完整返回对话补全的所有回复，参数见 stream_complete
+
+        :return: {"choices": [{"index", "text", "finish_reason"}], "usage": 用量}
+        """
+        texts: list[str] = [""] * n
+        finish_reasons: list[str | None] = [None] * n
+        usage: dict[str, int] = {}
+        for kind, index, payload in self.stream_complete(
+            messages, n, top_p, temperature, max_tokens, stop, cancel_event
         ):
-            # list 不可迭代，在 FastAPI 的 StreamingResponse 中会报错，因此只返回 LLM 回复字符串
-            # yield reply + "\n"  # requests: response.iter_lines
-            yield reply  # requests: response.iter_content
+            if kind == "delta":
+                texts[index] += payload
+            elif kind == "finish":
+                finish_reasons[index] = payload
+            else:
+                usage = payload
+        return {
+            "choices": [
+                {"index": index, "text": text, "finish_reason": finish_reason}
+                for index, (text, finish_reason) in enumerate(zip(texts, finish_reasons))
+            ],
+            "usage": usage,
+        }
+
+    def cache_stats(self) -> dict[str, Any]:
+        """
+        KV 缓存、前缀缓存与回复缓存的统计信息
+        """
+        return {
+            "kv_cache": self.kv_cache.stats(),
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+        }
 
-    def clear_history(self) -> bool:
+    def warm_up(
+        self,
+        prompt_lengths: tuple[int, ...] = WARMUP_PROMPT_LENGTHS,
+        new_tokens: int = WARMUP_NEW_TOKENS,
+        on_progress: Callable[[int], None] | None = None,
+    ) -> None:
+        """
+        以不同长度的提示词各生成几个 token，提前完成 CUDA 初始化与各形状的算子选择，不写入会话、缓存与监控指标
+
+        :param prompt_lengths: 提示词长度（token）
+        :param new_tokens: 每个提示词生成的 token 数量
+        :param on_progress: 每完成一个提示词的回调，参数为已完成的数量
+        """
+        unit: int = max(1, len(self.backend.tokenize(WARMUP_TEXT, [], continuation=True)))
+        for done, length in enumerate(prompt_lengths, start=1):
+            prompt: str = WARMUP_TEXT * max(1, length // unit)
+            if self.engine is not None:
+                prompt_ids: list[int] = self.backend.tokenize(prompt, [])
+                for _ in self.engine.submit(prompt_ids, 0.8, 0.8, new_tokens, self.eos_token_ids):
+                    pass
+            else:
+                max_length: int = len(self.backend.tokenize(prompt, [])) + new_tokens
+                for _ in self.backend.stream(prompt, [], top_p=0.8, temperature=0.8, max_length=max_length):
+                    pass
+            if on_progress is not None:
+                on_progress(done)
+
+    def clear_history(self, session_id: str) -> bool:
         """
         清除历史记录
+
+        :param session_id: 会话 ID
         """
-        self.history = []
+        self.conversations.remove(session_id)
         return True
 
 
 class ChatGLM3Factory:
     """
     ChatGLM3 单例模式工厂类
+
+    模型在后台线程中加载并预热，期间服务已可以响应健康检查；预热完成后 get_model 才返回模型
     """
 
     _instance = None
     _lock = threading.Lock()
 
-    def __new__(cls):
+    def __new__(cls, *args, **kwargs):  # pylint: disable=W0613
         if cls._instance is None:
             with cls._lock:
                 if not cls._instance:
                     cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self):
-        self.model_instance = ChatGLM3()
+    def __init__(
+        self,
+        model_instance: ChatGLM3 | None = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        warmup_lengths: tuple[int, ...] = WARMUP_PROMPT_LENGTHS,
+        prefix_cache_bytes: int = PREFIX_CACHE_BYTES,
+        blocklist_file: str | None = BLOCKLIST_FILE,
+        moderation_mode: str = MODERATION_MODE,
+        is_cpu: bool = IS_CPU,
+        is_quantize: bool = IS_QUANTIZE,
+        response_cache_ttl: float = RESPONSE_CACHE_TTL,
+        response_cache_path: str | None = RESPONSE_CACHE_PATH,
+    ):
+        """
+        :param model_instance: 已创建的模型（例如压测使用的替身模型），传入后直接就绪，不再加载与预热
+        :param max_batch_size: 加载的模型的连续批处理大小，也决定推理执行器的工作线程数量，默认由环境变量
+            LLM_MAX_BATCH_SIZE 设置
+        :param warmup_lengths: 预热使用的提示词长度，为空时不预热
+        :param prefix_cache_bytes: 大于 0 时加载的模型启用前缀 KV 缓存（经由连续批处理引擎生成），默认由环境变量
+            LLM_PREFIX_CACHE_BYTES 设置
+        :param blocklist_file: 敏感词文件，为 None 时不审核回复，默认由环境变量 LLM_BLOCKLIST_FILE 设置
+        :param moderation_mode: 回复出现敏感词时停止生成（stop）或替换为掩码（redact），默认由环境变量
+            LLM_MODERATION_MODE 设置
+        :param is_cpu: 是否使用 CPU 推理，默认由环境变量 LLM_CPU 设置
+        :param is_quantize: 是否 4-bit 量化，默认由环境变量 LLM_QUANTIZE 设置
+        :param response_cache_ttl: 回复缓存的有效时间（秒），为 0 时不缓存回复，默认由环境变量 LLM_RESPONSE_CACHE_TTL
+            设置
+        :param response_cache_path: 回复缓存的 SQLite 文件路径，为 None 时只缓存在内存中，默认由环境变量
+            LLM_RESPONSE_CACHE_PATH 设置
+        """
+        # 单例的 __init__ 每次调用都会执行，只在第一次时初始化
+        if not hasattr(self, "model_instance"):
+            self.model_instance: ChatGLM3 | None = None
+            self.max_batch_size: int = max_batch_size
+            self.warmup_lengths: tuple[int, ...] = warmup_lengths
+            self.prefix_cache_bytes: int = prefix_cache_bytes
+            self.blocklist_file: str | None = blocklist_file
+            self.moderation_mode: str = moderation_mode
+            self.is_cpu: bool = is_cpu
+            self.is_quantize: bool = is_quantize
+            self.response_cache_ttl: float = response_cache_ttl
+            self.response_cache_path: str | None = response_cache_path
+            self.status: Literal["pending", "loading", "warming_up", "ready", "failed"] = "pending"
+            self.error: str | None = None
+            self.warmup_done: int = 0
+            self.started_at: float | None = None
+            self.ready_at: float | None = None
+        if model_instance is not None and self.model_instance is None:
+            self.model_instance = model_instance
+            self.max_batch_size = model_instance.max_batch_size
+            self.status = "ready"
+
+    def start_loading(self) -> None:
+        """
+        在后台线程中加载并预热模型，重复调用无效
+        """
+        with self._lock:
+            if self.status != "pending":
+                return
+            self.status = "loading"
+            self.started_at = time.monotonic()
+        threading.Thread(target=self.load, name="model-loader", daemon=True).start()
+
+    def load(self) -> None:
+        """
+        在当前线程中加载并预热模型，环境变量 LLM_BACKEND 可切换模型后端，LLM_SPECULATIVE_TOKENS 启用投机解码
+        （只用于未启用连续批处理的逐请求生成）；敏感词文件或回复缓存的数据库读取失败、审核方式不合法或启用了后端
+        不支持的功能（例如 MiniCPM 的 4-bit 量化）时加载失败；多副本的工作进程直接调用
+        """
+        if self.started_at is None:
+            self.status, self.started_at = "loading", time.monotonic()
+        try:
+            if self.moderation_mode not in ("stop", "redact"):
+                raise ValueError(f"未知的审核方式 {self.moderation_mode}，可选 stop 或 redact")
+            model = ChatGLM3(
+                max_batch_size=self.max_batch_size,
+                prefix_cache_bytes=self.prefix_cache_bytes,
+                response_cache=(
+                    ResponseCache(ttl=self.response_cache_ttl, disk_path=self.response_cache_path)
+                    if self.response_cache_ttl > 0
+                    else None
+                ),
+                blocklist=None if self.blocklist_file is None else AhoCorasick.from_file(self.blocklist_file),
+                moderation_mode=self.moderation_mode,
+                metrics=METRICS,
+                backend=create_backend(backend_name(), is_quantize=self.is_quantize, is_cpu=self.is_cpu),
+                speculative_tokens=SPECULATIVE_TOKENS,
+            )
+            self.status = "warming_up"
+            model.warm_up(self.warmup_lengths, on_progress=self._on_warmup_progress)
+        except Exception as e:  # pylint: disable=W0718
+            logger.exception("模型加载失败")
+            self.status, self.error = "failed", f"{type(e).__name__}: {e}"
+            return
+        self.model_instance = model
+        self.ready_at = time.monotonic()
+        self.status = "ready"
+
+    def _on_warmup_progress(self, done: int) -> None:
+        self.warmup_done = done
+
+    @property
+    def ready(self) -> bool:
+        """
+        模型是否已加载并完成预热
+        """
+        return self.status == "ready"
+
+    def progress(self) -> dict[str, Any]:
+        """
+        加载进度
+        """
+        now: float = time.monotonic()
+        return {
+            "status": self.status,
+            "error": self.error,
+            "warmup_done": self.warmup_done,
+            "warmup_total": len(self.warmup_lengths),
+            "elapsed": None if self.started_at is None else (self.ready_at or now) - self.started_at,
+        }
 
-    def get_model(self):
+    def get_model(self) -> ChatGLM3 | None:
         """
-        获得 ChatGLM3 模型
+        获得 ChatGLM3 模型，尚未就绪时返回 None
         """
         return self.model_instance
@@ -0,0 +1,325 @@
+"""
+OpenAI 兼容的 FastAPI 路由文件
+
+- /v1/chat/completions：对话补全，支持流式（SSE）与非流式、n 个回复共享一次 prefill、max_tokens、stop 与用量统计
+- /v1/batch：一次请求提交多段对话，各段对话并发生成，按提交顺序返回各自的结果或错误
+- /v1/models：模型列表
+
+请求只使用 messages 中的完整聊天记录，不读写会话，也不使用回复缓存
+"""
+import asyncio
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from .completions import PromptError
+from .executor import ExecutorClosedError, QueueFullError
+from .model import ChatGLM3
+from .routers import (
+    REPLICAS,
+    cancel_on_disconnect,
+    cancellations,
+    executor,
+    executor_error,
+    get_model,
+    model_factory,
+    stop_on_disconnect,
+    worker_pool,
+)
+from .session import DEFAULT_SESSION_ID
+from .streaming import sse_json
+from .workers import WorkerUnavailableError
+
+openai_api = APIRouter(prefix="/v1")
+
+# 请求未指定 model 时返回的模型名称
+MODEL_NAME: str = "chatglm3-6b"
+MODEL_CREATED: int = int(time.time())
+# 单个请求的最大回复数量与停止词数量
+MAX_CHOICES: int = 8
+MAX_STOP_SEQUENCES: int = 4
+# 单次 /v1/batch 请求的最大对话数量
+MAX_BATCH_REQUESTS: int = 256
+# /v1/batch 同时生成的对话数量，与所有模型的批处理位置总数相同，其余对话等待而不占用推理请求队列
+BATCH_CONCURRENCY: int = REPLICAS * model_factory.max_batch_size
+
+
+class ChatMessage(BaseModel):
+    """
+    OpenAI 格式的单条消息
+    """
+
+    role: Literal["system", "user", "assistant"]
+    content: str
+
+
+class StreamOptions(BaseModel):
+    """
+    流式输出的选项
+    """
+
+    # 为 True 时在 [DONE] 之前发送一个 choices 为空、附带用量的事件
+    include_usage: bool = False
+
+
+class ChatCompletionRequest(BaseModel):
+    """
+    OpenAI 格式的对话补全请求，未列出的参数（例如 presence_penalty）被忽略
+    """
+
+    model: str = MODEL_NAME
+    messages: list[ChatMessage]
+    temperature: float = Field(default=0.8, ge=0.0, le=2.0)
+    top_p: float = Field(default=0.8, gt=0.0, le=1.0)
+    n: int = Field(default=1, ge=1, le=MAX_CHOICES)
+    max_tokens: int | None = Field(default=None, ge=1)
+    stop: str | list[str] | None = None
+    stream: bool = False
+    stream_options: StreamOptions | None = None
+    user: str | None = None
+
+
+class BatchRequestItem(BaseModel):
+    """
+    批量请求中的单段对话
+    """
+
+    custom_id: str | None = None
+    body: ChatCompletionRequest
+
+
+class BatchRequest(BaseModel):
+    """
+    批量对话补全请求，各段对话的 stream 参数被忽略
+    """
+
+    requests: list[BatchRequestItem]
+
+
+def get_request_id(x_request_id: str | None = Header(default=None)) -> str:
+    """
+    获取请求 ID，优先使用请求头 X-Request-Id，没有时随机生成
+    """
+    return x_request_id or uuid.uuid4().hex
+
+
+def completion_args(body: ChatCompletionRequest) -> tuple:
+    """
+    将 OpenAI 格式的请求转换为 ChatGLM3.complete 的参数（不含取消事件）
+
+    :raises HTTPException: 停止词过多时返回 400
+    """
+    stop: list[str] = [body.stop] if isinstance(body.stop, str) else list(body.stop or [])
+    if len(stop) > MAX_STOP_SEQUENCES:
+        raise HTTPException(status_code=400, detail=f"stop 最多包含 {MAX_STOP_SEQUENCES} 个停止词")
+    messages: list[dict[str, Any]] = [
+        {"role": "assistant", "metadata": "", "content": message.content}
+        if message.role == "assistant"
+        else {"role": message.role, "content": message.content}
+        for message in body.messages
+    ]
+    return messages, body.n, body.top_p, body.temperature, body.max_tokens, stop
+
+
+async def run_completion(model: ChatGLM3 | None, args: tuple, cancel_event: threading.Event) -> dict[str, Any]:
+    """
+    在推理执行器或模型工作进程中完整生成对话补全
+
+    :return: ChatGLM3.complete 的返回值
+    :raises HTTPException: 排队失败时返回 429 或 503，提示词不合法时返回 400
+    """
+    try:
+        if worker_pool is not None:
+            return await worker_pool.complete(*args, cancel_event)
+        return await executor.run(model.complete, *args, cancel_event)
+    except (QueueFullError, ExecutorClosedError, WorkerUnavailableError) as e:
+        raise executor_error(e) from e
+    except PromptError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+def completion_response(completion_id: str, created: int, model: str, result: dict[str, Any]) -> dict[str, Any]:
+    """
+    OpenAI 格式的非流式对话补全响应
+    """
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": choice["index"],
+                "message": {"role": "assistant", "content": choice["text"]},
+                "finish_reason": choice["finish_reason"],
+            }
+            for choice in result["choices"]
+        ],
+        "usage": result["usage"],
+    }
+
+
+async def completion_chunks(
+    events: AsyncIterator[tuple[str, int | None, Any]],
+    completion_id: str,
+    created: int,
+    model: str,
+    n: int,
+    include_usage: bool,
+) -> AsyncIterator[str]:
+    """
+    将对话补全事件编码为 OpenAI 格式的 SSE 事件流：每个回复先发送角色，之后发送新增的文本与结束原因，最后为 [DONE]
+
+    :param events: ChatGLM3.stream_complete 返回的事件
+    :param completion_id: 对话补全 ID
+    :param created: 创建时间
+    :param model: 模型名称
+    :param n: 回复数量
+    :param include_usage: 是否发送用量
+    :yield: SSE 事件
+    """
+
+    def chunk(choices: list[dict[str, Any]], usage: dict[str, int] | None = None) -> str:
+        data: dict[str, Any] = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": choices,
+        }
+        if usage is not None:
+            data["usage"] = usage
+        return f"data: {sse_json(data)}\n\n"
+
+    for index in range(n):
+        yield chunk([{"index": index, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+    async for kind, index, payload in events:
+        if kind == "delta":
+            yield chunk([{"index": index, "delta": {"content": payload}, "finish_reason": None}])
+        elif kind == "finish":
+            yield chunk([{"index": index, "delta": {}, "finish_reason": payload}])
+        elif include_usage:
+            yield chunk([], usage=payload)
+    yield "data: [DONE]\n\n"
+
+
+async def prepend(first: Any, rest: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    将已取出的第一个元素放回异步迭代器的开头
+    """
+    yield first
+    async for item in rest:
+        yield item
+
+
+@openai_api.get(path="/models")
+async def list_models() -> dict[str, Any]:
+    """
+    OpenAI 格式的模型列表
+    """
+    return {
+        "object": "list",
+        "data": [{"id": MODEL_NAME, "object": "model", "created": MODEL_CREATED, "owned_by": "THUDM"}],
+    }
+
+
+@openai_api.post(path="/chat/completions")
+async def chat_completions(
+    request: Request,
+    body: ChatCompletionRequest,
+    request_id: str = Depends(get_request_id),
+    model: ChatGLM3 | None = Depends(get_model),
+):
+    """
+    OpenAI 兼容的对话补全，响应头 X-Request-Id 可用于取消生成，客户端断开时同样停止生成（流式与非流式）；
+    被取消的回复的结束原因为 stop
+    """
+    args: tuple = completion_args(body)
+    completion_id: str = f"chatcmpl-{request_id}"
+    created: int = int(time.time())
+    # 请求不属于会话，使用默认会话登记，不会与其它请求互相取消
+    cancel_event: threading.Event = cancellations.start(request_id, DEFAULT_SESSION_ID)
+    if not body.stream:
+        try:
+            result: dict[str, Any] = await cancel_on_disconnect(
+                request, run_completion(model, args, cancel_event), cancel_event
+            )
+        finally:
+            cancel_event.set()
+            cancellations.finish(request_id, DEFAULT_SESSION_ID)
+        return completion_response(completion_id, created, body.model, result)
+
+    try:
+        if worker_pool is not None:
+            events = worker_pool.stream_complete(*args, cancel_event)
+        else:
+            events = executor.stream(model.stream_complete, *args, cancel_event)
+        # 提示词不合法的错误在生成第一个事件前抛出，等到第一个事件再开始响应，以便返回 400
+        first: tuple[str, int | None, Any] = await anext(events)
+    except (QueueFullError, ExecutorClosedError, WorkerUnavailableError) as e:
+        cancellations.finish(request_id, DEFAULT_SESSION_ID)
+        raise executor_error(e) from e
+    except PromptError as e:
+        cancellations.finish(request_id, DEFAULT_SESSION_ID)
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    include_usage: bool = body.stream_options is not None and body.stream_options.include_usage
+    chunks = completion_chunks(prepend(first, events), completion_id, created, body.model, body.n, include_usage)
+    return StreamingResponse(
+        content=stop_on_disconnect(request, chunks, cancel_event, request_id, DEFAULT_SESSION_ID),
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Request-Id": request_id,
+        },
+        media_type="text/event-stream",
+    )
+
+
+@openai_api.post(path="/batch")
+async def batch_completions(
+    body: BatchRequest,
+    request_id: str = Depends(get_request_id),
+    model: ChatGLM3 | None = Depends(get_model),
+) -> dict[str, Any]:
+    """
+    批量对话补全：各段对话并发生成（启用连续批处理时共享解码步骤），单段对话失败不影响其它对话；
+    可用响应的 X-Request-Id 或请求头中的请求 ID 取消整个批次
+    """
+    if len(body.requests) > MAX_BATCH_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {MAX_BATCH_REQUESTS} 段对话")
+    cancel_event: threading.Event = cancellations.start(request_id, DEFAULT_SESSION_ID)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    created: int = int(time.time())
+
+    async def run(index: int, item: BatchRequestItem) -> dict[str, Any]:
+        output: dict[str, Any] = {"id": f"batch_req-{request_id}-{index}", "custom_id": item.custom_id}
+        try:
+            args: tuple = completion_args(item.body)
+            async with semaphore:
+                result: dict[str, Any] = await run_completion(model, args, cancel_event)
+        except HTTPException as e:
+            return {**output, "response": None, "error": {"code": e.status_code, "message": e.detail}}
+        completion: dict[str, Any] = completion_response(
+            f"chatcmpl-{request_id}-{index}", created, item.body.model, result
+        )
+        return {**output, "response": {"status_code": 200, "body": completion}, "error": None}
+
+    try:
+        outputs: list[dict[str, Any]] = await asyncio.gather(
+            *(run(index, item) for index, item in enumerate(body.requests))
+        )
+    finally:
+        cancel_event.set()
+        cancellations.finish(request_id, DEFAULT_SESSION_ID)
+    usage: dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for output in outputs:
+        if output["response"] is not None:
+            for key, value in output["response"]["body"]["usage"].items():
+                usage[key] += value
+    return {"object": "list", "data": outputs, "usage": usage}
@@ -0,0 +1,179 @@
+"""
+跨会话共享的前缀 KV 缓存
+
+以固定长度的 token 块为单位组织成前缀树（radix tree），提示词命中已缓存的前缀时只需 prefill 剩余的部分
+"""
+
+import heapq
+import threading
+import time
+from typing import Any
+
+import torch
+
+
+class PrefixNode:
+    """
+    前缀树节点，保存一个 token 块对应的各层 KV
+    """
+
+    def __init__(self, parent: "PrefixNode | None", block: tuple[int, ...], kv: Any, nbytes: int) -> None:
+        self.parent: PrefixNode | None = parent
+        self.block: tuple[int, ...] = block
+        self.kv = kv  # 各层 (key, value)，序列长度为块大小，batch 为 1
+        self.nbytes: int = nbytes
+        self.children: dict[tuple[int, ...], PrefixNode] = {}
+        self.ref_count: int = 0  # 正在使用该节点的序列数量，大于 0 时不会被淘汰
+        self.last_access: float = time.monotonic()
+
+
+class PrefixCache:
+    """
+    前缀 KV 缓存，超出字节预算时按 LRU 顺序淘汰未被引用的叶子节点
+    """
+
+    def __init__(self, max_bytes: int = 1024**3, block_size: int = 16, kv_seq_dim: int = 0) -> None:
+        """
+        :param max_bytes: 缓存占用的最大字节数
+        :param block_size: 每个块的 token 数量
+        :param kv_seq_dim: past_key_values 中序列长度所在维度，ChatGLM3 为 0
+        """
+        self.max_bytes: int = max_bytes
+        self.block_size: int = block_size
+        self.kv_seq_dim: int = kv_seq_dim
+        self.total_bytes: int = 0
+        self.lookups: int = 0
+        self.hits: int = 0  # 至少命中一个块的查询次数
+        self.prompt_tokens: int = 0
+        self.cached_tokens: int = 0  # 命中缓存而无需 prefill 的 token 数量
+        self._root = PrefixNode(None, (), None, 0)
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        token 级命中率
+        """
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def stats(self) -> dict[str, Any]:
+        """
+        缓存统计信息
+        """
+        return {
+            "total_bytes": self.total_bytes,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": self.hit_rate,
+        }
+
+    def lookup(self, prompt_ids: list[int]) -> tuple[list[PrefixNode], Any]:
+        """
+        查找提示词最长的已缓存前缀，命中的节点引用计数加一
+
+        至少保留最后一个 token 不命中，保证 prefill 能得到下一个 token 的 logits
+
+        :param prompt_ids: 提示词 token id
+        :return: 命中的节点与拼接后的 past_key_values，未命中时为 ([], None)
+        """
+        max_blocks: int = (len(prompt_ids) - 1) // self.block_size
+        nodes: list[PrefixNode] = []
+        now: float = time.monotonic()
+        with self._lock:
+            node: PrefixNode = self._root
+            for i in range(max_blocks):
+                child: PrefixNode | None = node.children.get(self._block(prompt_ids, i))
+                if child is None:
+                    break
+                child.ref_count += 1
+                child.last_access = now
+                nodes.append(child)
+                node = child
+            self.lookups += 1
+            self.prompt_tokens += len(prompt_ids)
+            self.cached_tokens += len(nodes) * self.block_size
+            self.hits += bool(nodes)
+        if not nodes:
+            return [], None
+        past = tuple(
+            tuple(torch.cat([node.kv[layer][j] for node in nodes], dim=self.kv_seq_dim) for j in range(2))
+            for layer in range(len(nodes[0].kv))
+        )
+        return nodes, past
+
+    def insert(self, prompt_ids: list[int], past_key_values: Any, nodes: list[PrefixNode]) -> list[PrefixNode]:
+        """
+        将提示词 prefill 得到的 KV 按块插入前缀树，新节点引用计数加一
+
+        :param prompt_ids: 提示词 token id
+        :param past_key_values: 提示词 prefill 后的 past_key_values，batch 为 1
+        :param nodes: lookup 命中并已引用的节点
+        :return: 提示词所有完整块对应的已引用节点
+        """
+        nodes = list(nodes)
+        num_blocks: int = len(prompt_ids) // self.block_size
+        with self._lock:
+            node: PrefixNode = nodes[-1] if nodes else self._root
+            for i in range(len(nodes), num_blocks):
+                block: tuple[int, ...] = self._block(prompt_ids, i)
+                child: PrefixNode | None = node.children.get(block)
+                if child is None:
+                    kv = tuple(
+                        tuple(
+                            tensor.narrow(self.kv_seq_dim, i * self.block_size, self.block_size).clone()
+                            for tensor in layer
+                        )
+                        for layer in past_key_values
+                    )
+                    nbytes: int = sum(tensor.numel() * tensor.element_size() for layer in kv for tensor in layer)
+                    child = PrefixNode(node, block, kv, nbytes)
+                    node.children[block] = child
+                    self.total_bytes += nbytes
+                child.ref_count += 1
+                child.last_access = time.monotonic()
+                nodes.append(child)
+                node = child
+            self._evict()
+        return nodes
+
+    def release(self, nodes: list[PrefixNode]) -> None:
+        """
+        序列结束后释放对节点的引用
+
+        :param nodes: insert 返回的节点
+        """
+        with self._lock:
+            for node in nodes:
+                node.ref_count -= 1
+            self._evict()
+
+    def _block(self, prompt_ids: list[int], index: int) -> tuple[int, ...]:
+        """
+        第 index 个 token 块
+        """
+        return tuple(prompt_ids[index * self.block_size : (index + 1) * self.block_size])
+
+    def _evict(self) -> None:
+        """
+        超出字节预算时按最近访问时间淘汰未被引用的叶子节点，父节点成为叶子后也可继续被淘汰
+        """
+        if self.total_bytes <= self.max_bytes:
+            return
+        heap: list[tuple[float, int, PrefixNode]] = []
+        stack: list[PrefixNode] = list(self._root.children.values())
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(node.children.values())
+            elif node.ref_count == 0:
+                heap.append((node.last_access, id(node), node))
+        heapq.heapify(heap)
+        while self.total_bytes > self.max_bytes and heap:
+            _, _, node = heapq.heappop(heap)
+            parent: PrefixNode = node.parent
+            del parent.children[node.block]
+            self.total_bytes -= node.nbytes
+            if parent is not self._root and not parent.children and parent.ref_count == 0:
+                heapq.heappush(heap, (parent.last_access, id(parent), parent))
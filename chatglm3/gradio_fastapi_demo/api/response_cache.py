@@ -0,0 +1,157 @@
+"""
+确定性请求的回复缓存
+
+temperature 接近 0 时相同的聊天记录会得到相同的回复，直接返回缓存结果而无需重新生成
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class ResponseCache:
+    """
+    回复缓存，内存中按 LRU 与过期时间淘汰，可选的磁盘缓存（SQLite）在重启后依旧有效
+
+    磁盘缓存在打开时与之后每隔 purge_interval 秒删除过期的条目，并在超出 max_disk_entries 时删除最早写入的条目
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 24 * 3600.0,
+        disk_path: str | None = None,
+        max_temperature: float = 0.01,
+        max_disk_entries: int = 100_000,
+        purge_interval: float = 600.0,
+    ) -> None:
+        """
+        :param max_entries: 内存中缓存的最大条目数
+        :param ttl: 缓存有效时间（秒）
+        :param disk_path: SQLite 数据库文件路径，为 None 时只使用内存缓存
+        :param max_temperature: temperature 不超过该值时视为确定性请求并使用缓存
+        :param max_disk_entries: 磁盘缓存的最大条目数，清理时删除超出的部分
+        :param purge_interval: 清理磁盘缓存的间隔（秒）
+        """
+        self.max_entries: int = max_entries
+        self.ttl: float = ttl
+        self.max_temperature: float = max_temperature
+        self.max_disk_entries: int = max_disk_entries
+        self.purge_interval: float = purge_interval
+        self.hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()  # key -> (过期时间, 回复)
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if disk_path is not None:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, reply TEXT, expires REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+            self._purge()
+        self._next_purge: float = time.monotonic() + purge_interval
+
+    def is_cacheable(self, temperature: float) -> bool:
+        """
+        请求是否为确定性请求
+        """
+        return temperature <= self.max_temperature
+
+    @staticmethod
+    def make_key(model_id: str, history: list[dict[str, Any]], question: str, top_p: float, temperature: float) -> str:
+        """
+        根据模型、规范化后的聊天记录与采样参数计算缓存键
+
+        :param model_id: 模型 ID
+        :param history: ChatGLM3 格式的聊天记录
+        :param question: 用户最新的提问
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :return: 缓存键
+        """
+        messages: list[list[str]] = [[message["role"], message["content"].strip()] for message in history]
+        messages.append(["user", question.strip()])
+        payload: str = json.dumps([model_id, messages, round(top_p, 4), round(temperature, 4)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        缓存统计信息
+        """
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def get(self, key: str) -> str | None:
+        """
+        获取缓存的回复，先查内存再查磁盘
+
+        :param key: 缓存键
+        :return: 回复，未命中或已过期时返回 None
+        """
+        now: float = time.time()
+        with self._lock:
+            entry: tuple[float, str] | None = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT reply, expires FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, reply: str) -> None:
+        """
+        缓存回复
+
+        :param key: 缓存键
+        :param reply: 模型回复
+        """
+        expires: float = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires, reply)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, reply, expires) VALUES (?, ?, ?)", (key, reply, expires)
+                )
+                if time.monotonic() >= self._next_purge:
+                    self._next_purge = time.monotonic() + self.purge_interval
+                    self._purge()
+                else:
+                    self._db.commit()
+
+    def _purge(self) -> None:
+        """
+        删除磁盘缓存中过期的条目，超出条目上限时再按过期时间删除最早写入的条目
+        """
+        self._db.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        excess: int = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires LIMIT ?)", (excess,)
+            )
+        self._db.commit()
+
+    def _remember(self, key: str, expires: float, reply: str) -> None:
+        """
+        写入内存缓存，超出条目上限时淘汰最久未使用的条目
+        """
+        self._entries[key] = (expires, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
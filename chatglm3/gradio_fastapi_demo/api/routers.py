@@ -1,18 +1,57 @@
 """
 FastAPI 路由文件
 """
-from typing import Any
+import asyncio
+import os
+import threading
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Iterator, Literal, TypeVar
 
-from fastapi import APIRouter, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
 
+from .cancellation import CancellationRegistry
+from .executor import ExecutorClosedError, InferenceExecutor, QueueFullError
+from .metrics import REGISTRY, ServerStatsCollector
 from .model import ChatGLM3, ChatGLM3Factory
+from .session import DEFAULT_SESSION_ID
+from .streaming import replies_from_events, sse_delta_stream, sse_event_stream
+from .workers import WorkerPool, WorkerUnavailableError
 
 api = APIRouter()
 
+# 只创建工厂，模型在服务启动后于后台线程中加载；环境变量 LLM_MAX_BATCH_SIZE 大于 1 时启用连续批处理，
+# LLM_PREFIX_CACHE_BYTES 大于 0 时启用前缀 KV 缓存（同样经由连续批处理引擎生成）
 model_factory = ChatGLM3Factory()
 
+# 环境变量 LLM_REPLICAS 大于 1 时启动多个模型工作进程，本进程只按会话路由请求，不加载模型；
+# LLM_WORKER_DEVICES（例如 0,1）依次为各工作进程分配 GPU
+REPLICAS: int = int(os.environ.get("LLM_REPLICAS", "1"))
+worker_pool: WorkerPool | None = None
+# 模型推理均在执行器的工作线程中进行，事件循环只负责收发请求
+# 启用连续批处理时每个工作线程对应批次中的一个序列；多副本模式下推理在工作进程中进行，不创建执行器
+executor: InferenceExecutor | None = None
+if REPLICAS > 1:
+    worker_pool = WorkerPool(
+        REPLICAS,
+        max_batch_size=model_factory.max_batch_size,
+        devices=os.environ["LLM_WORKER_DEVICES"].split(",") if os.environ.get("LLM_WORKER_DEVICES") else None,
+    )
+else:
+    executor = InferenceExecutor(num_workers=model_factory.max_batch_size)
+
+# 进行中的请求，用于取消生成
+cancellations = CancellationRegistry()
+# 非流式请求等待生成期间检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL: float = 0.5
+
+T = TypeVar("T")
+
+# 缓存、会话与队列的状态在抓取 /metrics 时读取
+REGISTRY.register(ServerStatsCollector(model_factory.get_model, executor))
+
 
 class UploadContent(BaseModel):
     """
@@ -22,37 +61,218 @@ class UploadContent(BaseModel):
     chat_history: list[Any]
     top_p: float
     temperature: float
+    session_id: str | None = None
+    request_id: str | None = None
+    # text: 每次返回完整的回复字符串；sse: 以 SSE 事件只返回新增的文本
+    stream_format: Literal["text", "sse"] = "text"
+
+
+def get_session_id(content: UploadContent, x_session_id: str | None = Header(default=None)) -> str:
+    """
+    获取会话 ID，优先使用请求体中的 session_id，其次为请求头 X-Session-Id
+    """
+    return content.session_id or x_session_id or DEFAULT_SESSION_ID
+
+
+def get_request_id(content: UploadContent, x_request_id: str | None = Header(default=None)) -> str:
+    """
+    获取请求 ID，优先使用请求体中的 request_id，其次为请求头 X-Request-Id，都没有时随机生成
+    """
+    return content.request_id or x_request_id or uuid.uuid4().hex
+
+
+def get_model() -> ChatGLM3 | None:
+    """
+    获取已就绪的模型，模型仍在加载或预热时返回 503；多副本模式下模型位于工作进程中，返回 None
+    """
+    if worker_pool is not None:
+        return None
+    model: ChatGLM3 | None = model_factory.get_model()
+    if model is None:
+        raise HTTPException(status_code=503, detail=f"模型尚未就绪：{model_factory.status}", headers={"Retry-After": "5"})
+    return model
+
+
+def executor_error(e: Exception) -> HTTPException:
+    """
+    将执行器的排队错误转换为 HTTP 错误，队列已满返回 429，执行器已关闭或没有可用的模型工作进程返回 503
+    """
+    if isinstance(e, QueueFullError):
+        return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    if isinstance(e, WorkerUnavailableError):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return HTTPException(status_code=503, detail=str(e))
+
+
+def stream_sse_chat_reply(model: ChatGLM3, *args: Any) -> Iterator[str]:
+    """
+    以 SSE 增量事件的形式返回模型单条流式回复
+    """
+    return sse_delta_stream(model.stream_chat_reply(*args))
+
+
+async def stop_on_disconnect(
+    request: Request, reply: AsyncIterator[str], cancel_event: threading.Event, request_id: str, session_id: str
+) -> AsyncIterator[str]:
+    """
+    转发流式回复，客户端断开或流提前结束时设置取消事件，使模型在下一个解码步骤停止生成
+    """
+    try:
+        async for chunk in reply:
+            if await request.is_disconnected():
+                break
+            yield chunk
+    finally:
+        cancel_event.set()
+        cancellations.finish(request_id, session_id)
+
+
+async def cancel_on_disconnect(request: Request, result: Awaitable[T], cancel_event: threading.Event) -> T:
+    """
+    等待非流式请求的生成结果，期间定期检查客户端是否断开，断开时设置取消事件，使模型在下一个解码步骤停止生成
+
+    :param request: 请求
+    :param result: 生成结果
+    :param cancel_event: 取消事件
+    :return: 生成结果，客户端断开时为取消前已生成的部分
+    """
+    task: asyncio.Future[T] = asyncio.ensure_future(result)
+    while not cancel_event.is_set():
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            break
+        if await request.is_disconnected():
+            cancel_event.set()
+    return await task
 
 
 # Routers
 @api.post(path="/chat")
-async def chat_reply(content: UploadContent, model: ChatGLM3 = Depends(model_factory.get_model)):
+async def chat_reply(
+    content: UploadContent,
+    session_id: str = Depends(get_session_id),
+    request_id: str = Depends(get_request_id),
+    model: ChatGLM3 | None = Depends(get_model),
+):
     """
     获取 ChatGLM3 单条完整回复
     """
-    return model.chat_reply(content.chat_history, content.top_p, content.temperature)
+    cancel_event: threading.Event = cancellations.start(request_id, session_id)
+    args: tuple = (session_id, content.chat_history, content.top_p, content.temperature, cancel_event)
+    try:
+        if worker_pool is not None:
+            return await worker_pool.chat_reply(*args)
+        return await executor.run(model.chat_reply, *args)
+    except (QueueFullError, ExecutorClosedError, WorkerUnavailableError) as e:
+        raise executor_error(e) from e
+    finally:
+        cancel_event.set()
+        cancellations.finish(request_id, session_id)
 
 
 @api.post(path="/stream_chat")
-async def stream_chat_reply(content: UploadContent, model: ChatGLM3 = Depends(model_factory.get_model)):
+async def stream_chat_reply(
+    request: Request,
+    content: UploadContent,
+    session_id: str = Depends(get_session_id),
+    request_id: str = Depends(get_request_id),
+    model: ChatGLM3 | None = Depends(get_model),
+):
     """
-    获取 ChatGLM3 单条流式回复
+    获取 ChatGLM3 单条流式回复，响应头 X-Request-Id 可用于取消生成
     """
-    reply = model.stream_chat_reply(content.chat_history, content.top_p, content.temperature)
+    cancel_event: threading.Event = cancellations.start(request_id, session_id)
+    args: tuple = (session_id, content.chat_history, content.top_p, content.temperature, cancel_event)
+    try:
+        if worker_pool is not None:
+            # 工作进程只回传增量文本，text 格式的完整回复在本进程中还原
+            events = worker_pool.stream_chat_reply(*args)
+            reply = sse_event_stream(events) if content.stream_format == "sse" else replies_from_events(events)
+        elif content.stream_format == "sse":
+            reply = executor.stream(stream_sse_chat_reply, model, *args)
+        else:
+            reply = executor.stream(model.stream_chat_reply, *args)
+    except (QueueFullError, ExecutorClosedError, WorkerUnavailableError) as e:
+        cancellations.finish(request_id, session_id)
+        raise executor_error(e) from e
     return StreamingResponse(
-        content=reply,
+        content=stop_on_disconnect(request, reply, cancel_event, request_id, session_id),
         headers={
             "Content-Type": "text/event-stream",
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Request-Id": request_id,
         },
         media_type="text/event-stream",
     )
 
 
+@api.post(path="/cancel/{request_id}")
+async def cancel_request(request_id: str) -> bool:
+    """
+    取消进行中的生成请求
+    """
+    return cancellations.cancel(request_id)
+
+
 @api.delete(path="/clear_history")
-async def clear_history(model: ChatGLM3 = Depends(model_factory.get_model)) -> bool:
+async def clear_history(
+    session_id: str | None = None,
+    x_session_id: str | None = Header(default=None),
+    model: ChatGLM3 | None = Depends(get_model),
+) -> bool:
     """
     清除 ChatGLM3 的聊天历史
     """
-    return model.clear_history()
+    if worker_pool is not None:
+        return await worker_pool.clear_history(session_id or x_session_id or DEFAULT_SESSION_ID)
+    return model.clear_history(session_id or x_session_id or DEFAULT_SESSION_ID)
+
+
+@api.get(path="/cache_stats")
+async def cache_stats(model: ChatGLM3 | None = Depends(get_model)) -> dict[str, Any]:
+    """
+    获取各级缓存的统计信息，多副本模式下按工作进程序号分别返回
+    """
+    if worker_pool is not None:
+        return await worker_pool.cache_stats()
+    return model.cache_stats()
+
+
+@api.get(path="/queue_stats")
+async def queue_stats() -> dict[str, Any]:
+    """
+    获取推理请求队列的统计信息，多副本模式下为各工作进程的请求分布
+    """
+    if worker_pool is not None:
+        return worker_pool.stats()
+    return executor.stats()
+
+
+@api.get(path="/healthz")
+async def healthz() -> JSONResponse:
+    """
+    存活检查，模型加载失败时返回 503 以便重启进程；多副本模式下由本进程重启工作进程，总是返回 200
+    """
+    if worker_pool is not None:
+        return JSONResponse(content=worker_pool.progress())
+    progress: dict[str, Any] = model_factory.progress()
+    return JSONResponse(content=progress, status_code=503 if progress["status"] == "failed" else 200)
+
+
+@api.get(path="/readyz")
+async def readyz() -> JSONResponse:
+    """
+    就绪检查，模型加载并预热完成后返回 200，之前返回 503 与加载进度；多副本模式下至少一个工作进程就绪即可
+    """
+    if worker_pool is not None:
+        return JSONResponse(content=worker_pool.progress(), status_code=200 if worker_pool.ready else 503)
+    return JSONResponse(content=model_factory.progress(), status_code=200 if model_factory.ready else 503)
+
+
+@api.get(path="/metrics")
+async def metrics() -> Response:
+    """
+    Prometheus 监控指标
+    """
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
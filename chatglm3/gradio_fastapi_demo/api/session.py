@@ -0,0 +1,246 @@
+"""
+会话存储，按会话 ID 隔离不同用户的聊天记录
+"""
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable
+
+DEFAULT_SESSION_ID: str = "default"
+
+
+class Conversation:
+    """
+    单个会话的 ChatGLM3 格式聊天记录
+
+    每条消息的 token id 在追加时计算一次并与消息一同保存，下一轮的提示词由这些 token id 拼接而成，不再对整个聊天记录
+    重新分词；token 总数随之累计，trim 据此按 token 预算裁剪聊天记录：开头的系统消息与第一轮对话固定保留，从之后最早的
+    对话开始整轮丢弃
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        tokenize_message: Callable[[dict[str, Any]], list[int]] | None = None,
+        pin_first_turn: bool = True,
+    ) -> None:
+        """
+        :param session_id: 会话 ID
+        :param tokenize_message: 计算单条消息 token id 的函数，为 None 时不分词，也不裁剪
+        :param pin_first_turn: 裁剪时是否固定保留第一轮对话（开头的系统消息总是保留）
+        """
+        self.session_id: str = session_id
+        self.messages: list[dict[str, Any]] = []
+        self.message_ids: list[array] = []  # 与 messages 一一对应，以 int32 数组保存以节省内存
+        self.total_tokens: int = 0
+        self.dropped_tokens: int = 0  # 裁剪累计丢弃的 token 数量
+        self.tokenize_seconds: float = 0.0  # 累计的分词耗时
+        self.tokenize_message = tokenize_message
+        self._prepared: tuple[str, str, array] | None = None  # prepare 预先分词、尚未追加的消息
+        self.pin_first_turn: bool = pin_first_turn
+        self.pinned: int = 0  # 开头固定保留的消息数量
+        self._pinning: bool = True  # 固定保留的消息是否仍在增加
+        self._seen_user: bool = False
+        self.last_access: float = time.monotonic()
+        self._digest: int = 0
+        self._digested: int = 0  # 已计入摘要的消息数量
+        # 从重建聊天记录到写入回复期间持有，同一会话的请求依次生成
+        self.lock = threading.Lock()
+
+    @property
+    def digest(self) -> int:
+        """
+        聊天记录的滚动摘要，只对新增的消息计算，用于校验缓存对应的聊天记录前缀是否改变
+        """
+        for message in self.messages[self._digested :]:
+            self._digest = hash((self._digest, message["role"], message["content"]))
+        self._digested = len(self.messages)
+        return self._digest
+
+    def append(self, message: dict[str, Any]) -> None:
+        """
+        追加一条消息
+
+        :param message: ChatGLM3 格式的单条消息
+        """
+        self.messages.append(message)
+        self.tokenize_new_messages()
+
+    def prepare(self, message: dict[str, Any]) -> array:
+        """
+        为即将追加的消息（例如用户最新的提问）预先分词，追加时不再重复分词
+
+        :param message: 即将追加的消息
+        :return: 消息的 token id
+        """
+        ids: array = self._tokenize(message)
+        self._prepared = (message["role"], message["content"], ids)
+        return ids
+
+    def _tokenize(self, message: dict[str, Any]) -> array:
+        if self.tokenize_message is None:
+            return array("i")
+        prepared: tuple[str, str, array] | None = self._prepared
+        if prepared is not None and prepared[0] == message["role"] and prepared[1] == message["content"]:
+            self._prepared = None
+            return prepared[2]
+        start: float = time.perf_counter()
+        ids = array("i", self.tokenize_message(message))
+        self.tokenize_seconds += time.perf_counter() - start
+        return ids
+
+    def tokenize_new_messages(self) -> None:
+        """
+        为尚未分词的消息计算 token id；模型会在传入的 history 上原地追加用户提问，这些消息在这里补上
+        """
+        for message in self.messages[len(self.message_ids) :]:
+            ids: array = self._tokenize(message)
+            self.message_ids.append(ids)
+            self.total_tokens += len(ids)
+            if self._pinning:
+                # 固定保留开头的系统消息，以及第一条用户消息到第二条用户消息之前的第一轮对话
+                first_turn_over: bool = message["role"] == "user" and self._seen_user
+                if (message["role"] == "system" or self.pin_first_turn) and not first_turn_over:
+                    self.pinned = len(self.message_ids)
+                else:
+                    self._pinning = False
+            self._seen_user = self._seen_user or message["role"] == "user"
+
+    def trim(self, budget: int, target: int) -> int:
+        """
+        聊天记录超过 budget 个 token 时，从固定保留的消息之后整轮丢弃最早的对话，直到不超过 target 个 token
+
+        target 小于 budget 时一次多丢弃几轮，之后几轮对话不再裁剪，会话的 KV 缓存得以继续复用，
+        丢弃消息的开销均摊到每轮为 O(1)
+
+        :param budget: 聊天记录的 token 预算
+        :param target: 裁剪后的 token 数量上限
+        :return: 本次丢弃的 token 数量
+        """
+        self.tokenize_new_messages()
+        if self.total_tokens <= budget:
+            return 0
+        end: int = self.pinned
+        dropped: int = 0
+        while end < len(self.messages) and self.total_tokens - dropped > target:
+            dropped += len(self.message_ids[end])
+            end += 1
+            while end < len(self.messages) and self.messages[end]["role"] != "user":
+                dropped += len(self.message_ids[end])
+                end += 1
+        del self.messages[self.pinned : end]
+        del self.message_ids[self.pinned : end]
+        self.total_tokens -= dropped
+        self.dropped_tokens += dropped
+        # 聊天记录的前缀已改变，重新计算摘要
+        self._digest, self._digested = 0, 0
+        return dropped
+
+    def commit(self, new_history: list[dict[str, Any]]) -> None:
+        """
+        将模型返回的新聊天记录合并进会话，只追加新增的消息
+
+        模型会在传入的 history 上原地追加用户提问，因此这里按长度只取尾部新增的部分
+
+        :param new_history: 模型返回的完整聊天记录
+        """
+        for message in new_history[len(self.messages) :]:
+            self.messages.append(message)
+        self.tokenize_new_messages()
+
+
+class ConversationStore:
+    """
+    会话存储，按最近访问顺序保存，超出会话数量上限或空闲超时的会话会被淘汰
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1024,
+        idle_ttl: float = 3600.0,
+        on_evict: Callable[[str], None] | None = None,
+        tokenize_message: Callable[[dict[str, Any]], list[int]] | None = None,
+        pin_first_turn: bool = True,
+    ) -> None:
+        """
+        :param max_sessions: 同时保存的最大会话数量
+        :param idle_ttl: 会话空闲超时时间（秒）
+        :param on_evict: 会话被淘汰或删除时的回调，参数为会话 ID
+        :param tokenize_message: 计算单条消息 token id 的函数，见 Conversation
+        :param pin_first_turn: 裁剪聊天记录时是否固定保留第一轮对话
+        """
+        self.max_sessions: int = max_sessions
+        self.idle_ttl: float = idle_ttl
+        self.on_evict = on_evict
+        self.tokenize_message = tokenize_message
+        self.pin_first_turn: bool = pin_first_turn
+        self._sessions: OrderedDict[str, Conversation] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict[str, int]:
+        """
+        会话数量与保存的消息数量、字符数、token 数量
+        """
+        with self._lock:
+            conversations: list[Conversation] = list(self._sessions.values())
+        messages: int = sum(len(conversation.messages) for conversation in conversations)
+        chars: int = sum(len(message["content"]) for conversation in conversations for message in conversation.messages)
+        tokens: int = sum(conversation.total_tokens for conversation in conversations)
+        return {"sessions": len(conversations), "messages": messages, "chars": chars, "tokens": tokens}
+
+    def get(self, session_id: str) -> Conversation:
+        """
+        获取会话，不存在时创建新会话
+
+        :param session_id: 会话 ID
+        :return: 对应的会话
+        """
+        now: float = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            conversation: Conversation | None = self._sessions.get(session_id)
+            if conversation is None:
+                conversation = Conversation(session_id, self.tokenize_message, self.pin_first_turn)
+                self._sessions[session_id] = conversation
+                while len(self._sessions) > self.max_sessions:
+                    self._evict()
+            else:
+                self._sessions.move_to_end(session_id)
+            conversation.last_access = now
+            return conversation
+
+    def remove(self, session_id: str) -> bool:
+        """
+        删除会话
+
+        :param session_id: 会话 ID
+        :return: 会话是否存在
+        """
+        with self._lock:
+            existed: bool = self._sessions.pop(session_id, None) is not None
+        if self.on_evict is not None:
+            self.on_evict(session_id)
+        return existed
+
+    def _evict(self) -> None:
+        """
+        淘汰最久未访问的会话
+        """
+        session_id, _ = self._sessions.popitem(last=False)
+        if self.on_evict is not None:
+            self.on_evict(session_id)
+
+    def _evict_expired(self, now: float) -> None:
+        """
+        淘汰空闲超时的会话，会话按访问时间排序，因此只需从头部检查
+        """
+        while self._sessions:
+            conversation: Conversation = next(iter(self._sessions.values()))
+            if now - conversation.last_access < self.idle_ttl:
+                break
+            self._evict()
@@ -0,0 +1,125 @@
+"""
+流式回复的 SSE 封装，每个事件只发送新生成的文本
+"""
+
+import json
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+# JSON 编码时不转义、但按 Unicode 换行分行的客户端（例如 str.splitlines）会当作换行的字符
+LINE_SEPARATORS: dict[int, str] = {ord(char): f"\\u{ord(char):04x}" for char in "\x85\u2028\u2029"}
+
+
+def sse_json(data: Any) -> str:
+    """
+    将 SSE 事件的 data 编码为单行 JSON：中文等字符不转义以减少流量，只转义可能被客户端当作换行的字符
+
+    :param data: 事件数据
+    :return: 不含任何换行字符的 JSON
+    """
+    return json.dumps(data, ensure_ascii=False).translate(LINE_SEPARATORS)
+
+
+def format_sse_event(event: str, data: dict[str, Any], event_id: int | None = None) -> str:
+    """
+    按 Server-Sent Events 格式封装单个事件，data 使用 JSON 编码以避免文本内换行破坏分帧
+
+    :param event: 事件类型
+    :param data: 事件数据
+    :param event_id: 事件 ID
+    :return: SSE 格式的字符串
+    """
+    lines: list[str] = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {sse_json(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def delta_events(replies: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """
+    将模型逐步返回的完整回复转换为增量事件
+
+    - delta：回复新增的后缀
+    - replace：回复不再以已发送内容开头（例如模型后处理修改了结尾）时发送完整回复
+
+    :param replies: 模型每一步返回的完整回复
+    :yield: (事件类型, 文本)
+    """
+    sent: str = ""
+    for reply in replies:
+        if reply.startswith(sent):
+            delta: str = reply[len(sent) :]
+            if not delta:
+                continue
+            yield "delta", delta
+        else:
+            yield "replace", reply
+        sent = reply
+
+
+class SSEDeltaEncoder:
+    """
+    将增量事件编码为 SSE 事件，并统计用量
+    """
+
+    def __init__(self) -> None:
+        self.event_id: int = 0
+        self.completion_chars: int = 0
+
+    def encode(self, event: str, text: str) -> str:
+        """
+        :param event: delta 或 replace
+        :param text: 事件文本
+        :return: SSE 格式的字符串
+        """
+        self.event_id += 1
+        self.completion_chars = self.completion_chars + len(text) if event == "delta" else len(text)
+        return format_sse_event(event, {"text": text}, self.event_id)
+
+    def done(self) -> str:
+        """
+        :return: 回复结束的 done 事件，附带用量统计
+        """
+        self.event_id += 1
+        usage: dict[str, int] = {"completion_chars": self.completion_chars, "events": self.event_id - 1}
+        return format_sse_event("done", {"usage": usage}, self.event_id)
+
+
+def sse_delta_stream(replies: Iterable[str]) -> Iterator[str]:
+    """
+    将模型逐步返回的完整回复转换为增量 SSE 事件流，事件类型见 delta_events，最后发送 done 事件
+
+    :param replies: 模型每一步返回的完整回复
+    :yield: SSE 事件
+    """
+    encoder = SSEDeltaEncoder()
+    for event, text in delta_events(replies):
+        yield encoder.encode(event, text)
+    yield encoder.done()
+
+
+async def sse_event_stream(events: AsyncIterator[tuple[str, str]]) -> AsyncIterator[str]:
+    """
+    将增量事件流编码为 SSE 事件流，最后发送 done 事件
+
+    :param events: (事件类型, 文本)
+    :yield: SSE 事件
+    """
+    encoder = SSEDeltaEncoder()
+    async for event, text in events:
+        yield encoder.encode(event, text)
+    yield encoder.done()
+
+
+async def replies_from_events(events: AsyncIterator[tuple[str, str]]) -> AsyncIterator[str]:
+    """
+    由增量事件流还原每一步的完整回复
+
+    :param events: (事件类型, 文本)
+    :yield: 完整回复
+    """
+    reply: str = ""
+    async for event, text in events:
+        reply = reply + text if event == "delta" else text
+        yield reply
@@ -0,0 +1,572 @@
+"""
+单机多副本模型工作进程池
+
+API 服务进程作为监督进程启动 N 个模型工作进程，每个工作进程加载一份模型：
+- 路由：同一会话的请求发往保存其聊天记录与 KV 缓存的工作进程，新会话或该工作进程不可用、批处理位置已满时
+  发往进行中请求最少的工作进程
+- 回传：工作进程每个解码步骤只回传回复新增的文本，不在进程间复制完整回复
+- 重启：工作进程退出后以指数退避重新启动，其进行中的请求以错误结束
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Any, AsyncIterator, Literal
+
+from .completions import PromptError
+from .executor import ExecutorClosedError, QueueFullError
+from .streaming import delta_events
+
+logger = logging.getLogger(__name__)
+
+# 工作进程连续退出时重启的最长退避时间（秒）
+MAX_RESTART_BACKOFF: float = 30.0
+# 等待工作进程回复时检查取消事件的间隔（秒）
+CANCEL_POLL_INTERVAL: float = 0.1
+# 在工作线程中执行、可以取消的生成方法，其余方法在工作进程的接收线程中直接执行
+GENERATION_METHODS: frozenset[str] = frozenset({"chat_reply", "stream_chat_reply", "complete", "stream_complete"})
+
+
+class WorkerUnavailableError(Exception):
+    """
+    没有就绪的工作进程，或处理请求的工作进程在请求完成前退出
+    """
+
+
+class WorkerError(Exception):
+    """
+    工作进程中的模型调用出错
+    """
+
+
+def worker_main(conn: Connection, max_batch_size: int, num_threads: int | None, device: str | None) -> None:
+    """
+    工作进程入口，加载并预热模型后循环接收请求
+
+    - 监督进程发送 (request_id, method, args)，method 为 cancel 时取消请求，None 表示退出
+    - 工作进程发送 (request_id, kind, payload)，kind 为 delta、replace、event、done、result、invalid（请求不合法）
+      或 error；request_id 为 None 时表示工作进程的状态（ready 或 failed）
+
+    :param conn: 与监督进程通信的管道
+    :param max_batch_size: 连续批处理大小，也是同时执行的生成请求数量
+    :param num_threads: PyTorch 的 CPU 线程数，None 时使用默认值
+    :param device: 工作进程可见的 GPU（CUDA_VISIBLE_DEVICES），None 时不限制
+    """
+    # CUDA 在第一次使用时才读取 CUDA_VISIBLE_DEVICES，因此在加载模型前设置即可
+    if device is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+    import torch  # pylint: disable=C0415
+
+    from .model import ChatGLM3Factory  # pylint: disable=C0415
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    factory = ChatGLM3Factory(max_batch_size=max_batch_size)
+    factory.load()
+    model = factory.get_model()
+    if model is None:
+        conn.send((None, "failed", factory.error))
+        return
+    conn.send((None, "ready", None))
+
+    send_lock = threading.Lock()
+    cancel_events: dict[str, threading.Event] = {}
+
+    def send(message: tuple) -> None:
+        with send_lock:
+            conn.send(message)
+
+    def generate(request_id: str, method: str, args: tuple) -> None:
+        cancel_event: threading.Event = cancel_events[request_id]
+        try:
+            if method == "stream_chat_reply":
+                for kind, text in delta_events(model.stream_chat_reply(*args, cancel_event)):
+                    send((request_id, kind, text))
+                send((request_id, "done", None))
+            elif method == "stream_complete":
+                for event in model.stream_complete(*args, cancel_event):
+                    send((request_id, "event", event))
+                send((request_id, "done", None))
+            else:
+                send((request_id, "result", getattr(model, method)(*args, cancel_event)))
+        except PromptError as e:
+            send((request_id, "invalid", str(e)))
+        except Exception as e:  # pylint: disable=W0718
+            logger.exception("请求 %s 生成失败", request_id)
+            send((request_id, "error", f"{type(e).__name__}: {e}"))
+        finally:
+            cancel_events.pop(request_id, None)
+
+    with ThreadPoolExecutor(max_workers=max_batch_size, thread_name_prefix="inference-worker") as threads:
+        while True:
+            try:
+                message: tuple | None = conn.recv()
+            except EOFError:  # 监督进程已退出
+                break
+            if message is None:
+                break
+            request_id, method, args = message
+            if method == "cancel":
+                if request_id in cancel_events:
+                    cancel_events[request_id].set()
+            elif method in GENERATION_METHODS:
+                cancel_events[request_id] = threading.Event()
+                threads.submit(generate, request_id, method, args)
+            else:
+                try:
+                    send((request_id, "result", getattr(model, method)(*args)))
+                except Exception as e:  # pylint: disable=W0718
+                    send((request_id, "error", f"{type(e).__name__}: {e}"))
+        for event in list(cancel_events.values()):
+            event.set()
+
+
+class WorkerHandle:
+    """
+    监督进程中一个工作进程的状态，除读取线程外只在事件循环线程中修改
+    """
+
+    def __init__(self, index: int, device: str | None) -> None:
+        """
+        :param index: 工作进程序号
+        :param device: 工作进程可见的 GPU
+        """
+        self.index: int = index
+        self.device: str | None = device
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self.conn: Connection | None = None
+        self.status: Literal["starting", "ready", "restarting", "stopped"] = "starting"
+        self.error: str | None = None
+        self.restarts: int = 0
+        self.failures: int = 0  # 就绪前连续退出的次数，用于计算重启的退避时间
+        self.started_at: float | None = None
+        # 进行中的请求，值为接收该请求回复的队列
+        self.pending: dict[str, asyncio.Queue] = {}
+        self.send_lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        """
+        进行中的请求数量
+        """
+        return len(self.pending)
+
+    def send(self, message: tuple | None) -> None:
+        """
+        向工作进程发送消息
+
+        :raises WorkerUnavailableError: 工作进程已退出
+        """
+        if self.conn is None:
+            raise WorkerUnavailableError(f"模型工作进程 {self.index} 不可用")
+        try:
+            with self.send_lock:
+                self.conn.send(message)
+        except (OSError, ValueError) as e:  # 管道已关闭
+            raise WorkerUnavailableError(f"模型工作进程 {self.index} 不可用") from e
+
+    def progress(self) -> dict[str, Any]:
+        """
+        工作进程的状态
+        """
+        return {
+            "index": self.index,
+            "pid": None if self.process is None else self.process.pid,
+            "device": self.device,
+            "status": self.status,
+            "error": self.error,
+            "restarts": self.restarts,
+            "in_flight": self.in_flight,
+        }
+
+
+class WorkerPool:
+    """
+    多副本模型工作进程池，接口与 InferenceExecutor 加单个模型的组合相对应，均为异步方法
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        max_batch_size: int = 1,
+        max_queue_size: int = 32,
+        devices: list[str] | None = None,
+        max_sessions: int = 65536,
+    ) -> None:
+        """
+        :param num_workers: 工作进程数量
+        :param max_batch_size: 每个工作进程的连续批处理大小
+        :param max_queue_size: 每个工作进程中等待的请求的最大数量，超出后拒绝新请求
+        :param devices: 依次分配给各工作进程的 GPU，例如 ["0", "1"]；为空时不限制，CPU 线程在工作进程间平均分配
+        :param max_sessions: 记录会话所在工作进程的最大会话数量，超出后淘汰最久未使用的会话
+        """
+        self.num_workers: int = num_workers
+        self.max_batch_size: int = max_batch_size
+        self.max_queue_size: int = max_queue_size
+        self.max_sessions: int = max_sessions
+        self.num_threads: int | None = None if devices else max(1, (os.cpu_count() or 1) // num_workers)
+        self.workers: list[WorkerHandle] = [
+            WorkerHandle(i, devices[i % len(devices)] if devices else None) for i in range(num_workers)
+        ]
+        self.rejected: int = 0
+        self.migrations: int = 0  # 因原工作进程不可用或繁忙而改变所在工作进程的会话次数
+        # 会话 ID 到工作进程序号
+        self._sessions: OrderedDict[str, int] = OrderedDict()
+        self._request_ids = itertools.count()
+        # 工作进程中会初始化 CUDA，必须使用 spawn 方式启动
+        self._context = multiprocessing.get_context("spawn")
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._closed: bool = False
+
+    @property
+    def ready(self) -> bool:
+        """
+        是否至少有一个工作进程就绪
+        """
+        return any(worker.status == "ready" for worker in self.workers)
+
+    def start(self) -> None:
+        """
+        启动所有工作进程，需在服务的事件循环中调用
+        """
+        self._loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            self._spawn(worker)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """
+        通知工作进程退出，超时后强制结束
+        """
+        self._closed = True
+        for worker in self.workers:
+            try:
+                worker.send(None)
+            except WorkerUnavailableError:
+                pass
+        deadline: float = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            worker.status = "stopped"
+
+    def _spawn(self, worker: WorkerHandle) -> None:
+        """
+        启动工作进程，并在读取线程中接收其消息
+        """
+        if self._closed:
+            return
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=worker_main,
+            args=(child_conn, self.max_batch_size, self.num_threads, worker.device),
+            name=f"model-worker-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        # 关闭本进程持有的子进程一端，工作进程退出后读取线程才能收到 EOFError
+        child_conn.close()
+        worker.process, worker.conn = process, conn
+        worker.status, worker.started_at = "starting", time.monotonic()
+        threading.Thread(
+            target=self._read, args=(worker, process, conn), name=f"model-worker-{worker.index}-reader", daemon=True
+        ).start()
+
+    def _read(self, worker: WorkerHandle, process: multiprocessing.process.BaseProcess, conn: Connection) -> None:
+        """
+        读取线程，将工作进程的消息转交给事件循环，工作进程退出后安排重启
+        """
+        try:
+            while True:
+                message: tuple = conn.recv()
+                self._loop.call_soon_threadsafe(self._dispatch, worker, message)
+        except (EOFError, OSError):
+            pass
+        process.join()
+        conn.close()
+        if not self._closed:
+            self._loop.call_soon_threadsafe(self._on_exit, worker, process.exitcode)
+
+    def _dispatch(self, worker: WorkerHandle, message: tuple) -> None:
+        request_id, kind, payload = message
+        if request_id is None:
+            if kind == "ready":
+                worker.status, worker.error, worker.failures = "ready", None, 0
+                logger.info("模型工作进程 %d 已就绪，耗时 %.1f 秒", worker.index, time.monotonic() - worker.started_at)
+            else:
+                worker.error = payload
+            return
+        # 已结束的请求（例如被取消）可能仍会收到消息，直接丢弃
+        queue: asyncio.Queue | None = worker.pending.get(request_id)
+        if queue is not None:
+            queue.put_nowait((kind, payload))
+
+    def _on_exit(self, worker: WorkerHandle, exitcode: int | None) -> None:
+        """
+        工作进程退出后结束其进行中的请求，并按连续退出次数退避后重启
+        """
+        message: str = f"模型工作进程 {worker.index} 退出（exit code {exitcode}）"
+        logger.warning("%s，%d 个进行中的请求失败", message, worker.in_flight)
+        for queue in worker.pending.values():
+            queue.put_nowait(("exit", message))
+        worker.pending.clear()
+        worker.conn = None
+        worker.status = "restarting"
+        worker.error = worker.error or message
+        worker.restarts += 1
+        worker.failures += 1
+        delay: float = min(MAX_RESTART_BACKOFF, 2.0 ** (worker.failures - 1))
+        self._loop.call_later(delay, self._spawn, worker)
+
+    def _least_loaded(self) -> WorkerHandle:
+        """
+        进行中请求最少的就绪工作进程
+
+        :raises WorkerUnavailableError: 没有就绪的工作进程
+        """
+        ready: list[WorkerHandle] = [worker for worker in self.workers if worker.status == "ready"]
+        if not ready:
+            raise WorkerUnavailableError("没有就绪的模型工作进程")
+        return min(ready, key=lambda worker: worker.in_flight)
+
+    def _route(self, session_id: str) -> WorkerHandle:
+        """
+        选择处理会话请求的工作进程
+
+        :raises WorkerUnavailableError: 没有就绪的工作进程
+        """
+        least_loaded: WorkerHandle = self._least_loaded()
+        index: int | None = self._sessions.get(session_id)
+        if index is not None:
+            self._sessions.move_to_end(session_id)
+            current: WorkerHandle = self.workers[index]
+            # 原工作进程的批处理位置已满而其它工作进程空闲时，迁移会话比排队等待整条生成更快
+            if current.status == "ready" and (
+                current.in_flight < self.max_batch_size or least_loaded.in_flight >= self.max_batch_size
+            ):
+                return current
+            self.migrations += 1
+            if current.status == "ready":
+                # 清除原工作进程中的会话，避免会话之后迁回时使用过时的聊天记录
+                self._post(current, "clear_history", (session_id,))
+        self._sessions[session_id] = least_loaded.index
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return least_loaded
+
+    def _post(self, worker: WorkerHandle, method: str, args: tuple) -> None:
+        """
+        发送不需要回复的请求
+        """
+        try:
+            worker.send((f"post-{next(self._request_ids)}", method, args))
+        except WorkerUnavailableError:
+            pass
+
+    def _submit(self, worker: WorkerHandle, method: str, args: tuple) -> tuple[str, asyncio.Queue]:
+        """
+        向工作进程发送请求
+
+        :return: 请求 ID 与接收回复的队列
+        """
+        if self._closed:
+            raise ExecutorClosedError("模型工作进程池已关闭")
+        if method in GENERATION_METHODS and worker.in_flight >= self.max_batch_size + self.max_queue_size:
+            self.rejected += 1
+            raise QueueFullError(f"模型工作进程 {worker.index} 的请求队列已满（{self.max_queue_size}）")
+        request_id: str = str(next(self._request_ids))
+        queue: asyncio.Queue = asyncio.Queue()
+        worker.pending[request_id] = queue
+        try:
+            worker.send((request_id, method, args))
+        except WorkerUnavailableError:
+            del worker.pending[request_id]
+            raise
+        return request_id, queue
+
+    async def _receive(
+        self, worker: WorkerHandle, request_id: str, queue: asyncio.Queue, cancel_event: threading.Event | None
+    ) -> AsyncIterator[tuple[str, Any]]:
+        """
+        接收请求的回复，取消事件被设置或回复流被提前关闭时通知工作进程停止生成
+
+        :yield: (delta / replace / event / result, 内容)
+        """
+        finished: bool = False
+        cancel_sent: bool = False
+        try:
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(queue.get(), CANCEL_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    kind = None
+                if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                    cancel_sent = True
+                    self._post_cancel(worker, request_id)
+                if kind is None:
+                    continue
+                if kind == "exit":
+                    finished = True
+                    raise WorkerUnavailableError(payload)
+                if kind == "error":
+                    finished = True
+                    raise WorkerError(payload)
+                if kind == "invalid":
+                    finished = True
+                    raise PromptError(payload)
+                if kind == "done":
+                    finished = True
+                    return
+                if kind == "result":
+                    finished = True
+                    yield kind, payload
+                    return
+                yield kind, payload
+        finally:
+            worker.pending.pop(request_id, None)
+            if not finished and not cancel_sent:
+                self._post_cancel(worker, request_id)
+
+    def _post_cancel(self, worker: WorkerHandle, request_id: str) -> None:
+        try:
+            worker.send((request_id, "cancel", None))
+        except WorkerUnavailableError:
+            pass
+
+    async def _call(
+        self, worker: WorkerHandle, method: str, args: tuple, cancel_event: threading.Event | None = None
+    ) -> Any:
+        request_id, queue = self._submit(worker, method, args)
+        result: Any = None
+        # 完整迭代以便在收到结果后立即结束请求
+        async for _, result in self._receive(worker, request_id, queue, cancel_event):
+            pass
+        return result
+
+    async def chat_reply(
+        self, session_id: str, chat_history: list[Any], top_p: float, temperature: float, cancel_event: threading.Event
+    ) -> str:
+        """
+        获取单条完整回复，参数与 ChatGLM3.chat_reply 相同
+
+        :raises QueueFullError: 工作进程的请求队列已满
+        :raises WorkerUnavailableError: 没有就绪的工作进程，或工作进程在生成完成前退出
+        """
+        worker: WorkerHandle = self._route(session_id)
+        return await self._call(worker, "chat_reply", (session_id, chat_history, top_p, temperature), cancel_event)
+
+    def stream_chat_reply(
+        self, session_id: str, chat_history: list[Any], top_p: float, temperature: float, cancel_event: threading.Event
+    ) -> AsyncIterator[tuple[str, str]]:
+        """
+        以增量事件的形式流式返回单条回复，参数与 ChatGLM3.stream_chat_reply 相同；在返回前完成路由与排队检查，
+        因此排队错误在开始响应前抛出
+
+        :return: (delta / replace, 文本)，含义见 streaming.delta_events
+        :raises QueueFullError: 工作进程的请求队列已满
+        :raises WorkerUnavailableError: 没有就绪的工作进程
+        """
+        worker: WorkerHandle = self._route(session_id)
+        request_id, queue = self._submit(worker, "stream_chat_reply", (session_id, chat_history, top_p, temperature))
+        return self._receive(worker, request_id, queue, cancel_event)
+
+    async def complete(
+        self,
+        messages: list[dict[str, Any]],
+        n: int,
+        top_p: float,
+        temperature: float,
+        max_tokens: int | None,
+        stop: list[str] | None,
+        cancel_event: threading.Event,
+    ) -> dict[str, Any]:
+        """
+        完整返回无状态的对话补全，参数与 ChatGLM3.complete 相同；请求不属于会话，发往进行中请求最少的工作进程
+
+        :raises QueueFullError: 工作进程的请求队列已满
+        :raises WorkerUnavailableError: 没有就绪的工作进程，或工作进程在生成完成前退出
+        """
+        args: tuple = (messages, n, top_p, temperature, max_tokens, stop)
+        return await self._call(self._least_loaded(), "complete", args, cancel_event)
+
+    def stream_complete(
+        self,
+        messages: list[dict[str, Any]],
+        n: int,
+        top_p: float,
+        temperature: float,
+        max_tokens: int | None,
+        stop: list[str] | None,
+        cancel_event: threading.Event,
+    ) -> AsyncIterator[tuple[str, int | None, Any]]:
+        """
+        流式返回无状态的对话补全事件，参数与返回值与 ChatGLM3.stream_complete 相同；与 stream_chat_reply 一样在返回前
+        完成排队检查
+
+        :raises QueueFullError: 工作进程的请求队列已满
+        :raises WorkerUnavailableError: 没有就绪的工作进程
+        """
+        worker: WorkerHandle = self._least_loaded()
+        args: tuple = (messages, n, top_p, temperature, max_tokens, stop)
+        request_id, queue = self._submit(worker, "stream_complete", args)
+
+        async def events() -> AsyncIterator[tuple[str, int | None, Any]]:
+            async for _, event in self._receive(worker, request_id, queue, cancel_event):
+                yield event
+
+        return events()
+
+    async def clear_history(self, session_id: str) -> bool:
+        """
+        清除会话所在工作进程中的聊天历史
+        """
+        index: int | None = self._sessions.pop(session_id, None)
+        if index is None or self.workers[index].status != "ready":
+            return False
+        return await self._call(self.workers[index], "clear_history", (session_id,))
+
+    async def cache_stats(self) -> dict[str, Any]:
+        """
+        各个就绪工作进程的缓存统计信息
+        """
+        ready: list[WorkerHandle] = [worker for worker in self.workers if worker.status == "ready"]
+        stats: list[Any] = await asyncio.gather(
+            *(self._call(worker, "cache_stats", ()) for worker in ready), return_exceptions=True
+        )
+        return {
+            str(worker.index): (f"{type(result).__name__}: {result}" if isinstance(result, Exception) else result)
+            for worker, result in zip(ready, stats)
+        }
+
+    def stats(self) -> dict[str, Any]:
+        """
+        请求分布与会话路由的统计信息
+        """
+        return {
+            "num_workers": self.num_workers,
+            "max_batch_size": self.max_batch_size,
+            "max_queue_size": self.max_queue_size,
+            "in_flight": sum(worker.in_flight for worker in self.workers),
+            "rejected": self.rejected,
+            "sessions": len(self._sessions),
+            "migrations": self.migrations,
+            "workers": [worker.progress() for worker in self.workers],
+        }
+
+    def progress(self) -> dict[str, Any]:
+        """
+        加载进度，至少一个工作进程就绪时为 ready
+        """
+        return {
+            "status": "ready" if self.ready else "loading",
+            "workers": [worker.progress() for worker in self.workers],
+        }
@@ -0,0 +1,3 @@
+"""
+性能基准测试，在 gradio_fastapi_demo 目录下以 python -m benchmarks.<name> 运行
+"""
@@ -0,0 +1,152 @@
+"""
+敏感词 logits processor 基准测试：在 CPU 上比较内置的 NoBadWordsLogitsProcessor 与编译为字典树的
+BlocklistLogitsProcessor 每个解码步骤的额外耗时，并校验两者禁止的 token 完全一致；同时比较 TokenTrie.from_words
+不使用磁盘缓存（分词与编译）与读取磁盘缓存的耗时
+
+默认使用替身分词器；--backend chatglm3 使用真实的 ChatGLM3 分词器（只加载分词器，需已下载模型）
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+from transformers import NoBadWordsLogitsProcessor
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import STUB_VOCAB, backend_name, create_backend  # pylint: disable=C0413
+from common.bad_words import BlocklistLogitsProcessor, TokenTrie  # pylint: disable=C0413
+
+# 与 ChatGLM3 的词表大小一致
+VOCAB_SIZE: int = 65024
+EOS_TOKEN_ID: int = 2
+
+
+def random_bad_words(rng: random.Random, count: int, token_range: int) -> list[list[int]]:
+    """
+    生成随机的敏感词 token 序列，长度为 1 到 4 个 token
+    """
+    return [[rng.randrange(3, token_range) for _ in range(rng.randint(1, 4))] for _ in range(count)]
+
+
+def random_input_ids(rng: random.Random, bad_words_ids: list[list[int]], batch: int, length: int, token_range: int):
+    """
+    生成随机的 input_ids，末尾有一定概率是某个敏感词的前缀
+    """
+    rows: list[list[int]] = []
+    for _ in range(batch):
+        row: list[int] = [rng.randrange(3, token_range) for _ in range(length)]
+        word: list[int] = rng.choice(bad_words_ids)
+        if len(word) > 1 and rng.random() < 0.5:
+            row[-(len(word) - 1) :] = word[:-1]
+        rows.append(row)
+    return torch.tensor(rows)
+
+
+def check_parity(rng: random.Random, bad_words_ids: list[list[int]], trials: int, token_range: int) -> int:
+    """
+    逐步解码，比较两种 processor 禁止的 token
+
+    :return: 不一致的步骤数
+    """
+    failures: int = 0
+    for _ in range(trials):
+        builtin = NoBadWordsLogitsProcessor(bad_words_ids, eos_token_id=EOS_TOKEN_ID)
+        processor = BlocklistLogitsProcessor(TokenTrie(bad_words_ids, [EOS_TOKEN_ID]))
+        input_ids = random_input_ids(rng, bad_words_ids, 4, 8, token_range)
+        for _ in range(8):
+            scores = torch.zeros(input_ids.shape[0], VOCAB_SIZE)
+            expected = torch.isinf(builtin(input_ids, scores.clone()))
+            actual = torch.isinf(processor(input_ids, scores.clone()))
+            failures += int(not torch.equal(expected, actual))
+            # 下一个 token 有一定概率沿着某个敏感词继续
+            next_ids = [rng.randrange(3, token_range) for _ in range(input_ids.shape[0])]
+            input_ids = torch.cat([input_ids, torch.tensor(next_ids)[:, None]], dim=1)
+    return failures
+
+
+def per_step_ms(processor_factory, input_ids: torch.Tensor, steps: int) -> float:
+    """
+    模拟逐步解码，返回每个步骤 processor 的平均耗时（毫秒）
+    """
+    processor = processor_factory()
+    scores = torch.randn(input_ids.shape[0], VOCAB_SIZE)
+    processor(input_ids, scores)  # 首次调用会准备掩码与状态，不计入
+    elapsed: float = 0.0
+    for step in range(steps):
+        input_ids = torch.cat([input_ids, torch.full((input_ids.shape[0], 1), 3 + step)], dim=1)
+        start: float = time.perf_counter()
+        processor(input_ids, scores)
+        elapsed += time.perf_counter() - start
+    return elapsed / steps * 1000
+
+
+def from_words_ms(tokenizer, words: list[str], eos_token_ids: list[int], repeats: int = 5) -> tuple[float, float]:
+    """
+    TokenTrie.from_words 不使用磁盘缓存（对敏感词分词并编译）与读取磁盘缓存（含计算缓存键）的耗时（毫秒），各取多次中最快的一次
+    """
+    build_ms: float = float("inf")
+    load_ms: float = float("inf")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path: str = f"{tmp}/trie.json"
+        TokenTrie.from_words(tokenizer, words, eos_token_ids, cache_path=cache_path)  # 写入缓存
+        for _ in range(repeats):
+            start: float = time.perf_counter()
+            TokenTrie.from_words(tokenizer, words, eos_token_ids)
+            build_ms = min(build_ms, (time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            TokenTrie.from_words(tokenizer, words, eos_token_ids, cache_path=cache_path)
+            load_ms = min(load_ms, (time.perf_counter() - start) * 1000)
+    return build_ms, load_ms
+
+
+def compare_processors(bad_words_ids: list[list[int]], input_ids: torch.Tensor, steps: int) -> tuple[float, float]:
+    """
+    NoBadWordsLogitsProcessor 与 BlocklistLogitsProcessor 每个解码步骤的平均耗时（毫秒）
+    """
+    trie = TokenTrie(bad_words_ids, [EOS_TOKEN_ID])
+    builtin_ms: float = per_step_ms(
+        lambda: NoBadWordsLogitsProcessor(bad_words_ids, eos_token_id=EOS_TOKEN_ID), input_ids, steps
+    )
+    trie_ms: float = per_step_ms(lambda: BlocklistLogitsProcessor(trie), input_ids, steps)
+    return builtin_ms, trie_ms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=backend_name("stub"), help="对敏感词分词的模型后端，见 common.backends.BACKENDS")
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--prompt-length", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+
+    RNG = random.Random(0)
+    # 使用较小的 token 范围，使随机序列中敏感词前缀的命中足够频繁
+    FAILURES: int = check_parity(RNG, random_bad_words(RNG, 200, 40), trials=50, token_range=40)
+    print(f"parity: {FAILURES} mismatched steps")
+
+    BACKEND = create_backend(args.backend)
+    BACKEND.load_tokenizer()
+    for word_count in args.words:
+        # 2 到 6 个字的随机敏感词
+        WORDS: list[str] = ["".join(RNG.choices(STUB_VOCAB, k=RNG.randint(2, 6))) for _ in range(word_count)]
+        BUILD_MS, LOAD_MS = from_words_ms(BACKEND.tokenizer, WORDS, BACKEND.eos_token_ids)
+        print(
+            f"{word_count} words ({args.backend} tokenizer): from_words without cache {BUILD_MS:.1f} ms, "
+            f"from disk cache {LOAD_MS:.1f} ms ({BUILD_MS / LOAD_MS:.1f}x)"
+        )
+        BAD_WORDS_IDS: list[list[int]] = random_bad_words(RNG, word_count, VOCAB_SIZE)
+        for batch_size in args.batch:
+            INPUT_IDS = random_input_ids(RNG, BAD_WORDS_IDS, batch_size, args.prompt_length, VOCAB_SIZE)
+            BUILTIN_MS, TRIE_MS = compare_processors(BAD_WORDS_IDS, INPUT_IDS, args.steps)
+            print(
+                f"  batch {batch_size}: NoBadWordsLogitsProcessor {BUILTIN_MS:.2f} ms/step, "
+                f"BlocklistLogitsProcessor {TRIE_MS:.2f} ms/step ({BUILTIN_MS / TRIE_MS:.0f}x)"
+            )
+
+    if FAILURES:
+        raise SystemExit("禁止的 token 与 NoBadWordsLogitsProcessor 不一致")
@@ -0,0 +1,64 @@
+"""
+连续批处理基准测试：使用随机权重的小型 GPT-2 模型在 CPU 上比较不同并发数下的总吞吐量
+"""
+import argparse
+import random
+import threading
+import time
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from api.batching import ContinuousBatchingEngine
+
+
+def build_model() -> GPT2LMHeadModel:
+    """
+    构建随机权重的小型 GPT-2 模型
+    """
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=4096, n_positions=1024, n_embd=256, n_layer=4, n_head=4)
+    return GPT2LMHeadModel(config).eval()
+
+
+def run(model: GPT2LMHeadModel, concurrency: int, requests: int, max_new_tokens: int) -> float:
+    """
+    以指定并发数提交请求，返回总吞吐量（tokens/s）
+    """
+    # GPT-2 的 past_key_values 形状为 [batch, heads, seq_len, head_dim]
+    engine = ContinuousBatchingEngine(model, max_batch_size=concurrency, kv_seq_dim=2, kv_batch_dim=0)
+    rng = random.Random(0)
+    prompts: list[list[int]] = [[rng.randrange(4096) for _ in range(rng.randint(16, 128))] for _ in range(requests)]
+    counts: list[int] = [0] * requests
+    semaphore = threading.Semaphore(concurrency)
+
+    def client(i: int) -> None:
+        with semaphore:
+            for _ in engine.submit(
+                prompts[i], top_p=0.8, temperature=0.8, max_new_tokens=max_new_tokens, eos_token_ids=[]
+            ):
+                counts[i] += 1
+
+    start: float = time.perf_counter()
+    threads: list[threading.Thread] = [threading.Thread(target=client, args=(i,)) for i in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed: float = time.perf_counter() - start
+    engine.shutdown()
+    return sum(counts) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    torch.set_num_threads(max(1, torch.get_num_threads()))
+    MODEL = build_model()
+    print(f"{'concurrency':>12} {'tokens/s':>10}")
+    for n in args.concurrency:
+        print(f"{n:>12} {run(MODEL, n, args.requests, args.max_new_tokens):>10.1f}")
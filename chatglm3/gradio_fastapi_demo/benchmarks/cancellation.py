@@ -0,0 +1,188 @@
+"""
+取消生成基准测试：消费方收到指定数量的 token 后同步设置取消事件，由生成方统计在观察到取消之后才开始的解码步骤
+生成的 token 数量（浪费的 token），覆盖：
+
+- generate 与 CancelStoppingCriteria
+- 连续批处理引擎（批次中的其余序列持续解码）
+- /stream_chat 的生成路径：ChatGLM3.stream_chat_reply 经由 session_stream_chat、ModelBackend.stream 与
+  CancelStoppingCriteria（替身模型）
+
+generate 与 /stream_chat 的生成方在消费方处理 token 时暂停，取消应在下一个解码步骤前生效，浪费的 token 为 0；
+引擎在独立线程中解码，取消恰好发生在解码步骤开始时最多浪费 1 个 token
+"""
+import argparse
+import sys
+import threading
+from pathlib import Path
+from typing import Any
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import StubBackend  # pylint: disable=C0413
+
+from api.batching import ContinuousBatchingEngine  # pylint: disable=C0413
+from api.cancellation import CancelStoppingCriteria  # pylint: disable=C0413
+from api.model import ChatGLM3  # pylint: disable=C0413
+from benchmarks.batching import build_model  # pylint: disable=C0413
+
+
+class CancellingStreamer(BaseStreamer):
+    """
+    收到指定数量的 token 后同步设置取消事件
+    """
+
+    def __init__(self, cancel_event: threading.Event, cancel_after: int) -> None:
+        self.cancel_event = cancel_event
+        self.cancel_after: int = cancel_after
+        self.received: int = 0
+
+    def put(self, value) -> None:
+        if self.received == 0 and value.dim() > 1:  # 第一次 put 的是提示词
+            self.received = -1
+        self.received += 1
+        if self.received == self.cancel_after:
+            self.cancel_event.set()
+
+    def end(self) -> None:
+        pass
+
+
+class WastedTokenCounter(StoppingCriteria):
+    """
+    统计 generate 在观察到取消之后才开始生成的 token 数量，从不停止生成
+
+    generate 生成每个 token 之后调用一次停止条件，上一次调用时已被取消说明本次的 token 是取消之后才生成的
+    """
+
+    def __init__(self, cancel_event: threading.Event) -> None:
+        self.cancel_event = cancel_event
+        self.wasted: int = 0
+        self._cancelled: bool = False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.wasted += self._cancelled
+        self._cancelled = self.cancel_event.is_set()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+class CountingEngine(ContinuousBatchingEngine):
+    """
+    统计解码步骤开始时已被取消的序列仍生成的 token 数量
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.wasted: int = 0
+
+    def _step(self) -> None:
+        cancelled: int = sum(sequence.cancelled for sequence in self._running)
+        super()._step()
+        self.wasted += cancelled
+
+
+class CountingStubBackend(StubBackend):
+    """
+    统计取消之后才开始的解码步骤数量的替身后端
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.cancel_event: threading.Event | None = None
+        self.wasted: int = 0
+
+    def decode_step(self, token_id: int, past_key_values: Any) -> tuple[torch.Tensor, Any]:
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.wasted += 1
+        return super().decode_step(token_id, past_key_values)
+
+
+def wasted_tokens_generate(model, cancel_after: int, max_new_tokens: int) -> int:
+    """
+    使用 generate 与 CancelStoppingCriteria 时取消后浪费的 token 数量
+    """
+    cancel_event = threading.Event()
+    counter = WastedTokenCounter(cancel_event)
+    model.generate(
+        torch.randint(0, 4096, (1, 32)),
+        do_sample=True,
+        max_new_tokens=max_new_tokens,
+        pad_token_id=0,
+        streamer=CancellingStreamer(cancel_event, cancel_after),
+        stopping_criteria=StoppingCriteriaList([counter, CancelStoppingCriteria(cancel_event)]),
+    )
+    return counter.wasted
+
+
+def wasted_tokens_engine(model, cancel_after: int, max_new_tokens: int, batch: int) -> int:
+    """
+    连续批处理引擎中取消一个序列后浪费的 token 数量，其余序列持续解码
+    """
+    engine = CountingEngine(model, max_batch_size=batch, kv_seq_dim=2, kv_batch_dim=0)
+    others = [engine.submit(list(range(1, 33)), 0.8, 0.8, max_new_tokens, []) for _ in range(batch - 1)]
+    cancel_event = threading.Event()
+    sequence = engine.submit(list(range(1, 33)), 0.8, 0.8, max_new_tokens, [], cancel_event)
+    received: int = 0
+    # 读完整个序列，引擎移除该序列后才结束
+    for _ in sequence:
+        received += 1
+        if received == cancel_after:
+            cancel_event.set()
+    for other in others:
+        other.cancel()
+    engine.shutdown()
+    return engine.wasted
+
+
+def wasted_tokens_stream_chat(chatbot: ChatGLM3, cancel_after: int, max_new_tokens: int, session_id: str) -> int:
+    """
+    经由 ChatGLM3.stream_chat_reply 生成时取消后浪费的 token 数量
+    """
+    backend: CountingStubBackend = chatbot.backend
+    backend.cancel_event, backend.wasted = threading.Event(), 0
+    received: int = 0
+    question: str = f"请写一段话[[tokens={max_new_tokens}]]"
+    for _ in chatbot.stream_chat_reply(session_id, [[question, None]], 0.8, 0.8, backend.cancel_event):
+        received += 1  # 替身模型的每个 token 都是一个完整的字符，每个 token 返回一次
+        if received == cancel_after:
+            backend.cancel_event.set()
+    return backend.wasted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cancel-after", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--trials", type=int, default=5)
+    args = parser.parse_args()
+
+    MODEL = build_model()
+    generate_wasted = [
+        wasted_tokens_generate(MODEL, args.cancel_after, args.max_new_tokens) for _ in range(args.trials)
+    ]
+    engine_wasted = [
+        wasted_tokens_engine(MODEL, args.cancel_after, args.max_new_tokens, args.batch) for _ in range(args.trials)
+    ]
+    CHATBOT = ChatGLM3(backend=CountingStubBackend(token_latency=0.001))
+    stream_chat_wasted = [
+        wasted_tokens_stream_chat(CHATBOT, args.cancel_after, args.max_new_tokens, f"cancel-{trial}")
+        for trial in range(args.trials)
+    ]
+    print(f"generate + CancelStoppingCriteria: wasted tokens per trial {generate_wasted}")
+    print(f"ContinuousBatchingEngine (batch={args.batch}): wasted tokens per trial {engine_wasted}")
+    print(f"stream_chat_reply (stub): wasted tokens per trial {stream_chat_wasted}")
+    print(f"without cancellation each request would decode {args.max_new_tokens - args.cancel_after} more tokens")
+    failures: int = 0
+    # 生成方在消费方处理 token 时暂停，取消在下一个解码步骤前生效
+    if max(generate_wasted + stream_chat_wasted) > 0:
+        failures += 1
+        print("generate 或 stream_chat_reply 在取消之后仍生成了 token")
+    # 引擎与消费方并行，取消应在一个解码步骤内生效
+    if max(engine_wasted) > 1:
+        failures += 1
+        print("连续批处理引擎取消后浪费的 token 超过 1 个")
+    if failures:
+        raise SystemExit(f"{failures} 项校验失败")
@@ -0,0 +1,94 @@
+"""
+流式解码基准测试：生成 2k token 的回复时，比较每步对完整输出重新解码与增量解码的每 token 耗时，并校验增量解码
+输出的文本与完整解码一致、且不包含不完整多字节字符产生的替换字符
+
+默认使用替身分词器与逐字节解码的分词器（模拟 SentencePiece 的字节回退）；--backend chatglm3 使用真实的 ChatGLM3
+分词器（只加载分词器，需已下载模型）
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import STUB_VOCAB, backend_name, create_backend  # pylint: disable=C0413
+from common.detokenizer import REPLACEMENT_CHAR, IncrementalDetokenizer  # pylint: disable=C0413
+
+
+def decode_bytes(token_ids: list[int]) -> str:
+    """
+    每个 token 为一个 UTF-8 字节，汉字由三个 token 组成
+    """
+    return bytes(token_ids).decode("utf-8", errors="replace")
+
+
+def full_decode(decode: Callable[[list[int]], str], token_ids: list[int]) -> tuple[list[str], float]:
+    """
+    原有做法：每步解码完整输出，末尾为替换字符时跳过该步
+
+    :return: 每步返回的完整回复与总耗时
+    """
+    replies: list[str] = []
+    start: float = time.perf_counter()
+    for end in range(1, len(token_ids) + 1):
+        response: str = decode(token_ids[:end])
+        if response and response[-1] != REPLACEMENT_CHAR:
+            replies.append(response)
+    return replies, time.perf_counter() - start
+
+
+def incremental_decode(decode: Callable[[list[int]], str], token_ids: list[int]) -> tuple[list[str], float]:
+    """
+    增量解码
+
+    :return: 每步新增的文本与总耗时
+    """
+    deltas: list[str] = []
+    detokenizer = IncrementalDetokenizer(decode)
+    start: float = time.perf_counter()
+    for token_id in token_ids:
+        delta: str = detokenizer.add(token_id)
+        if delta:
+            deltas.append(delta)
+    return deltas, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=backend_name("stub"), help="模型后端，见 common.backends.BACKENDS")
+    parser.add_argument("--tokens", type=int, default=2048, help="回复的 token 数量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    BACKEND = create_backend(args.backend)
+    BACKEND.load_tokenizer()
+    # 混合汉字、ASCII 与换行的回复文本，按各分词器编码后截取指定数量的 token
+    TEXT: str = "".join(rng.choices(STUB_VOCAB + "abcdefghij 0123456789,.\n", k=args.tokens * 2))
+    CASES: list[tuple[str, Callable[[list[int]], str], list[int]]] = [
+        (args.backend, BACKEND.decode, BACKEND.tokenizer.encode(TEXT, add_special_tokens=False)[: args.tokens]),
+        ("utf-8 bytes", decode_bytes, list(TEXT.encode("utf-8"))[: args.tokens]),
+    ]
+
+    failures: int = 0
+    print(f"{'tokenizer':>12} {'tokens':>7} {'full us/token':>14} {'incremental us/token':>21} {'speedup':>8}")
+    for name, decode, token_ids in CASES:
+        replies, full = full_decode(decode, token_ids)
+        deltas, incremental = incremental_decode(decode, token_ids)
+        print(
+            f"{name:>12} {len(token_ids):>7} {full / len(token_ids) * 1e6:>14.1f} "
+            f"{incremental / len(token_ids) * 1e6:>21.1f} {full / incremental:>7.1f}x"
+        )
+        # 增量输出拼接后应与完整解码的最后一次回复一致，且每段都不含替换字符
+        text: str = "".join(deltas)
+        if text != replies[-1]:
+            failures += 1
+            print(f"{name}: 增量解码的文本与完整解码不一致")
+        if any(REPLACEMENT_CHAR in delta for delta in deltas):
+            failures += 1
+            print(f"{name}: 增量解码输出了替换字符")
+    if failures:
+        raise SystemExit(f"{failures} 项校验失败")
+    print("incremental text parity: ok")
@@ -0,0 +1,267 @@
+"""
+API 服务压测：以不同并发数请求 /chat 与 /stream_chat，统计首 token 延迟（TTFT）、token 间延迟（ITL）、
+吞吐量与端到端延迟的 p50/p95/p99，结果可输出为 JSON 以便与历史结果比较
+
+不指定 --url 时在进程内以确定性的替身模型启动服务，无需 GPU 与模型文件；替身模型每个汉字为一个 token
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import STUB_VOCAB, StubBackend  # pylint: disable=C0413
+
+
+def sample_length(rng: random.Random, spec: str) -> int:
+    """
+    按长度分布采样
+
+    :param spec: fixed:N、uniform:LOW:HIGH 或 normal:MEAN:STD
+    :return: 长度，至少为 1
+    """
+    kind, *values = spec.split(":")
+    numbers: list[float] = [float(value) for value in values]
+    if kind == "fixed":
+        length: float = numbers[0]
+    elif kind == "uniform":
+        length = rng.randint(int(numbers[0]), int(numbers[1]))
+    elif kind == "normal":
+        length = rng.gauss(numbers[0], numbers[1])
+    else:
+        raise ValueError(f"未知的长度分布：{spec}")
+    return max(1, round(length))
+
+
+def make_prompt(rng: random.Random, prompt_tokens: int, response_tokens: int) -> str:
+    """
+    生成指定长度的提问，[[tokens=N]] 标记指定替身模型回复的 token 数量（真实模型会忽略该标记）
+    """
+    marker: str = f"[[tokens={response_tokens}]]"
+    body: str = "".join(rng.choices(STUB_VOCAB, k=max(0, prompt_tokens - len(marker))))
+    return body + marker
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    线性插值的分位数
+    """
+    values = sorted(values)
+    position: float = (len(values) - 1) * q
+    low: int = int(position)
+    high: int = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(values: list[float]) -> dict[str, float] | None:
+    """
+    均值与 p50/p95/p99（毫秒），没有数据时返回 None
+    """
+    if not values:
+        return None
+    return {
+        "mean": statistics.fmean(values) * 1000,
+        "p50": percentile(values, 0.50) * 1000,
+        "p95": percentile(values, 0.95) * 1000,
+        "p99": percentile(values, 0.99) * 1000,
+    }
+
+
+async def stream_request(client: httpx.AsyncClient, payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    请求 /stream_chat（SSE 格式），记录每个 delta 事件的到达时间，事件中的每个字符计为一个 token
+    """
+    start: float = time.perf_counter()
+    token_times: list[float] = []
+    async with client.stream("POST", "/stream_chat", json={**payload, "stream_format": "sse"}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"status": response.status_code, "e2e": time.perf_counter() - start, "token_times": []}
+        event: str = ""
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: ") :]
+            elif line.startswith("data: ") and event in ("delta", "replace"):
+                now: float = time.perf_counter()
+                text: str = json.loads(line[len("data: ") :])["text"]
+                if event == "replace":
+                    text = text[len(token_times) :]
+                # 一个事件可能包含多个 token，均记为同一时刻到达
+                token_times.extend([now] * len(text))
+    return {"status": 200, "e2e": time.perf_counter() - start, "start": start, "token_times": token_times}
+
+
+async def chat_request(client: httpx.AsyncClient, payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    请求 /chat，完整回复一次返回，只统计端到端延迟与 token 数量
+    """
+    start: float = time.perf_counter()
+    response = await client.post("/chat", json=payload)
+    elapsed: float = time.perf_counter() - start
+    if response.status_code != 200:
+        return {"status": response.status_code, "e2e": elapsed, "token_times": []}
+    return {"status": 200, "e2e": elapsed, "tokens": len(response.json())}
+
+
+async def run_level(
+    base_url: str, endpoint: str, concurrency: int, requests: int, args: argparse.Namespace
+) -> dict[str, Any]:
+    """
+    以固定并发数发送请求，统计一轮压测的结果
+    """
+    rng = random.Random(args.seed)
+    payloads: list[dict[str, Any]] = []
+    for _ in range(requests):
+        prompt: str = make_prompt(rng, sample_length(rng, args.prompt_length), sample_length(rng, args.response_length))
+        payloads.append(
+            {
+                "chat_history": [[prompt, None]],
+                "top_p": 0.8,
+                "temperature": args.temperature,
+                # 每个请求使用独立的会话，避免同一会话的新请求取消旧请求
+                "session_id": uuid.uuid4().hex,
+            }
+        )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+
+        async def worker(payload: dict[str, Any]) -> dict[str, Any]:
+            async with semaphore:
+                try:
+                    if endpoint == "stream_chat":
+                        return await stream_request(client, payload)
+                    return await chat_request(client, payload)
+                except httpx.HTTPError as e:
+                    return {"status": type(e).__name__, "e2e": 0.0, "token_times": []}
+
+        start: float = time.perf_counter()
+        results: list[dict[str, Any]] = await asyncio.gather(*(worker(payload) for payload in payloads))
+        elapsed: float = time.perf_counter() - start
+
+    ok: list[dict[str, Any]] = [result for result in results if result["status"] == 200]
+    errors: dict[str, int] = {}
+    for result in results:
+        if result["status"] != 200:
+            errors[str(result["status"])] = errors.get(str(result["status"]), 0) + 1
+    ttft: list[float] = []
+    itl: list[float] = []
+    tokens: int = 0
+    for result in ok:
+        if endpoint == "stream_chat":
+            times: list[float] = result["token_times"]
+            tokens += len(times)
+            if times:
+                ttft.append(times[0] - result["start"])
+                itl.extend(later - earlier for earlier, later in zip(times, times[1:]))
+        else:
+            tokens += result["tokens"]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "completed": len(ok),
+        "errors": errors,
+        "duration_s": elapsed,
+        "requests_per_s": len(ok) / elapsed,
+        "tokens_per_s": tokens / elapsed,
+        "ttft_ms": summarize(ttft) if endpoint == "stream_chat" else None,
+        "itl_ms": summarize(itl) if endpoint == "stream_chat" else None,
+        "e2e_ms": summarize([result["e2e"] for result in ok]),
+    }
+
+
+def start_stub_server(args: argparse.Namespace, port: int) -> str:
+    """
+    在后台线程中以替身模型启动 API 服务
+
+    :return: 服务地址
+    """
+    import uvicorn  # pylint: disable=C0415
+
+    from api.metrics import METRICS  # pylint: disable=C0415
+    from api.model import ChatGLM3, ChatGLM3Factory  # pylint: disable=C0415
+
+    # 路由模块导入时创建工厂单例与工作进程池，需在导入 api.main 之前注入替身模型或设置环境变量
+    if args.replicas > 1:
+        # 各工作进程自行创建替身后端，使用其默认的延迟参数
+        os.environ["LLM_BACKEND"] = "stub"
+        os.environ["LLM_REPLICAS"] = str(args.replicas)
+        ChatGLM3Factory(max_batch_size=args.max_batch_size)
+    else:
+        backend = StubBackend(prefill_latency=args.prefill_latency, token_latency=args.token_latency)
+        ChatGLM3Factory(model_instance=ChatGLM3(backend=backend, max_batch_size=args.max_batch_size, metrics=METRICS))
+    from api.main import app  # pylint: disable=C0415
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base_url: str = f"http://127.0.0.1:{port}"
+    while not server.started or httpx.get(f"{base_url}/readyz").status_code != 200:
+        time.sleep(0.1)
+    return base_url
+
+
+def print_result(result: dict[str, Any]) -> None:
+    """
+    打印一轮压测结果
+    """
+
+    def fmt(stats: dict[str, float] | None) -> str:
+        if stats is None:
+            return "-"
+        return f"{stats['p50']:.0f}/{stats['p95']:.0f}/{stats['p99']:.0f}"
+
+    errors: int = sum(result["errors"].values())
+    print(
+        f"{result['endpoint']:>12} {result['concurrency']:>5} {result['requests_per_s']:>7.2f} "
+        f"{result['tokens_per_s']:>9.1f} {fmt(result['ttft_ms']):>16} {fmt(result['itl_ms']):>12} "
+        f"{fmt(result['e2e_ms']):>18} {errors:>6}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="已启动的服务地址，例如 http://127.0.0.1:8000；不指定时使用替身模型")
+    parser.add_argument("--endpoint", choices=["chat", "stream_chat"], nargs="+", default=["stream_chat", "chat"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="每个并发数发送的请求数量")
+    parser.add_argument("--prompt-length", default="uniform:16:256", help="提问长度分布（token）")
+    parser.add_argument("--response-length", default="normal:64:16", help="回复长度分布（token，仅替身模型遵循）")
+    parser.add_argument("--temperature", type=float, default=0.8, help="大于 0.01 时不命中回复缓存")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765, help="替身模型服务的端口")
+    parser.add_argument("--prefill-latency", type=float, default=0.0002, help="替身模型每个提示词 token 的耗时（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="替身模型每个解码步骤的耗时（秒）")
+    parser.add_argument("--max-batch-size", type=int, default=1, help="替身模型服务的连续批处理大小")
+    parser.add_argument("--replicas", type=int, default=1, help="替身模型服务的模型工作进程数量，大于 1 时启用多副本")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    BASE_URL: str = args.url or start_stub_server(args, args.port)
+    print(
+        f"{'endpoint':>12} {'conc':>5} {'req/s':>7} {'tokens/s':>9} {'ttft p50/95/99':>16} "
+        f"{'itl p50/95/99':>12} {'e2e ms p50/95/99':>18} {'errors':>6}"
+    )
+    RESULTS: list[dict[str, Any]] = []
+    for endpoint in args.endpoint:
+        for concurrency in args.concurrency:
+            RESULTS.append(asyncio.run(run_level(BASE_URL, endpoint, concurrency, args.requests, args)))
+            print_result(RESULTS[-1])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"url": args.url or "stub", "config": vars(args), "results": RESULTS}, f, ensure_ascii=False, indent=2
+            )
@@ -0,0 +1,106 @@
+"""
+Markdown 渲染基准测试：模拟 MiniCPM Demo 中 200 轮的流式对话，比较每次聊天框更新时全部重新渲染与使用缓存的耗时，
+并校验缓存的渲染结果与 mdtex2html.convert 完全一致
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import mdtex2html
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.markdown_render import MarkdownRenderer  # pylint: disable=C0413
+
+PIECES: list[str] = [
+    "这是一段说明文字，",
+    "**加粗** 与 *斜体*，",
+    "行内代码 `x = 1`，",
+    "公式 $E = mc^2$，",
+    "$$\\sum_{i=1}^{n} i = \\frac{n(n+1)}{2}$$",
+    "\n- 列表项\n- 列表项\n",
+    "\n\n",
+    "\n```python\ndef add(a, b):\n    return a + b\n```\n",
+    "\n\n| a | b |\n| - | - |\n| 1 | 2 |\n\n",
+]
+
+
+def random_reply(rng: random.Random, pieces: int) -> str:
+    """
+    生成包含段落、代码块与公式的随机回复
+    """
+    return "".join(rng.choice(PIECES) for _ in range(pieces))
+
+
+def stream_prefixes(text: str, chunk_size: int) -> list[str]:
+    """
+    流式输出过程中回复依次经过的各个前缀
+    """
+    return [text[:end] for end in range(chunk_size, len(text) + chunk_size, chunk_size)]
+
+
+def postprocess(history: list[tuple[str, str | None]], render) -> list[tuple[str, str | None]]:
+    """
+    与 MiniCPM Demo 中 gr.Chatbot.postprocess 相同的处理
+    """
+    return [(render(message), None if response is None else render(response)) for message, response in history]
+
+
+def check_parity(cases: int, chunk_size: int) -> int:
+    """
+    校验流式输出的每个前缀的缓存渲染结果都与 mdtex2html.convert 一致
+
+    :return: 不一致的次数
+    """
+    rng = random.Random(1)
+    renderer = MarkdownRenderer()
+    failures: int = 0
+    for _ in range(cases):
+        for prefix in stream_prefixes(random_reply(rng, rng.randint(1, 12)), chunk_size):
+            if renderer.render(prefix) != mdtex2html.convert(prefix):
+                failures += 1
+    return failures
+
+
+def measure(history: list[tuple[str, str | None]], render) -> float:
+    """
+    一次聊天框更新的耗时（秒）
+    """
+    start: float = time.perf_counter()
+    postprocess(history, render)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--reply-pieces", type=int, default=8, help="每条回复由多少个随机片段组成")
+    parser.add_argument("--chunk-size", type=int, default=16, help="流式输出每次更新新增的字符数")
+    parser.add_argument("--sample-every", type=int, default=40, help="每隔多少轮测量一次全部重新渲染的耗时")
+    parser.add_argument("--cases", type=int, default=100)
+    args = parser.parse_args()
+
+    failures = check_parity(args.cases, args.chunk_size)
+    print(f"parity: {args.cases} streamed replies, {failures} mismatches")
+
+    rng = random.Random(0)
+    RENDERER = MarkdownRenderer()
+    history: list[tuple[str, str | None]] = []
+    print(f"{'turn':>5} {'updates':>8} {'cached ms/update':>17} {'uncached ms/update':>19}")
+    for turn in range(1, args.turns + 1):
+        history.append((f"第 {turn} 个问题：如何计算 $x^{turn}$ 的导数？", None))
+        reply: str = random_reply(rng, args.reply_pieces)
+        prefixes: list[str] = stream_prefixes(reply, args.chunk_size)
+        cached: float = 0.0
+        for prefix in prefixes:
+            history[-1] = (history[-1][0], prefix)
+            cached += measure(history, RENDERER.render)
+        if turn == 1 or turn % args.sample_every == 0:
+            # 全部重新渲染的耗时只在最后一次更新时测量
+            uncached: float = measure(history, mdtex2html.convert)
+            print(f"{turn:>5} {len(prefixes):>8} {cached / len(prefixes) * 1000:>17.2f} {uncached * 1000:>19.2f}")
+    print(f"cache: {RENDERER.stats()}")
+
+    if failures:
+        raise SystemExit("缓存的渲染结果与 mdtex2html.convert 不一致")
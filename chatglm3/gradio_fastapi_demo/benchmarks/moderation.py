@@ -0,0 +1,78 @@
+"""
+流式审核基准测试：使用 1 万个敏感词，比较每个片段都对完整回复逐词查找与 Aho-Corasick 流式审核的耗时
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.moderation import AhoCorasick, StreamModerator  # pylint: disable=C0413
+
+# 常用汉字范围内随机组词
+CHARS: list[str] = [chr(code) for code in range(0x4E00, 0x4E00 + 3000)]
+
+
+def random_words(rng: random.Random, count: int) -> list[str]:
+    """
+    生成随机敏感词
+    """
+    return ["".join(rng.choices(CHARS, k=rng.randint(2, 6))) for _ in range(count)]
+
+
+def naive_stream(words: list[str], chunks: list[str]) -> bool:
+    """
+    原有做法：每收到一个片段都在完整回复中逐个查找敏感词
+    """
+    response: str = ""
+    for chunk in chunks:
+        response += chunk
+        if any(word in response for word in words):
+            return True
+    return False
+
+
+def automaton_stream(automaton: AhoCorasick, chunks: list[str]) -> bool:
+    """
+    流式审核：每个片段只处理新增的字符
+    """
+    moderator = StreamModerator(automaton, mode="stop")
+    for chunk in chunks:
+        moderator.feed(chunk)
+        if moderator.blocked:
+            return True
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=10000)
+    parser.add_argument("--reply-chars", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=2, help="每个片段的字符数，约等于一个 token")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    WORDS = random_words(rng, args.words)
+    start = time.perf_counter()
+    AUTOMATON = AhoCorasick(WORDS)
+    print(f"build automaton: {len(WORDS)} words, {len(AUTOMATON.goto)} states in {time.perf_counter() - start:.2f} s")
+
+    REPLY = "".join(rng.choices(CHARS, k=args.reply_chars))
+    CHUNKS = [REPLY[i : i + args.chunk_size] for i in range(0, len(REPLY), args.chunk_size)]
+    for name, fn, arg in (
+        ("naive any(word in response)", naive_stream, WORDS),
+        ("aho-corasick", automaton_stream, AUTOMATON),
+    ):
+        start = time.perf_counter()
+        blocked = fn(arg, CHUNKS)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name}: {len(CHUNKS)} chunks in {elapsed * 1000:.1f} ms, "
+            f"{elapsed / len(CHUNKS) * 1e6:.1f} us/chunk, blocked={blocked}"
+        )
+
+    # 两种做法的检测结果应一致：在回复末尾插入一个敏感词
+    BAD_CHUNKS = CHUNKS + [rng.choice(WORDS)]
+    if not (naive_stream(WORDS, BAD_CHUNKS) and automaton_stream(AUTOMATON, BAD_CHUNKS)):
+        raise SystemExit("未检测到插入的敏感词")
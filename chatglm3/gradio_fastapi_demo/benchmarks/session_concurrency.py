@@ -0,0 +1,74 @@
+"""
+同一会话并发请求的校验：多个线程同时向同一个会话（未指定会话 ID 时的默认会话）发送提问，生成结束后会话的聊天记录
+应与依次发送时一样由完整的对话轮次组成：用户提问与助手回复交替出现，每个提问恰好出现一次，并报告总耗时
+
+逐请求生成与连续批处理（不同会话的请求共享解码步骤）分别校验，使用替身模型
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import StubBackend  # pylint: disable=C0413
+
+from api.model import ChatGLM3  # pylint: disable=C0413
+from api.session import DEFAULT_SESSION_ID  # pylint: disable=C0413
+
+
+def check_session(chatbot: ChatGLM3, threads: int, tokens: int) -> tuple[list[str], float]:
+    """
+    多个线程同时向默认会话提问
+
+    :param chatbot: 模型
+    :param threads: 并发的请求数量
+    :param tokens: 每条回复的 token 数量
+    :return: 聊天记录中不符合预期的问题与总耗时
+    """
+    questions: list[str] = [f"第{i}个问题[[tokens={tokens}]]" for i in range(threads)]
+    barrier = threading.Barrier(threads)
+
+    def client(question: str) -> None:
+        barrier.wait()
+        chatbot.chat_reply(DEFAULT_SESSION_ID, [[question, None]], top_p=0.8, temperature=0.8)
+
+    start: float = time.perf_counter()
+    workers: list[threading.Thread] = [threading.Thread(target=client, args=(question,)) for question in questions]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed: float = time.perf_counter() - start
+
+    problems: list[str] = []
+    messages = chatbot.conversations.get(DEFAULT_SESSION_ID).messages
+    roles: list[str] = [message["role"] for message in messages]
+    if roles != ["user", "assistant"] * threads:
+        problems.append(f"消息的角色顺序为 {roles}")
+    asked: list[str] = sorted(message["content"] for message in messages if message["role"] == "user")
+    if asked != sorted(questions):
+        problems.append(f"聊天记录中的提问为 {asked}")
+    return problems, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8, help="同时向同一会话提问的线程数量")
+    parser.add_argument("--tokens", type=int, default=16, help="每条回复的 token 数量")
+    args = parser.parse_args()
+
+    failures: int = 0
+    for mode, max_batch_size in (("plain", 1), ("batched", 4)):
+        CHATBOT = ChatGLM3(backend=StubBackend(token_latency=0.001), max_batch_size=max_batch_size)
+        PROBLEMS, ELAPSED = check_session(CHATBOT, args.threads, args.tokens)
+        if CHATBOT.engine is not None:
+            CHATBOT.engine.shutdown()
+        failures += bool(PROBLEMS)
+        print(
+            f"{mode:>7}: {args.threads} concurrent requests on one session in {ELAPSED:.2f}s {'FAIL' if PROBLEMS else 'ok'}"
+        )
+        for problem in PROBLEMS:
+            print(f"  {problem}")
+    if failures:
+        raise SystemExit(f"{failures} 项校验失败")
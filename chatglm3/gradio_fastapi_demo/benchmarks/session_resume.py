@@ -0,0 +1,105 @@
+"""
+会话 KV 缓存复用的校验：随机权重的小型 GPT-2 模型（替身分词器）经由 ChatGLM3.session_stream_chat 进行多轮对话，
+每轮开始前比较复用上一轮 KV 缓存、只 prefill 新提问得到的 logits 与对完整聊天记录重新分词并 prefill 的 logits，
+两者应在浮点误差内一致；逐 token 解码与投机解码（从聊天记录中查找草稿）分别校验
+
+ChatGLM3 分词器下续接提示词与完整提示词的一致性见 benchmarks.tokenization --backend chatglm3
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+from typing import Any
+
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import STUB_VOCAB, StubBackend  # pylint: disable=C0413
+
+from api.model import ChatGLM3  # pylint: disable=C0413
+
+
+class RandomWeightBackend(StubBackend):
+    """
+    替身分词器与随机权重的小型 GPT-2 模型
+
+    只保留可以由文本还原的 token 与结束 token，使写入聊天记录的回复重新分词后与生成的 token 完全一致
+    """
+
+    kv_seq_dim: int = 2
+    kv_batch_dim: int = 0
+
+    def load(self) -> None:
+        self.load_tokenizer()
+        config = GPT2Config(vocab_size=self.tokenizer.vocab_size, n_positions=4096, n_embd=64, n_layer=2, n_head=2)
+        self.model = GPT2LMHeadModel(config).eval()
+
+    def score(self, input_ids: list[int], past_key_values: Any = None) -> tuple[torch.Tensor, Any]:
+        logits, past_key_values = super().score(input_ids, past_key_values)
+        # 解码为空字符串的特殊 token 不会出现在回复文本中
+        masked: list[int] = [i for i in range(8) if i not in self.eos_token_ids]
+        logits[:, masked] = float("-inf")
+        return logits, past_key_values
+
+
+def check_resume(backend: RandomWeightBackend, turns: int, speculative_tokens: int, rng: random.Random) -> float:
+    """
+    进行多轮对话，返回复用 KV 缓存与完整 prefill 的 logits 的最大误差，提示词不一致或未复用 KV 缓存时返回 inf
+
+    :param backend: 已加载的模型后端
+    :param turns: 对话轮数
+    :param speculative_tokens: 投机解码每轮最多验证的草稿 token 数量，为 0 时逐 token 解码
+    :param rng: 生成提问的随机数发生器
+    """
+    chatbot = ChatGLM3(backend=backend, max_history_tokens=None, speculative_tokens=speculative_tokens)
+    session_id: str = "resume"
+    max_error: float = 0.0
+    for turn in range(turns):
+        question: str = "".join(rng.choices(STUB_VOCAB, k=rng.randint(4, 32)))
+        conversation = chatbot.conversations.get(session_id)
+        if turn > 0:
+            past_key_values = chatbot.kv_cache.take(session_id, conversation.digest)
+            if past_key_values is None:
+                print(f"第 {turn + 1} 轮未复用 KV 缓存")
+                return float("inf")
+            continued: list[int] = chatbot.build_prompt(conversation, question, continuation=True)
+            full: list[int] = backend.tokenize(question, conversation.messages)
+            if backend.kv_length(past_key_values) + len(continued) != len(full):
+                print(
+                    f"第 {turn + 1} 轮 KV 缓存 {backend.kv_length(past_key_values)} + 续接 {len(continued)} "
+                    f"与完整提示词 {len(full)} 的长度不一致"
+                )
+                return float("inf")
+            with torch.inference_mode():
+                resumed_logits, _ = backend.prefill(continued, past_key_values)
+                full_logits, _ = backend.prefill(full)
+            finite = torch.isfinite(full_logits)
+            max_error = max(max_error, float((resumed_logits[finite] - full_logits[finite]).abs().max()))
+            chatbot.kv_cache.put(session_id, conversation.digest, past_key_values)
+        # 每轮回复最多 32 个 token
+        chatbot.max_length = len(backend.tokenize(question, conversation.messages)) + 32
+        chatbot.chat_reply(session_id, [[question, None]], top_p=0.9, temperature=1.0)
+    return max_error
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=8, help="对话轮数")
+    parser.add_argument("--draft-tokens", type=int, default=4, help="投机解码每轮最多验证的草稿 token 数量")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="logits 的最大允许误差")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    BACKEND = RandomWeightBackend()
+    BACKEND.load()
+    failures: int = 0
+    for mode, draft_tokens in (("plain", 0), ("lookup", args.draft_tokens)):
+        error: float = check_resume(BACKEND, args.turns, draft_tokens, random.Random(args.seed))
+        ok: bool = error <= args.tolerance
+        failures += not ok
+        print(f"{mode:>7}: max |resumed - full prefill| logits = {error:.2e} {'ok' if ok else 'FAIL'}")
+    if failures:
+        raise SystemExit(f"{failures} 项校验失败")
+    print("resume equals full prefill: ok")
@@ -0,0 +1,139 @@
+"""
+投机解码基准测试：比较逐 token 解码与投机解码（从聊天记录中查找草稿、可选的草稿模型）的生成速度，报告草稿接受率、
+每次前向计算生成的 token 数量与加速比，并校验：
+
+- 贪心解码时投机解码的回复与逐 token 解码完全一致
+- 投机采样的验证（verify_draft）输出的 token 与直接从目标分布采样同分布（随机分布上的蒙特卡洛检验）
+
+默认使用替身模型，提问中的 [[copy=P]] 使约 P% 的回复 token 逐字复用提问，模拟改写、总结与代码修改等回复大量
+引用上文的场景；--backend chatglm3 --cpu 在 CPU 上测试真实的 ChatGLM3（需已下载模型，标记被真实模型忽略），
+真实模型的浮点误差在极少数情况下可能使贪心解码的并列最大值不同
+
+例如：python -m benchmarks.speculative --backend chatglm3 --cpu --tokens 256
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import ModelBackend, StubBackend, backend_name, create_backend  # pylint: disable=C0413
+from common.sampling import verify_draft  # pylint: disable=C0413
+from common.speculative import DraftModelDrafter, Drafter, PromptLookupDrafter  # pylint: disable=C0413
+
+CODE: str = "\n".join(f"def step_{i}(x):\n    total = x * {i} + 1\n    return total\n" for i in range(8))
+# (名称, 提问)：改写代码与复述文本的回复大量引用提问，自由问答几乎没有可查找的草稿
+CASES: list[tuple[str, str]] = [
+    ("code edit", f"把下面代码中的变量 total 改名为 result，输出完整的代码：\n{CODE}[[copy=90]]"),
+    ("summarize", "用原文中的句子概括：大语言模型逐个生成 token，每一步都要读取全部权重，CPU 推理受内存带宽限制。[[copy=60]]"),
+    ("open chat", "请介绍一下你自己。[[copy=0]]"),
+]
+
+
+def check_verify(trials: int, vocab_size: int = 8) -> float:
+    """
+    在随机的目标分布与草稿分布上重复验证草稿，统计输出的 token 与目标分布的总变差距离
+
+    :param trials: 每种草稿的验证次数
+    :param vocab_size: 词表大小
+    :return: 确定性草稿与随机草稿中较大的总变差距离
+    """
+    probs = torch.softmax(torch.randn(vocab_size) * 2, dim=-1)
+    draft_probs = torch.softmax(torch.randn(vocab_size) * 2, dim=-1)
+    distances: list[float] = []
+    for draft in (None, draft_probs):
+        counts = torch.zeros(vocab_size)
+        for _ in range(trials):
+            # 草稿 token 从草稿分布中采样，确定性的草稿固定为目标分布中概率较低的 token
+            token_id: int = int(probs.argmin()) if draft is None else int(torch.multinomial(draft, 1))
+            counts[verify_draft(probs, token_id, draft)[1]] += 1
+        distances.append(float((counts / trials - probs).abs().sum() / 2))
+    return max(distances)
+
+
+def generate(
+    backend: ModelBackend, prompt: str, max_new_tokens: int, drafter: Drafter | None
+) -> tuple[str, int, float]:
+    """
+    贪心生成一条回复
+
+    :return: 回复、生成的 token 数量与耗时
+    """
+    input_ids: list[int] = backend.tokenize(prompt, [])
+    reply: str = ""
+    past_key_values: Any = None
+    start: float = time.perf_counter()
+    for reply, _, past_key_values in backend.stream(
+        prompt,
+        [],
+        temperature=0.01,
+        max_length=len(input_ids) + max_new_tokens,
+        input_ids=input_ids,
+        drafter=drafter,
+    ):
+        pass
+    elapsed: float = time.perf_counter() - start
+    # 返回的 KV 缓存包含提示词与回复的全部 token
+    return reply, backend.kv_length(past_key_values) - len(input_ids), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=backend_name("stub"), help="模型后端，见 common.backends.BACKENDS")
+    parser.add_argument("--cpu", action="store_true", help="CPU 推理（is_cpu=True）")
+    parser.add_argument("--draft-backend", default=None, help="草稿模型后端，须与目标模型共享词表；stub 为更快的替身")
+    parser.add_argument("--draft-tokens", type=int, default=4, help="每轮最多验证的草稿 token 数量")
+    parser.add_argument("--tokens", type=int, default=128, help="每条回复最多生成的 token 数量")
+    parser.add_argument("--trials", type=int, default=20000, help="分布检验中每种草稿的验证次数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    KWARGS: dict[str, Any] = {"is_cpu": args.cpu} if args.backend in ("chatglm3", "minicpm") else {}
+    BACKEND: ModelBackend = create_backend(args.backend, load=True, **KWARGS)
+    DRAFT_BACKEND: ModelBackend | None = None
+    if args.draft_backend == "stub":
+        # 替身草稿模型与替身目标模型的输出相同，解码步骤快 10 倍，相当于接受率的上限
+        DRAFT_BACKEND = StubBackend(token_latency=0.002)
+        DRAFT_BACKEND.load()
+    elif args.draft_backend is not None:
+        DRAFT_BACKEND = create_backend(args.draft_backend, load=True, **KWARGS)
+    # 预热，不计入耗时
+    generate(BACKEND, CASES[-1][1], 4, None)
+
+    failures: int = 0
+    print(
+        f"{'case':>10} {'mode':>7} {'tokens':>7} {'tokens/s':>9} {'accept':>7} "
+        f"{'tokens/forward':>15} {'speedup':>8} {'parity':>7}"
+    )
+    for name, prompt in CASES:
+        # [[tokens=N]] 使替身模型回复 N 个 token
+        prompt += f"[[tokens={args.tokens}]]"
+        baseline, tokens, elapsed = generate(BACKEND, prompt, args.tokens, None)
+        print(
+            f"{name:>10} {'plain':>7} {tokens:>7} {tokens / elapsed:>9.1f} {'-':>7} {1.0:>15.2f} {1.0:>7.2f}x {'-':>7}"
+        )
+        modes: list[tuple[str, Drafter]] = [("lookup", PromptLookupDrafter(args.draft_tokens))]
+        if DRAFT_BACKEND is not None:
+            modes.append(("draft", DraftModelDrafter(DRAFT_BACKEND, args.draft_tokens)))
+        for mode, drafter in modes:
+            reply, count, spent = generate(BACKEND, prompt, args.tokens, drafter)
+            parity: bool = reply == baseline
+            failures += not parity
+            # 第一个 token 由 prefill 生成，之后每次验证的前向计算至少生成一个 token
+            print(
+                f"{name:>10} {mode:>7} {count:>7} {count / spent:>9.1f} {drafter.acceptance_rate:>7.1%} "
+                f"{(count - 1) / max(drafter.steps, 1):>15.2f} {elapsed / spent:>7.2f}x {'ok' if parity else 'FAIL':>7}"
+            )
+
+    distance: float = check_verify(args.trials)
+    print(f"verify_draft total variation distance: {distance:.4f}")
+    if distance > 0.02:
+        failures += 1
+        print("投机采样输出的分布与目标分布不一致")
+    if failures:
+        raise SystemExit(f"{failures} 项校验失败")
+    print("greedy parity and sampling distribution: ok")
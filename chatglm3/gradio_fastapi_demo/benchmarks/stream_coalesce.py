@@ -0,0 +1,74 @@
+"""
+流式 UI 更新合并基准测试：以固定的 token 间隔模拟流式回复，比较逐片段推送与合并推送时
+聊天框的更新次数、序列化的数据量与片段从生成到显示的最大延迟
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Iterator
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.stream_coalesce import coalesce  # pylint: disable=C0413
+
+
+def fake_stream(tokens: int, token_interval: float) -> Iterator[tuple[str, float]]:
+    """
+    模拟模型的流式回复
+
+    :yield: (至今为止的完整回复, 该片段生成的时间)
+    """
+    reply: str = ""
+    for i in range(tokens):
+        time.sleep(token_interval)
+        reply += f"词{i} "
+        yield reply, time.perf_counter()
+
+
+def run(history: list[list[str]], tokens: int, token_interval: float, interval: float, max_chunks: int) -> dict:
+    """
+    以与 Gradio 相同的方式把聊天记录序列化后推送，统计更新次数、数据量与延迟
+    """
+    updates, total_bytes, max_delay, serialize_time = 0, 0, 0.0, 0.0
+    chat_history: list[list[str]] = history + [["问题", ""]]
+    displayed: int = 0  # 已显示的片段数
+    stream = fake_stream(tokens, token_interval)
+    for reply, created in coalesce(stream, interval, max_chunks) if interval or max_chunks else stream:
+        chat_history[-1][1] = reply
+        start: float = time.perf_counter()
+        total_bytes += len(json.dumps(chat_history, ensure_ascii=False).encode("utf-8"))
+        now: float = time.perf_counter()
+        serialize_time += now - start
+        updates += 1
+        # 被跳过的中间片段在本次推送时才显示，延迟从最早被跳过的片段的生成时间算起
+        skipped: int = reply.count(" ") - displayed - 1
+        max_delay = max(max_delay, now - (created - skipped * token_interval))
+        displayed += skipped + 1
+    return {
+        "updates": updates,
+        "serialized_kib": total_bytes / 1024,
+        "serialize_ms": serialize_time * 1000,
+        "max_delay_ms": max_delay * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history-turns", type=int, default=50, help="已有聊天记录的轮数")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-interval", type=float, default=0.01, help="模型生成相邻 token 的间隔（秒）")
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--max-chunks", type=int, default=0)
+    args = parser.parse_args()
+
+    HISTORY = [[f"第 {i} 个问题", "这是一条较长的历史回复。" * 40] for i in range(args.history_turns)]
+    for name, interval, max_chunks in (
+        ("per chunk", 0.0, 0),
+        (f"coalesced (interval={args.interval}s, max_chunks={args.max_chunks})", args.interval, args.max_chunks),
+    ):
+        result = run(HISTORY, args.tokens, args.token_interval, interval, max_chunks)
+        print(
+            f"{name}: {result['updates']} updates, {result['serialized_kib']:.0f} KiB serialized "
+            f"in {result['serialize_ms']:.1f} ms, max display delay {result['max_delay_ms']:.1f} ms"
+        )
@@ -0,0 +1,136 @@
+"""
+文本解析基准测试：校验共享的 parse_text 与原实现逐字节一致，并比较大段粘贴文本（含中文与纯 ASCII 两种）的耗时
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.text_render import parse_text  # pylint: disable=C0413
+
+
+def legacy_parse_text(text: str, drop_empty_lines: bool = False) -> str:
+    """
+    原有的 parse_text 实现，每行依次调用 16 次 replace，drop_empty_lines 对应 MiniCPM Demo 中的版本
+    """
+    lines: list[str] = text.split("\n")
+    if drop_empty_lines:
+        lines = [line for line in lines if line != ""]
+    else:
+        if lines and lines[0] == "":
+            lines = lines[1:]
+        if lines and lines[-1] == "":
+            lines = lines[:-1]
+
+    in_code_block: bool = False
+    for i, line in enumerate(lines):
+        if "```" in line:
+            in_code_block = not in_code_block
+            items: list[str] = line.rstrip().split("`")
+            if in_code_block:
+                lines[i] = f'<pre><code class="language-{items[-1].strip()}">'
+            else:
+                lines[i] = f"{items[0].strip()}</code></pre>"
+        else:
+            line = line.rstrip()
+            line = (
+                line.replace("&", "&amp;")
+                .replace("<", "&lt;")
+                .replace(">", "&gt;")
+                .replace(" ", "&nbsp;")
+                .replace('"', "&quot;")
+                .replace("`", r"\`")
+                .replace("*", "&ast;")
+                .replace("_", "&lowbar;")
+                .replace("-", "&#45;")
+                .replace(".", "&#46;")
+                .replace("!", "&#33;")
+                .replace("(", "&#40;")
+                .replace(")", "&#41;")
+                .replace("$", "&#36;")
+                .replace("'", "&#x27;")
+                .replace("/", "&#x2F;")
+            )
+            lines[i] = line + "<br/>" if i + 1 != len(lines) else line
+    return "".join(lines)
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    """
+    生成包含代码块、空行、行尾空白与各类特殊字符的随机文本
+    """
+    pieces: list[str] = ["\n", "\n\n", "```", "```python\n", " ", "\t", "\r", "&<>\"'`*_-.!()$/", "中文", "abc", "&amp;"]
+    return "".join(rng.choice(pieces) for _ in range(length))
+
+
+def check_parity(cases: int) -> int:
+    """
+    对随机文本校验 parse_text 的输出和原实现一致
+
+    :return: 不一致的次数
+    """
+    rng = random.Random(0)
+    mismatches: int = 0
+    for _ in range(cases):
+        text: str = random_text(rng, rng.randint(0, 40))
+        for drop_empty_lines in (False, True):
+            if parse_text(text, drop_empty_lines) != legacy_parse_text(text, drop_empty_lines):
+                mismatches += 1
+    return mismatches
+
+
+def pasted_text(lines: int, ascii_only: bool = False) -> str:
+    """
+    模拟粘贴的大段文本：说明文字与代码块交替出现
+
+    :param ascii_only: 说明文字是否使用英文，为 False 时使用中文
+    """
+    block: list[str] = [
+        "Here is an example function that computes the mean of a list:"
+        if ascii_only
+        else "下面是一个示例函数，用于计算列表中所有元素的平均值 (mean)：",
+        "",
+        "```python",
+        "def mean(values: list[float]) -> float:",
+        '    """Return the arithmetic mean of *values*."""',
+        "    return sum(values) / len(values) if values else 0.0",
+        "```",
+        "Note: it's O(n) & returns 0.0 for an empty list -- see `statistics.mean` for details!",
+    ]
+    return "\n".join(block[i % len(block)] for i in range(lines))
+
+
+def timeit(fn, *fn_args, repeat: int = 5) -> float:
+    """
+    多次运行取最短耗时（秒）
+    """
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        fn(*fn_args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=50000, help="粘贴文本的行数")
+    args = parser.parse_args()
+
+    failures = check_parity(args.cases)
+    print(f"parity: {args.cases} random texts x 2 modes, {failures} mismatches")
+
+    for label, ascii_only_text in (("Chinese", False), ("ASCII", True)):
+        pasted = pasted_text(args.lines, ascii_only_text)
+        if parse_text(pasted) != legacy_parse_text(pasted):
+            failures += 1
+        legacy_time, shared_time = timeit(legacy_parse_text, pasted), timeit(parse_text, pasted)
+        print(f"pasted {label} text ({len(pasted) / 1024:.0f} KiB, {args.lines} lines)")
+        print(f"  legacy parse_text: {legacy_time * 1000:.1f} ms")
+        print(f"  shared parse_text: {shared_time * 1000:.1f} ms ({legacy_time / shared_time:.2f}x)")
+
+    if failures:
+        raise SystemExit("parse_text 的输出与原实现不一致")
@@ -0,0 +1,112 @@
+"""
+提示词分词基准测试：模拟一段多轮对话，比较每轮对整个聊天记录重新分词（build_chat_input）与拼接会话中缓存的
+每条消息 token id 的耗时，并逐轮校验两者的 token id 完全一致，以及复用 KV 缓存时的提示词（上一轮的提示词、回复与
+只含新提问的续接提示词）与完整聊天记录的提示词完全一致
+
+默认使用替身后端；--backend chatglm3 使用真实的 ChatGLM3 分词器（只加载分词器，需已下载模型）
+"""
+import argparse
+import itertools
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.backends import STUB_VOCAB, ModelBackend, backend_name, create_backend  # pylint: disable=C0413
+
+from api.session import Conversation  # pylint: disable=C0413
+
+# 消息内容混合汉字、ASCII 与换行，覆盖分词器在消息边界处可能合并字符的情况
+CHARS: str = STUB_VOCAB + "abcdefghijklmnopqrstuvwxyz0123456789 ,.!?:\n"
+
+TOOLS: list[dict[str, Any]] = [
+    {
+        "name": "get_weather",
+        "description": "查询城市的实时天气",
+        "parameters": {"type": "object", "properties": {"city": {"type": "string"}}, "required": ["city"]},
+    }
+]
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    """
+    生成随机消息内容
+    """
+    return "".join(rng.choices(CHARS, k=length)).strip() or "你好"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=backend_name("stub"), help="模型后端，见 common.backends.BACKENDS")
+    parser.add_argument("--turns", type=int, default=128, help="对话轮数")
+    parser.add_argument("--message-length", type=int, default=200, help="每条消息的平均字符数")
+    parser.add_argument("--tools", action="store_true", help="以带工具定义的系统消息开头")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    BACKEND: ModelBackend = create_backend(args.backend)
+    BACKEND.load_tokenizer()
+    if not BACKEND.incremental_prompt:
+        raise SystemExit(f"{args.backend} 后端不支持按消息增量构建提示词")
+
+    rng = random.Random(args.seed)
+    CONVERSATION = Conversation("benchmark", tokenize_message=BACKEND.message_tokens)
+    if args.tools:
+        CONVERSATION.append({"role": "system", "content": "你是一个可以调用工具的助手。", "tools": TOOLS})
+
+    REPORT_TURNS: set[int] = {1, 8, 16, 32, 64, 128, 256, 512, args.turns}
+    mismatches: int = 0
+    previous: list[int] | None = None  # 上一轮的提示词与回复的 token id，即复用的 KV 缓存对应的 token
+    full_total: float = 0.0
+    incremental_total: float = 0.0
+    print(f"{'turn':>5} {'prompt tokens':>14} {'full ms':>9} {'incremental ms':>15} {'speedup':>8}")
+    for turn in range(1, args.turns + 1):
+        question: str = random_text(rng, rng.randint(1, 2 * args.message_length))
+
+        # 原有做法：每轮对整个聊天记录重新分词
+        start: float = time.perf_counter()
+        expected: list[int] = BACKEND.tokenize(question, CONVERSATION.messages)
+        full: float = time.perf_counter() - start
+
+        # 增量做法：只对新的提问分词，拼接缓存的每条消息 token id
+        start = time.perf_counter()
+        question_ids = CONVERSATION.prepare({"role": "user", "content": question})
+        actual: list[int] = BACKEND.build_prompt(itertools.chain(CONVERSATION.message_ids, [question_ids]))
+        incremental: float = time.perf_counter() - start
+
+        if actual != expected:
+            mismatches += 1
+            print(f"第 {turn} 轮的 token id 不一致：{len(actual)} / {len(expected)} 个 token")
+        continued: list[int] = BACKEND.build_prompt([question_ids], continuation=True)
+        if previous is not None and (
+            previous + continued != expected or BACKEND.tokenize(question, [], continuation=True) != continued
+        ):
+            mismatches += 1
+            print(f"第 {turn} 轮复用 KV 缓存的提示词与完整聊天记录的提示词不一致")
+
+        # 回复写入会话时分词一次，计入增量做法的耗时
+        reply: dict[str, Any] = {"role": "assistant", "metadata": "", "content": random_text(rng, args.message_length)}
+        start = time.perf_counter()
+        CONVERSATION.append({"role": "user", "content": question})
+        CONVERSATION.append(reply)
+        incremental += time.perf_counter() - start
+        # 模型生成的回复接在提示词末尾的 <|assistant|> 之后
+        previous = expected + BACKEND.message_tokens(reply)[1:]
+
+        full_total += full
+        incremental_total += incremental
+        if turn in REPORT_TURNS:
+            print(
+                f"{turn:>5} {len(expected):>14} {full * 1000:>9.3f} {incremental * 1000:>15.3f} "
+                f"{full / incremental:>7.1f}x"
+            )
+
+    print(
+        f"total: full {full_total * 1000:.1f} ms, incremental {incremental_total * 1000:.1f} ms, "
+        f"{args.turns} turns, {CONVERSATION.total_tokens} tokens in history"
+    )
+    if mismatches:
+        raise SystemExit(f"{mismatches} 轮的 token id 与 tokenize 不一致")
+    print("token id parity: ok")
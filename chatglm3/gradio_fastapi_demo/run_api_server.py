@@ -1,14 +1,14 @@
 """
 以 API 服务的形式运行 LLM
 """
-from api import app
 
 if __name__ == "__main__":
     import uvicorn
 
+    # 多副本的工作进程以 spawn 方式启动并重新导入本模块，因此以导入路径传入 app，只在主进程中导入，
+    # 避免每个工作进程都创建路由模块中的模型工厂、推理执行器与工作进程池
     uvicorn.run(
-        # app="api.main:app",
-        app=app,
+        app="api.main:app",
         host="127.0.0.1",
         port=8000,
         reload=False,
@@ -1,44 +1,219 @@
 """
 API 请求
 """
-from typing import Any
+import json
+from typing import Any, AsyncIterator, Iterator
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 
-def request_chat_reply(url: str, chat_history: list[Any], top_p: float, temperature: float):
+class SSEParser:
+    """
+    按行解析 SSE 事件流
+    """
+
+    def __init__(self) -> None:
+        self.event: str = "message"
+        self.data_lines: list[str] = []
+
+    def feed(self, line: str) -> tuple[str, dict[str, Any]] | None:
+        """
+        输入一行内容
+
+        :param line: 不含换行符的一行
+        :return: 一个事件结束时返回 (事件类型, 事件数据)，否则返回 None
+        """
+        if not line:  # 空行表示一个事件结束
+            event: tuple[str, dict[str, Any]] | None = None
+            if self.data_lines:
+                event = (self.event, json.loads("\n".join(self.data_lines)))
+            self.event, self.data_lines = "message", []
+            return event
+        if line.startswith("event:"):
+            self.event = line[len("event:") :].strip()
+        elif line.startswith("data:"):
+            self.data_lines.append(line[len("data:") :].lstrip())
+        return None
+
+
+class ReplyAssembler:
+    """
+    将 SSE 增量事件拼接为完整的回复
+    """
+
+    def __init__(self) -> None:
+        self.reply: str = ""
+        self.done: bool = False
+
+    def apply(self, event: str, payload: dict[str, Any]) -> bool:
+        """
+        应用一个事件
+
+        :return: 回复是否发生了变化
+        """
+        if event == "delta":
+            self.reply += payload["text"]
+        elif event == "replace":
+            self.reply = payload["text"]
+        elif event == "done":
+            self.done = True
+            return False
+        else:
+            return False
+        return True
+
+
+class ChatAPIClient:
+    """
+    ChatGLM3 API 客户端，同步请求与异步请求分别复用各自的连接池
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        pool_size: int = 32,
+        retries: int = 3,
+    ) -> None:
+        """
+        :param connect_timeout: 建立连接的超时时间（秒）
+        :param read_timeout: 两次读取之间的超时时间（秒），流式回复中即为相邻两个事件的最长间隔
+        :param pool_size: 连接池大小
+        :param retries: 幂等请求（GET、DELETE）失败后的重试次数，生成回复的 POST 请求不重试
+        """
+        self.timeout: tuple[float, float] = (connect_timeout, read_timeout)
+
+        # 同步客户端，连接保持 keep-alive 并在请求之间复用
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "DELETE"}),
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # 异步客户端，在首次使用时创建，供 Gradio 的异步事件处理函数使用
+        self._async_client: httpx.AsyncClient | None = None
+        self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._async_timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """
+        共享的异步 HTTP 客户端
+        """
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(limits=self._limits, timeout=self._async_timeout)
+        return self._async_client
+
+    @staticmethod
+    def build_data(session_id: str, chat_history: list[Any], top_p: float, temperature: float) -> dict[str, Any]:
+        """
+        构建请求体
+        """
+        return {
+            "chat_history": chat_history,
+            "top_p": top_p,
+            "temperature": temperature,
+            "session_id": session_id,
+        }
+
+    def chat_reply(self, url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float):
+        """
+        发送 post 请求来获得 ChatGLM3 的单条完整回复
+        """
+        data: dict[str, Any] = self.build_data(session_id, chat_history, top_p, temperature)
+        response = self.session.post(url=f"{url}/chat", timeout=self.timeout, json=data)
+        return response.json()
+
+    def stream_chat_reply(
+        self, url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float
+    ) -> Iterator[str]:
+        """
+        发送 post 请求来获得 ChatGLM3 的单条流式回复
+
+        服务端以 SSE 事件只发送新增的文本，在此拼接后依旧返回完整的回复
+        """
+        data: dict[str, Any] = self.build_data(session_id, chat_history, top_p, temperature)
+        data["stream_format"] = "sse"
+        headers: dict[str, str] = {"Accept": "text/event-stream"}
+        with self.session.post(
+            url=f"{url}/stream_chat", timeout=self.timeout, json=data, headers=headers, stream=True
+        ) as response:
+            response.encoding = "utf-8"  # 避免中文内容出现乱码
+            parser, assembler = SSEParser(), ReplyAssembler()
+            # 服务端以 \n 分行（兼容 \r\n），不使用默认按 str.splitlines 分行，避免文本中的 U+2028 等字符被当作换行
+            for line in response.iter_lines(decode_unicode=True, delimiter="\n"):
+                event = parser.feed(line.removesuffix("\r"))
+                if event is not None and assembler.apply(*event):
+                    yield assembler.reply
+                if assembler.done:
+                    break
+
+    async def async_chat_reply(
+        self, url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float
+    ):
+        """
+        异步发送 post 请求来获得 ChatGLM3 的单条完整回复
+        """
+        data: dict[str, Any] = self.build_data(session_id, chat_history, top_p, temperature)
+        response = await self.async_client.post(f"{url}/chat", json=data)
+        return response.json()
+
+    async def async_stream_chat_reply(
+        self, url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float
+    ) -> AsyncIterator[str]:
+        """
+        异步发送 post 请求来获得 ChatGLM3 的单条流式回复，等待回复期间不占用线程
+        """
+        data: dict[str, Any] = self.build_data(session_id, chat_history, top_p, temperature)
+        data["stream_format"] = "sse"
+        headers: dict[str, str] = {"Accept": "text/event-stream"}
+        async with self.async_client.stream("POST", f"{url}/stream_chat", json=data, headers=headers) as response:
+            parser, assembler = SSEParser(), ReplyAssembler()
+            async for line in response.aiter_lines():
+                event = parser.feed(line)
+                if event is not None and assembler.apply(*event):
+                    yield assembler.reply
+                if assembler.done:
+                    break
+
+    def clear_history(self, url: str, session_id: str):
+        """
+        清除 ChatGLM3 聊天记录
+        """
+        response = self.session.delete(
+            url=f"{url}/clear_history", params={"session_id": session_id}, timeout=(self.timeout[0], 5)
+        )
+        return response.json()
+
+
+# 默认客户端，所有 UI 用户共享同一组连接池
+client = ChatAPIClient()
+
+
+def request_chat_reply(url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float):
     """
     发送 post 请求来获得 ChatGLM3 的单条完整回复
     """
-    data: dict[str, Any] = {
-        "chat_history": chat_history,
-        "top_p": top_p,
-        "temperature": temperature,
-    }
-    response = requests.post(url=f"{url}/chat", timeout=60, json=data)
-    return response.json()
+    return client.chat_reply(url, session_id, chat_history, top_p, temperature)
 
 
-def request_stream_chat_reply(url: str, chat_history: list[Any], top_p: float, temperature: float):
+def request_stream_chat_reply(url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float):
     """
     发送 post 请求来获得 ChatGLM3 的单条流式回复
     """
-    data: dict[str, Any] = {
-        "chat_history": chat_history,
-        "top_p": top_p,
-        "temperature": temperature,
-    }
-    headers: dict[str, str] = {"Accept": "text/event-stream"}
-    with requests.post(url=f"{url}/stream_chat", timeout=60, json=data, headers=headers, stream=True) as response:
-        response.encoding = "utf-8"  # 避免中文内容出现乱码
-        # for chunk in response.iter_lines(decode_unicode=True):  # 不可重入
-        for chunk in response.iter_content(chunk_size=1024, decode_unicode=True):
-            yield chunk
+    yield from client.stream_chat_reply(url, session_id, chat_history, top_p, temperature)
 
 
-def clear_history(url: str):
+def clear_history(url: str, session_id: str):
     """
     清除 ChatGLM3 聊天记录
     """
-    response = requests.delete(url=f"{url}/clear_history", timeout=5)
-    return response.json()
+    return client.clear_history(url, session_id)
@@ -3,7 +3,7 @@ UI 界面
 """
 import gradio as gr
 
-from .ui_functions import clear_messages, llm_reply, llm_stream_reply, query_user_input
+from .ui_functions import clear_messages, llm_reply, llm_stream_reply, new_session_id, query_user_input
 
 # Gradio UI
 with gr.Blocks(title="ChatGLM3-6B Gradio Simple Demo") as demo:
@@ -16,6 +16,9 @@ with gr.Blocks(title="ChatGLM3-6B Gradio Simple Demo") as demo:
         interactive=True,
     )
 
+    # 每个页面拥有独立的会话 ID，后端据此隔离聊天记录
+    session_id = gr.State(value=new_session_id)
+
     chatbot = gr.Chatbot()
 
     with gr.Row():
@@ -45,7 +48,7 @@ with gr.Blocks(title="ChatGLM3-6B Gradio Simple Demo") as demo:
     empty_btn.add(components=[user_input, chatbot])
     empty_btn.click(  # pylint: disable=E1101
         fn=clear_messages,
-        inputs=url_text,
+        inputs=[url_text, session_id],
         outputs=None,
     )
 
@@ -57,7 +60,7 @@ with gr.Blocks(title="ChatGLM3-6B Gradio Simple Demo") as demo:
     ).then(
         # fn=llm_reply,
         fn=llm_stream_reply,
-        inputs=[url_text, chatbot, top_p_input, temperature_input],
+        inputs=[url_text, session_id, chatbot, top_p_input, temperature_input],
         outputs=chatbot,
     )
 
@@ -69,6 +72,6 @@ with gr.Blocks(title="ChatGLM3-6B Gradio Simple Demo") as demo:
     ).then(
         # fn=llm_reply,
         fn=llm_stream_reply,
-        inputs=[url_text, chatbot, top_p_input, temperature_input],
+        inputs=[url_text, session_id, chatbot, top_p_input, temperature_input],
         outputs=chatbot,
     )
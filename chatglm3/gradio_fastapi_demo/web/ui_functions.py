@@ -1,69 +1,37 @@
 """
 Gradio 组件所需的方法
 """
+import sys
+import uuid
+from pathlib import Path
 from typing import Any, LiteralString
 
 import gradio as gr
 
-from .api_requests import clear_history, request_chat_reply, request_stream_chat_reply
+from .api_requests import clear_history, client
 
+sys.path.append(str(Path(__file__).resolve().parents[3]))  # 仓库根目录，用于导入 common 模块
+from common.stream_coalesce import acoalesce  # pylint: disable=C0413,C0411
+from common.text_render import parse_text  # pylint: disable=C0413,C0411
 
-def clear_messages(url: str):
+# 流式回复推送到聊天框的最短间隔（秒）与最多合并的片段数，0 表示不按该条件合并
+UPDATE_INTERVAL: float = 0.05
+UPDATE_MAX_CHUNKS: int = 0
+
+
+def clear_messages(url: str, session_id: str):
     """
     清除 ChatGLM3 历史记录
     """
-    if clear_history(url):
+    if clear_history(url, session_id):
         gr.Info("清除聊天历史完成！")
 
 
-def parse_text(text: str) -> str:
+def new_session_id() -> str:
     """
-    解析用户输入的文本并转义文本内特殊字符
-
-    :param text: 输入文本
-    :return: 处理后的文本
+    为每个打开的浏览器页面生成独立的会话 ID
     """
-    lines: list[str] = text.split("\n")
-    # 移除头尾无意义的空元素
-    if lines and lines[0] == "":
-        lines = lines[1:]
-    if lines and lines[-1] == "":
-        lines = lines[:-1]
-
-    in_code_block: bool = False
-    for i, line in enumerate(lines):
-        if "```" in line:  # 转换 Markdown 代码块
-            in_code_block = not in_code_block
-            items: list[str] = line.rstrip().split("`")
-            if in_code_block:
-                lines[i] = f'<pre><code class="language-{items[-1].strip()}">'
-            else:
-                lines[i] = f"{items[0].strip()}</code></pre>"
-        else:
-            # 空行
-            line: str = line.rstrip()  # 移除空行右侧的空格
-            # HTML 转义字符
-            line = (
-                line.replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace(" ", "&nbsp;")
-                .replace('"', "&quot;")
-                .replace("`", r"\`")
-                .replace("*", "&ast;")
-                .replace("_", "&lowbar;")
-                .replace("-", "&#45;")
-                .replace(".", "&#46;")
-                .replace("!", "&#33;")
-                .replace("(", "&#40;")
-                .replace(")", "&#41;")
-                .replace("$", "&#36;")
-                .replace("'", "&#x27;")
-                .replace("/", "&#x2F;")
-            )
-            lines[i] = line + "<br/>" if i + 1 != len(lines) else line
-    text = "".join(lines)
-    return text
+    return uuid.uuid4().hex
 
 
 def query_user_input(input_text: str, chat_history: list[Any]) -> tuple[LiteralString, list[Any]]:
@@ -79,28 +47,33 @@ def query_user_input(input_text: str, chat_history: list[Any]) -> tuple[LiteralS
     return "", chat_history
 
 
-def llm_reply(url: str, chat_history: list[Any], top_p: float, temperature: float):
+async def llm_reply(url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float):
     """
     交由 LLM 来处理聊天对话输入并将单条回复拼接回 Gradio 聊天记录中。
 
+    :param session_id: 当前浏览器页面的会话 ID
     :param chat_history: Gradio 中的聊天历史记录
     :param top_p: top p 参数
     :param temperature: temperature 参数
     :return: Gradio 格式的新的聊天历史记录
     """
-    chat_history[-1][1] = request_chat_reply(url, chat_history, top_p, temperature)
+    chat_history[-1][1] = await client.async_chat_reply(url, session_id, chat_history, top_p, temperature)
     return chat_history
 
 
-def llm_stream_reply(url: str, chat_history: list[Any], top_p: float, temperature: float):
+async def llm_stream_reply(url: str, session_id: str, chat_history: list[Any], top_p: float, temperature: float):
     """
     交由 LLM 来处理聊天对话输入并将单条回复拼接回 Gradio 聊天记录中。
 
+    :param session_id: 当前浏览器页面的会话 ID
     :param chat_history: Gradio 中的聊天历史记录
     :param top_p: top p 参数
     :param temperature: temperature 参数
     :yield: 新的聊天历史记录
     """
-    for reply_chunk in request_stream_chat_reply(url, chat_history, top_p, temperature):
+    # 异步请求在等待回复期间不占用 Gradio 的工作线程
+    replies = client.async_stream_chat_reply(url, session_id, chat_history, top_p, temperature)
+    # 每个片段都是完整的回复，合并后只推送最新的片段，减少聊天框的序列化与重新渲染
+    async for reply_chunk in acoalesce(replies, UPDATE_INTERVAL, UPDATE_MAX_CHUNKS):
         chat_history[-1][1] = reply_chunk
         yield chat_history
@@ -1,13 +1,17 @@
 """
 Gradio UI Demo
 """
+import sys
+from pathlib import Path
 from typing import Any, LiteralString
 
 import gradio as gr
-from modelscope import AutoModel, AutoTokenizer, snapshot_download
 
-TOKENIZER = None
-MODEL = None
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 仓库根目录，用于导入 common 模块
+from common.backends import create_backend  # pylint: disable=C0413
+from common.text_render import parse_text  # pylint: disable=C0413
+
+BACKEND = create_backend("chatglm3")
 MESSAGES: list[dict[str, Any]] = []
 
 
@@ -15,65 +19,8 @@ def init_model():
     """
     初始化 ChatGLM3 模型
     """
-    global TOKENIZER, MODEL  # pylint: disable=W0603
-
-    model_dir: str = snapshot_download("ZhipuAI/chatglm3-6b", revision="master", local_files_only=True)
-
-    if TOKENIZER is None:
-        TOKENIZER = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
-
-    if MODEL is None:
-        MODEL = AutoModel.from_pretrained(model_dir, trust_remote_code=True).cuda().eval()
-
-
-def parse_text(text: str) -> str:
-    """
-    解析用户输入的文本并转义文本内特殊字符
-
-    :param text: 输入文本
-    :return: 处理后的文本
-    """
-    lines: list[str] = text.split("\n")
-    # 移除头尾无意义的空元素
-    if lines and lines[0] == "":
-        lines = lines[1:]
-    if lines and lines[-1] == "":
-        lines = lines[:-1]
-
-    in_code_block: bool = False
-    for i, line in enumerate(lines):
-        if "```" in line:  # 转换 Markdown 代码块
-            in_code_block = not in_code_block
-            items: list[str] = line.rstrip().split("`")
-            if in_code_block:
-                lines[i] = f'<pre><code class="language-{items[-1].strip()}">'
-            else:
-                lines[i] = f"{items[0].strip()}</code></pre>"
-        else:
-            # 空行
-            line: str = line.rstrip()  # 移除空行右侧的空格
-            # HTML 转义字符
-            line = (
-                line.replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace(" ", "&nbsp;")
-                .replace('"', "&quot;")
-                .replace("`", r"\`")
-                .replace("*", "&ast;")
-                .replace("_", "&lowbar;")
-                .replace("-", "&#45;")
-                .replace(".", "&#46;")
-                .replace("!", "&#33;")
-                .replace("(", "&#40;")
-                .replace(")", "&#41;")
-                .replace("$", "&#36;")
-                .replace("'", "&#x27;")
-                .replace("/", "&#x2F;")
-            )
-            lines[i] = line + "<br/>" if i + 1 != len(lines) else line
-    text = "".join(lines)
-    return text
+    if not BACKEND.loaded:
+        BACKEND.load()
 
 
 def llm_reply(chat_history: list[Any], top_p: float, temperature: float):
@@ -100,13 +47,7 @@ def llm_reply(chat_history: list[Any], top_p: float, temperature: float):
     else:
         user_question = chat_history[-1][0]
 
-    reply, MESSAGES = MODEL.chat(
-        TOKENIZER,
-        user_question,
-        history=MESSAGES,
-        top_p=top_p,
-        temperature=temperature,
-    )
+    reply, MESSAGES = BACKEND.chat(user_question, MESSAGES, top_p=top_p, temperature=temperature)
     chat_history[-1][1] = reply
     return chat_history
 
@@ -0,0 +1,3 @@
+"""
+ChatGLM3 与 MiniCPM 各个 Demo 共享的模块
+"""
@@ -0,0 +1,982 @@
+"""
+模型后端：统一不同模型的加载、分词、prefill、单步解码与流式对话接口
+
+- ChatGLM3Backend：ChatGLM3-6B
+- MiniCPMBackend：MiniCPM-2B
+- StubBackend：确定性的 CPU 替身模型，无需下载模型即可测试与压测整个服务
+
+流式对话均使用通用的逐 token 解码循环，每步只增量解码新生成的 token；完整对话使用模型自带的 chat；同一提示词的多个
+回复共享一次 prefill 并批量解码（stream_choices）；传入草稿器（common.speculative）时流式对话使用投机解码，每次前向
+计算验证多个草稿 token
+
+API 服务与基准测试经由 backend_name 读取环境变量 LLM_BACKEND 切换后端，例如 LLM_BACKEND=stub；演示脚本使用固定的后端
+"""
+
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Iterable, Iterator, Sequence
+
+import torch
+from transformers import LogitsProcessorList, StoppingCriteriaList
+from transformers.modeling_outputs import CausalLMOutputWithPast
+
+from .detokenizer import IncrementalDetokenizer
+from .sampling import sample_token, sampling_probs, verify_draft
+from .speculative import Drafter
+
+
+class ModelBackend:
+    """
+    模型后端基类
+
+    子类需要实现 load_tokenizer、load、tokenize 与 eos_token_ids；prefill、decode_step 与 stream 默认按 HuggingFace
+    因果语言模型实现，模型自带更完整的对话逻辑时可以覆盖
+    """
+
+    model_id: str = ""
+    # past_key_values 中序列长度与 batch 所在维度，ChatGLM3 分别为 0 与 1，多数 HuggingFace 模型为 2 与 0
+    kv_seq_dim: int = 2
+    kv_batch_dim: int = 0
+    # 每条消息的 message_tokens 拼接后与 tokenize 的结果完全一致时为 True，此时可以用 build_prompt 由缓存的
+    # 每条消息 token id 构建提示词；BPE 等分词在消息边界处可能合并字符的模板为 False
+    incremental_prompt: bool = False
+
+    def __init__(self) -> None:
+        self.tokenizer: Any = None
+        self.model: Any = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        模型与分词器是否已加载
+        """
+        return self.model is not None and self.tokenizer is not None
+
+    @property
+    def device(self) -> torch.device:
+        """
+        模型所在设备
+        """
+        return next(self.model.parameters()).device
+
+    @property
+    def eos_token_ids(self) -> list[int]:
+        """
+        结束生成的 token id
+        """
+        raise NotImplementedError
+
+    def load_tokenizer(self) -> None:
+        """
+        只加载分词器
+        """
+        raise NotImplementedError
+
+    def load(self) -> None:
+        """
+        加载模型与分词器
+        """
+        raise NotImplementedError
+
+    def tokenize(self, query: str, history: list[dict[str, Any]], continuation: bool = False) -> list[int]:
+        """
+        将聊天记录与用户提问转换为提示词 token id，末尾为助手回复的开头
+
+        :param query: 用户提问
+        :param history: 聊天记录
+        :param continuation: 是否接在上一轮对话的 KV 缓存之后，此时 history 为空，只对新的提问分词
+        :return: 提示词 token id
+        """
+        raise NotImplementedError
+
+    def message_tokens(self, message: dict[str, Any]) -> list[int]:
+        """
+        单条消息在提示词中对应的 token id，不含提示词开头的特殊 token 与末尾助手回复的开头
+
+        :param message: 聊天记录中的单条消息
+        :return: token id
+        """
+        raise NotImplementedError
+
+    def build_prompt(self, message_ids: Iterable[Sequence[int]], continuation: bool = False) -> list[int]:
+        """
+        拼接每条消息的 token id 构建提示词，仅 incremental_prompt 为 True 的后端支持
+
+        :param message_ids: 聊天记录中每条消息与最后的用户提问的 message_tokens
+        :param continuation: 是否接在上一轮对话的 KV 缓存之后，此时不添加提示词开头的特殊 token
+        :return: 与 tokenize(query, history, continuation) 相同的提示词 token id
+        """
+        raise NotImplementedError
+
+    def tokenize_messages(self, messages: list[dict[str, Any]]) -> list[int]:
+        """
+        将完整的聊天记录（最后一条为用户提问）转换为提示词 token id，后端支持时拼接每条消息的 token id
+
+        :param messages: 聊天记录
+        :return: 提示词 token id
+        """
+        if self.incremental_prompt:
+            return self.build_prompt(map(self.message_tokens, messages))
+        return self.tokenize(messages[-1]["content"], messages[:-1])
+
+    def decode(self, token_ids: list[int]) -> str:
+        """
+        将生成的 token id 还原为文本
+        """
+        return self.tokenizer.decode(token_ids)
+
+    def kv_length(self, past_key_values: Any) -> int:
+        """
+        past_key_values 对应的 token 数量
+        """
+        return 0 if past_key_values is None else past_key_values[0][0].shape[self.kv_seq_dim]
+
+    def trim_kv(self, past_key_values: Any, length: int) -> Any:
+        """
+        只保留 past_key_values 的前 length 个 token，返回原张量的视图
+
+        :param past_key_values: 已缓存的 KV
+        :param length: 保留的 token 数量，为 0 时返回 None
+        :return: 截断后的 past_key_values
+        """
+        if past_key_values is None or length <= 0:
+            return None
+        if length >= self.kv_length(past_key_values):
+            return past_key_values
+        return tuple(tuple(tensor.narrow(self.kv_seq_dim, 0, length) for tensor in layer) for layer in past_key_values)
+
+    def score(self, input_ids: list[int], past_key_values: Any = None) -> tuple[torch.Tensor, Any]:
+        """
+        对输入的 token 执行一次前向计算
+
+        :param input_ids: token id，有 past_key_values 时只包含新增的部分
+        :param past_key_values: 已缓存的 KV
+        :return: 各位置的 logits [len, vocab] 与新的 past_key_values
+        """
+        past_length: int = self.kv_length(past_key_values)
+        outputs = self.model(
+            input_ids=torch.tensor([input_ids], dtype=torch.long, device=self.device),
+            position_ids=torch.arange(past_length, past_length + len(input_ids), device=self.device).unsqueeze(0),
+            attention_mask=torch.ones(1, past_length + len(input_ids), dtype=torch.long, device=self.device),
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        return outputs.logits[0], outputs.past_key_values
+
+    def prefill(self, input_ids: list[int], past_key_values: Any = None) -> tuple[torch.Tensor, Any]:
+        """
+        对提示词执行一次前向计算
+
+        :param input_ids: 提示词 token id，有 past_key_values 时只包含新增的部分
+        :param past_key_values: 已缓存的 KV
+        :return: 最后一个位置的 logits [vocab] 与新的 past_key_values
+        """
+        logits, past_key_values = self.score(input_ids, past_key_values)
+        return logits[-1], past_key_values
+
+    def decode_step(self, token_id: int, past_key_values: Any) -> tuple[torch.Tensor, Any]:
+        """
+        输入上一步生成的 token，执行一个解码步骤
+
+        :param token_id: 上一步生成的 token id
+        :param past_key_values: 已缓存的 KV
+        :return: 下一个位置的 logits [vocab] 与新的 past_key_values
+        """
+        return self.prefill([token_id], past_key_values)
+
+    def response_messages(  # pylint: disable=W0613
+        self, output: str, history: list[dict[str, Any]]
+    ) -> tuple[str, list[dict[str, Any]]]:
+        """
+        后处理模型输出，返回回复与应追加到聊天记录的助手消息，不复制聊天记录，流式输出时每步调用的开销与聊天记录
+        的长度无关
+
+        :param output: 模型输出的文本
+        :param history: 聊天记录（不含本次回复）
+        :return: (回复, 助手消息)
+        """
+        return output, [{"role": "assistant", "metadata": "", "content": output}]
+
+    def process_response(self, output: str, history: list[dict[str, Any]]) -> tuple[str, list[dict[str, Any]]]:
+        """
+        后处理模型输出，返回回复与追加了回复的聊天记录（不修改传入的聊天记录）
+        """
+        reply, messages = self.response_messages(output, history)
+        return reply, [*history, *messages]
+
+    @torch.inference_mode()
+    def stream(
+        self,
+        query: str,
+        history: list[dict[str, Any]],
+        top_p: float = 0.8,
+        temperature: float = 0.8,
+        past_key_values: Any = None,
+        max_length: int = 8192,
+        stopping_criteria: StoppingCriteriaList | None = None,
+        logits_processor: LogitsProcessorList | None = None,
+        input_ids: list[int] | None = None,
+        drafter: Drafter | None = None,
+    ) -> Iterator[tuple[str, list[dict[str, Any]], Any]]:
+        """
+        流式对话，与 ChatGLM3 的 stream_chat 一致：用户提问原地追加到 history，每个解码步骤返回完整的回复、
+        追加了回复的聊天记录与 past_key_values
+
+        返回的 past_key_values 恰好包含提示词与已返回的回复的全部 token（不含结束 token），下一轮传入时与
+        对完整聊天记录 prefill 的结果相同；生成的 token 先输入模型再返回，与 stream_chat 相同
+
+        传入 drafter 时使用投机解码，每次前向计算验证多个草稿 token，输出的分布与逐 token 解码相同
+
+        :param query: 用户提问
+        :param history: 聊天记录
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param past_key_values: 上一轮对话结束时的 KV 缓存，传入时只 prefill 新的提问
+        :param max_length: 提示词（含 KV 缓存）与回复的最大总长度
+        :param stopping_criteria: 停止条件，例如取消生成
+        :param logits_processor: logits 处理器，例如禁止敏感词
+        :param input_ids: 调用方已构建的提示词 token id（例如由缓存的每条消息 token id 拼接），为 None 时在这里分词
+        :param drafter: 投机解码的草稿器，为 None 时逐 token 解码
+        :return: (回复, 聊天记录, past_key_values)
+        """
+        if input_ids is None:
+            if past_key_values is None:
+                input_ids = self.tokenize(query, history)
+            else:
+                input_ids = self.tokenize(query, [], continuation=True)
+        history.append({"role": "user", "content": query})
+        max_new_tokens: int = max_length - self.kv_length(past_key_values) - len(input_ids)
+        logits, past_key_values = self.prefill(input_ids, past_key_values)
+        if drafter is not None:
+            yield from self._stream_speculative(
+                input_ids,
+                history,
+                logits,
+                past_key_values,
+                max_new_tokens,
+                top_p,
+                temperature,
+                stopping_criteria,
+                logits_processor,
+                drafter,
+            )
+            return
+        output_ids: list[int] = []
+        detokenizer = IncrementalDetokenizer(self.decode)
+        eos_token_ids: list[int] = self.eos_token_ids
+        ids: torch.Tensor | None = self._token_buffer(input_ids, max_new_tokens, logits_processor, stopping_criteria)
+        # 追加了回复的聊天记录只构建一次，之后每步只替换末尾的助手消息
+        new_history: list[dict[str, Any]] = list(history)
+        while len(output_ids) < max_new_tokens:
+            if ids is not None:
+                prefix = ids[:, : len(input_ids) + len(output_ids)]
+                if logits_processor is not None:
+                    logits = logits_processor(prefix, logits.unsqueeze(0))[0]
+                if stopping_criteria is not None and stopping_criteria(prefix, logits.unsqueeze(0)).any():
+                    break
+            token_id: int = sample_token(logits, top_p, temperature)
+            if token_id in eos_token_ids:
+                break
+            if ids is not None:
+                ids[0, len(input_ids) + len(output_ids)] = token_id
+            output_ids.append(token_id)
+            logits, past_key_values = self.decode_step(token_id, past_key_values)
+            # 只增量解码新的 token，末尾的多字节字符不完整时暂不返回
+            if detokenizer.add(token_id):
+                reply, new_history[len(history) :] = self.response_messages(detokenizer.text, history)
+                yield reply, new_history, past_key_values
+
+    def _stream_speculative(
+        self,
+        input_ids: list[int],
+        history: list[dict[str, Any]],
+        logits: torch.Tensor,
+        past_key_values: Any,
+        max_new_tokens: int,
+        top_p: float,
+        temperature: float,
+        stopping_criteria: StoppingCriteriaList | None,
+        logits_processor: LogitsProcessorList | None,
+        drafter: Drafter,
+    ) -> Iterator[tuple[str, list[dict[str, Any]], Any]]:
+        """
+        投机解码的流式对话：每轮由草稿器提出若干草稿，上一个生成的 token 与全部草稿在一次前向计算中得到各位置的
+        logits，依次验证草稿，第一个被拒绝的位置重新采样，全部接受时再从最后一个位置采样，每轮至少生成一个 token
+
+        logits 处理器与停止条件在每个位置按已生成的 token 执行，与逐 token 解码相同；返回值同 stream，重新采样的
+        token 在下一轮输入模型之后才返回
+        """
+        base_length: int = self.kv_length(past_key_values)  # prefill 之后的 KV 长度
+        output_ids: list[int] = []
+        detokenizer = IncrementalDetokenizer(self.decode)
+        eos_token_ids: list[int] = self.eos_token_ids
+        emitted: int = 0  # 已解码为文本的 token 数量
+        returned: int = 0  # 已返回的文本对应的 token 数量
+        ids: torch.Tensor | None = self._token_buffer(input_ids, max_new_tokens, logits_processor, stopping_criteria)
+        new_history: list[dict[str, Any]] = list(history)
+
+        def reply_with_kv() -> tuple[str, list[dict[str, Any]], Any]:
+            """
+            已解码的回复与只包含其 token 的 KV 缓存
+            """
+            reply, new_history[len(history) :] = self.response_messages(detokenizer.text, history)
+            return reply, new_history, self.trim_kv(past_key_values, base_length + emitted)
+
+        # 本轮待验证的各位置 logits 与草稿，第一轮只有 prefill 最后一个位置的 logits
+        scores: torch.Tensor = logits.unsqueeze(0)
+        draft_ids: list[int] = []
+        draft_probs: torch.Tensor | None = None
+        while True:
+            # 上一轮最后生成的 token 已在本轮输入
+            if emitted > returned:
+                yield reply_with_kv()
+                returned = emitted
+            accepted: bool = False
+            for position, logits in enumerate(scores):
+                if ids is not None:
+                    prefix = ids[:, : len(input_ids) + len(output_ids)]
+                    if logits_processor is not None:
+                        logits = logits_processor(prefix, logits.unsqueeze(0))[0]
+                    if stopping_criteria is not None and stopping_criteria(prefix, logits.unsqueeze(0)).any():
+                        return
+                probs: torch.Tensor = sampling_probs(logits, top_p, temperature)
+                if position < len(draft_ids):
+                    draft: torch.Tensor | None = None if draft_probs is None else draft_probs[position].to(probs.device)
+                    accepted, token_id = verify_draft(probs, draft_ids[position], draft)
+                    drafter.accepted += accepted
+                else:
+                    accepted, token_id = False, int(torch.multinomial(probs, num_samples=1))
+                if token_id in eos_token_ids:
+                    return
+                if ids is not None:
+                    ids[0, len(input_ids) + len(output_ids)] = token_id
+                output_ids.append(token_id)
+                if detokenizer.add(token_id):
+                    emitted = len(output_ids)
+                if not accepted or len(output_ids) >= max_new_tokens:
+                    break
+                # 被接受的草稿已在本轮输入，可以直接返回
+                if emitted > returned:
+                    yield reply_with_kv()
+                    returned = emitted
+            if len(output_ids) >= max_new_tokens:
+                if not accepted:  # 最后一个 token 是重新采样的，尚未输入模型
+                    past_key_values = self.trim_kv(past_key_values, base_length + len(output_ids) - 1)
+                    _, past_key_values = self.decode_step(output_ids[-1], past_key_values)
+                if emitted > returned:
+                    yield reply_with_kv()
+                return
+            # 丢弃被拒绝的草稿的 KV，最后一个生成的 token 在本轮与新的草稿一起输入
+            past_key_values = self.trim_kv(past_key_values, base_length + len(output_ids) - 1)
+            num_tokens: int = min(drafter.num_tokens, max_new_tokens - len(output_ids) - 1)
+            draft_ids, draft_probs = drafter.propose(input_ids + output_ids, num_tokens, top_p, temperature)
+            scores, past_key_values = self.score([output_ids[-1], *draft_ids], past_key_values)
+            drafter.steps += 1
+
+    def _token_buffer(
+        self,
+        input_ids: list[int],
+        max_new_tokens: int,
+        logits_processor: LogitsProcessorList | None,
+        stopping_criteria: StoppingCriteriaList | None,
+    ) -> torch.Tensor | None:
+        """
+        预先分配提示词与回复的 token id 张量，每步只写入新生成的 token，logits 处理器与停止条件读取其前缀视图；
+        两者都没有时不需要 token id，返回 None
+        """
+        if logits_processor is None and stopping_criteria is None:
+            return None
+        ids = torch.zeros(1, len(input_ids) + max(max_new_tokens, 0), dtype=torch.long, device=self.device)
+        ids[0, : len(input_ids)] = torch.tensor(input_ids, dtype=torch.long)
+        return ids
+
+    @torch.inference_mode()
+    def generate_batch(
+        self, prompts: list[list[int]], top_p: float, temperature: float, max_new_tokens: list[int]
+    ) -> list[list[int]]:
+        """
+        批量生成：提示词左侧补齐后一次 prefill，之后在同一次前向计算中解码所有未结束的提示词，结束的提示词从批次中移除
+
+        提示词长度相近时补齐的开销最小，调用方应按长度分组
+
+        :param prompts: 各提示词的 token id
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param max_new_tokens: 各提示词最多生成的 token 数量（包含结束 token）
+        :return: 各提示词生成的 token id，不含结束 token；长度等于 max_new_tokens 时说明因长度限制而结束
+        """
+        length: int = max(map(len, prompts))
+        pad_token_id: int = self.tokenizer.pad_token_id or 0
+        input_ids = torch.tensor(
+            [[pad_token_id] * (length - len(prompt)) + prompt for prompt in prompts],
+            dtype=torch.long,
+            device=self.device,
+        )
+        attention_mask = torch.tensor(
+            [[0] * (length - len(prompt)) + [1] * len(prompt) for prompt in prompts],
+            dtype=torch.long,
+            device=self.device,
+        )
+        # 补齐的位置不参与注意力计算，位置编码从每个提示词的第一个 token 开始
+        outputs = self.model(
+            input_ids=input_ids,
+            position_ids=(attention_mask.cumsum(-1) - 1).clamp(min=0),
+            attention_mask=attention_mask,
+            use_cache=True,
+        )
+        logits, past_key_values = outputs.logits[:, -1, :], outputs.past_key_values
+        positions = torch.tensor([len(prompt) for prompt in prompts], dtype=torch.long, device=self.device)
+        active: list[int] = list(range(len(prompts)))
+        output_ids: list[list[int]] = [[] for _ in prompts]
+        eos_token_ids: list[int] = self.eos_token_ids
+        while True:
+            token_ids: list[int] = [sample_token(logits[row], top_p, temperature) for row in range(len(active))]
+            keep: list[int] = []
+            for row, (index, token_id) in enumerate(zip(active, token_ids)):
+                if token_id in eos_token_ids:
+                    continue
+                output_ids[index].append(token_id)
+                if len(output_ids[index]) < max_new_tokens[index]:
+                    keep.append(row)
+            if not keep:
+                return output_ids
+            if len(keep) < len(active):
+                index = torch.tensor(keep, dtype=torch.long, device=self.device)
+                past_key_values = tuple(
+                    tuple(tensor.index_select(self.kv_batch_dim, index) for tensor in layer)
+                    for layer in past_key_values
+                )
+                attention_mask, positions = attention_mask.index_select(0, index), positions.index_select(0, index)
+                active, token_ids = [active[row] for row in keep], [token_ids[row] for row in keep]
+            attention_mask = torch.cat((attention_mask, attention_mask.new_ones(len(active), 1)), dim=1)
+            outputs = self.model(
+                input_ids=torch.tensor([[token_id] for token_id in token_ids], dtype=torch.long, device=self.device),
+                position_ids=positions.unsqueeze(1),
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            logits, past_key_values = outputs.logits[:, -1, :], outputs.past_key_values
+            positions = positions + 1
+
+    @torch.inference_mode()
+    def stream_choices(
+        self,
+        input_ids: list[int],
+        top_p: float,
+        temperature: float,
+        max_new_tokens: int,
+        cancel_events: list[threading.Event],
+    ) -> Iterator[tuple[int, int]]:
+        """
+        对同一提示词生成多个回复：只 prefill 一次，KV 缓存沿 batch 维复制后各回复独立采样，并在同一次前向计算中解码
+
+        各回复的长度始终相同，无需补齐；结束的回复直接从批次中移除
+
+        :param input_ids: 提示词 token id
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :param max_new_tokens: 每个回复最多生成的 token 数量（包含结束 token）
+        :param cancel_events: 每个回复的取消事件，数量即为回复数量，被设置后该回复在下一个解码步骤结束
+        :return: (回复序号, token id)，每个解码步骤依次返回各个未结束的回复新生成的 token，包含结束 token
+        """
+        logits, past_key_values = self.prefill(input_ids)
+        active: list[int] = list(range(len(cancel_events)))
+        index = torch.zeros(len(active), dtype=torch.long, device=self.device)
+        past_key_values = tuple(
+            tuple(tensor.index_select(self.kv_batch_dim, index) for tensor in layer) for layer in past_key_values
+        )
+        logits = logits.unsqueeze(0).expand(len(active), -1)
+        length: int = len(input_ids)
+        eos_token_ids: list[int] = self.eos_token_ids
+        for step in range(1, max_new_tokens + 1):
+            token_ids: list[int] = [sample_token(logits[row], top_p, temperature) for row in range(len(active))]
+            keep: list[int] = []
+            for row, (choice, token_id) in enumerate(zip(active, token_ids)):
+                yield choice, token_id
+                if token_id not in eos_token_ids and not cancel_events[choice].is_set():
+                    keep.append(row)
+            if not keep or step == max_new_tokens:
+                break
+            if len(keep) < len(active):
+                index = torch.tensor(keep, dtype=torch.long, device=self.device)
+                past_key_values = tuple(
+                    tuple(tensor.index_select(self.kv_batch_dim, index) for tensor in layer)
+                    for layer in past_key_values
+                )
+                active, token_ids = [active[row] for row in keep], [token_ids[row] for row in keep]
+            outputs = self.model(
+                input_ids=torch.tensor([[token_id] for token_id in token_ids], dtype=torch.long, device=self.device),
+                position_ids=torch.full((len(active), 1), length, dtype=torch.long, device=self.device),
+                attention_mask=torch.ones(len(active), length + 1, dtype=torch.long, device=self.device),
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            logits, past_key_values = outputs.logits[:, -1, :], outputs.past_key_values
+            length += 1
+
+    def chat(
+        self, query: str, history: list[dict[str, Any]], top_p: float = 0.8, temperature: float = 0.8, **kwargs: Any
+    ) -> tuple[str, list[dict[str, Any]]]:
+        """
+        完整返回单条回复
+
+        :return: (回复, 追加了提问与回复的聊天记录)
+        """
+        reply: str = ""
+        new_history: list[dict[str, Any]] = history
+        for reply, new_history, _ in self.stream(query, history, top_p, temperature, **kwargs):
+            pass
+        return reply, new_history
+
+
+class ChatGLM3Backend(ModelBackend):
+    """
+    ChatGLM3-6B 后端
+    """
+
+    model_id: str = "ZhipuAI/chatglm3-6b"
+    kv_seq_dim: int = 0
+    kv_batch_dim: int = 1
+    # build_chat_input 对每条消息单独编码后拼接，因此提示词可以按消息增量构建
+    incremental_prompt: bool = True
+
+    def __init__(self, is_quantize: bool = False, is_cpu: bool = False, local_files_only: bool = True) -> None:
+        """
+        :param is_quantize: 是否 4-bit 量化
+        :param is_cpu: 是否使用 CPU 推理
+        :param local_files_only: 只使用本地已下载的模型
+        """
+        super().__init__()
+        self.is_quantize: bool = is_quantize
+        self.is_cpu: bool = is_cpu
+        self.local_files_only: bool = local_files_only
+
+    @property
+    def eos_token_ids(self) -> list[int]:
+        return [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.get_command("<|user|>"),
+            self.tokenizer.get_command("<|observation|>"),
+        ]
+
+    def load_tokenizer(self) -> None:
+        # 替身后端无需安装 modelscope，因此在加载时才导入
+        from modelscope import AutoTokenizer, snapshot_download  # pylint: disable=C0415
+
+        model_dir: str = snapshot_download(self.model_id, revision="master", local_files_only=self.local_files_only)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+
+    def load(self) -> None:
+        from modelscope import AutoModel, snapshot_download  # pylint: disable=C0415
+
+        self.load_tokenizer()
+        model_dir: str = snapshot_download(self.model_id, revision="master", local_files_only=self.local_files_only)
+        if self.is_quantize:
+            # 模型 4-bit 量化，减少显存压力，6GB 显存即可
+            model = AutoModel.from_pretrained(model_dir, trust_remote_code=True).quantize(4).cuda()
+        elif self.is_cpu:
+            # CPU 推理，要求 32GB 内存空间
+            model = AutoModel.from_pretrained(model_dir, trust_remote_code=True).float()
+        else:
+            # GPU 推理，默认 FP16 精度加载，需要 13GB 显存
+            model = AutoModel.from_pretrained(model_dir, trust_remote_code=True).cuda()
+        self.model = model.eval()
+
+    def tokenize(self, query: str, history: list[dict[str, Any]], continuation: bool = False) -> list[int]:
+        input_ids: list[int] = self.tokenizer.build_chat_input(query, history=history)["input_ids"][0].tolist()
+        # 复用 KV 缓存时新的提问直接接在上一轮回复之后，与完整聊天记录的提示词一致，不再添加开头的 [gMASK] 与 sop
+        return input_ids[len(self.tokenizer.get_prefix_tokens()) :] if continuation else input_ids
+
+    def message_tokens(self, message: dict[str, Any]) -> list[int]:
+        # 与 build_chat_input 相同，系统消息的工具定义附加在内容之后
+        content: str = message["content"]
+        if message["role"] == "system" and "tools" in message:
+            content = content + "\n" + json.dumps(message["tools"], indent=4, ensure_ascii=False)
+        return self.tokenizer.build_single_message(message["role"], message.get("metadata", ""), content)
+
+    def build_prompt(self, message_ids: Iterable[Sequence[int]], continuation: bool = False) -> list[int]:
+        # build_chat_input 在开头添加 [gMASK] 与 sop，末尾为 <|assistant|>
+        input_ids: list[int] = [] if continuation else self.tokenizer.get_prefix_tokens()
+        for ids in message_ids:
+            input_ids.extend(ids)
+        input_ids.append(self.tokenizer.get_command("<|assistant|>"))
+        return input_ids
+
+    def response_messages(self, output: str, history: list[dict[str, Any]]) -> tuple[str, list[dict[str, Any]]]:
+        # 模型的 process_response 会深拷贝传入的聊天记录，而它只读取第一条消息判断是否带工具定义，
+        # 因此只传入替代第一条消息的占位消息
+        head: list[dict[str, Any]] = []
+        if history and history[0]["role"] == "system" and "tools" in history[0]:
+            head = [{"role": "system", "tools": None}]
+        reply, messages = self.model.process_response(output, head)
+        return reply, messages[len(head) :]
+
+    def chat(
+        self, query: str, history: list[dict[str, Any]], top_p: float = 0.8, temperature: float = 0.8, **kwargs: Any
+    ) -> tuple[str, list[dict[str, Any]]]:
+        return self.model.chat(self.tokenizer, query, history=history, top_p=top_p, temperature=temperature, **kwargs)
+
+
+class MiniCPMBackend(ModelBackend):
+    """
+    MiniCPM-2B 后端
+    """
+
+    model_id: str = "OpenBMB/MiniCPM-2B-dpo-bf16"
+
+    def __init__(self, is_cpu: bool = False, local_files_only: bool = False) -> None:
+        """
+        :param is_cpu: 是否使用 CPU 推理
+        :param local_files_only: 只使用本地已下载的模型
+        """
+        super().__init__()
+        self.is_cpu: bool = is_cpu
+        self.local_files_only: bool = local_files_only
+
+    @property
+    def eos_token_ids(self) -> list[int]:
+        return [self.tokenizer.eos_token_id]
+
+    def load_tokenizer(self) -> None:
+        from modelscope import AutoTokenizer, snapshot_download  # pylint: disable=C0415
+
+        model_dir: str = snapshot_download(self.model_id, revision="master", local_files_only=self.local_files_only)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+
+    def load(self) -> None:
+        from modelscope import AutoModelForCausalLM, snapshot_download  # pylint: disable=C0415
+
+        self.load_tokenizer()
+        model_dir: str = snapshot_download(self.model_id, revision="master", local_files_only=self.local_files_only)
+        self.model = AutoModelForCausalLM.from_pretrained(
+            model_dir,
+            torch_dtype=torch.float32 if self.is_cpu else torch.bfloat16,
+            device_map="cpu" if self.is_cpu else "cuda",
+            trust_remote_code=True,
+        ).eval()
+
+    def tokenize(self, query: str, history: list[dict[str, Any]], continuation: bool = False) -> list[int]:
+        messages: list[dict[str, Any]] = [*history, {"role": "user", "content": query}]
+        text: str = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
+        # 复用 KV 缓存时新的提问接在上一轮回复之后，不再添加开头的 BOS
+        return self.tokenizer(text, add_special_tokens=not continuation)["input_ids"]
+
+    def message_tokens(self, message: dict[str, Any]) -> list[int]:
+        text: str = self.tokenizer.apply_chat_template([message], tokenize=False, add_generation_prompt=False)
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def response_messages(  # pylint: disable=W0613
+        self, output: str, history: list[dict[str, Any]]
+    ) -> tuple[str, list[dict[str, Any]]]:
+        # 与 MiniCPM 的 chat 一致，截断模型继续生成的下一轮对话
+        match = re.match(r".*?(?=<AI>|<用户>)", output, re.DOTALL)
+        if match is not None:
+            output = match.group(0)
+        return output, [{"role": "assistant", "content": output}]
+
+    def chat(
+        self, query: str, history: list[dict[str, Any]], top_p: float = 0.8, temperature: float = 0.8, **kwargs: Any
+    ) -> tuple[str, list[dict[str, Any]]]:
+        return self.model.chat(self.tokenizer, query, history=history, top_p=top_p, temperature=temperature, **kwargs)
+
+
+# 替身模型输出的 token 从这些汉字中选取
+STUB_VOCAB: str = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法"
+    "所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政"
+    "四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最"
+    "立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根"
+)
+
+
+class StubTokenizer:
+    """
+    逐字符分词的替身分词器，词表只包含特殊 token、可打印 ASCII 字符与 STUB_VOCAB 中的汉字，其余字符记为问号
+
+    词表较小，使 CPU 上的采样开销远小于设定的解码耗时
+    """
+
+    pad_token_id: int = 0
+    eos_token_id: int = 2
+    _commands: dict[str, int] = {"<|system|>": 3, "<|user|>": 4, "<|assistant|>": 5, "<|observation|>": 6}
+    _special_count: int = 8  # 0 为补齐，1 保留，2 为结束 token，3-6 为角色，7 保留
+
+    def __init__(self) -> None:
+        chars: list[str] = [chr(code) for code in range(32, 127)] + list(STUB_VOCAB)
+        self._chars: list[str] = [""] * self._special_count + chars
+        self._ids: dict[str, int] = {char: i for i, char in enumerate(self._chars) if char}
+        self.vocab_size: int = len(self._chars)
+
+    def __len__(self) -> int:
+        return self.vocab_size
+
+    def get_command(self, token: str) -> int:
+        """
+        特殊 token 的 id
+        """
+        return self._commands[token]
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:  # pylint: disable=W0613
+        """
+        每个字符对应一个 token
+        """
+        unknown: int = self._ids["?"]
+        return [self._ids.get(char, unknown) for char in text]
+
+    def decode(self, token_ids: list[int]) -> str:
+        """
+        将 token id 还原为文本，特殊 token 不输出
+        """
+        return "".join(self._chars[token_id] for token_id in token_ids)
+
+
+class StubCausalLM(torch.nn.Module):
+    """
+    确定性的替身因果语言模型，前向计算只按设定的耗时等待
+
+    KV 缓存的形状与 ChatGLM3 一致（[seq_len, batch, 1, kv_dim]），每个位置的前几个元素保存该位置的 token id 与
+    生成状态，因此模型本身无状态，支持连续批处理引擎的批量解码；生成的 token 由 position_ids 确定位置，左侧补齐的
+    批次与单独生成的结果相同
+
+    每个位置的生成状态由上一个位置推进一步，<|assistant|> 处按之前的提问开始新的回复；前向计算返回每个位置的
+    logits，因此一次输入多个 token 的验证（投机解码）与逐个输入的结果相同
+    """
+
+    # 生成状态：之后还需生成的 token 数量、回复开头到提问开头的距离（0 表示不复用提问）、提问的长度、复用提问的
+    # 百分比与下一个 token 在回复中的序号
+    _state_size: int = 5
+
+    def __init__(
+        self,
+        tokenizer: StubTokenizer,
+        prefill_latency: float = 0.0002,
+        token_latency: float = 0.02,
+        default_tokens: int = 64,
+        kv_dim: int = 256,
+    ) -> None:
+        """
+        :param tokenizer: 替身分词器
+        :param prefill_latency: 每个需要 prefill 的 token 的耗时（秒），解码时每多输入一个 token 也增加同样的耗时
+        :param token_latency: 每个解码步骤的耗时（秒）
+        :param default_tokens: 提问中未指定长度时回复的 token 数量
+        :param kv_dim: 每个 token 的 KV 缓存元素数，用于模拟 KV 缓存占用的内存，至少为 6
+        """
+        super().__init__()
+        self.tokenizer: StubTokenizer = tokenizer
+        self.prefill_latency: float = prefill_latency
+        self.token_latency: float = token_latency
+        self.default_tokens: int = default_tokens
+        self.kv_dim: int = max(kv_dim, 1 + self._state_size)
+        # 连续批处理引擎通过模型参数获取设备
+        self.anchor = torch.nn.Parameter(torch.zeros(1), requires_grad=False)
+
+    def reply_tokens(self, input_ids: list[int]) -> int:
+        """
+        回复的 token 数量，提问中包含 [[tokens=N]] 时为 N
+        """
+        matches: list[str] = re.findall(r"\[\[tokens=(\d+)\]\]", self.tokenizer.decode(input_ids))
+        return int(matches[-1]) if matches else self.default_tokens
+
+    def copy_percent(self, input_ids: list[int]) -> int:
+        """
+        回复中逐字复用提问的 token 的百分比，提问中包含 [[copy=P]] 时为 P，否则为 0
+        """
+        matches: list[str] = re.findall(r"\[\[copy=(\d+)\]\]", self.tokenizer.decode(input_ids))
+        return min(int(matches[-1]), 100) if matches else 0
+
+    def next_token(self, token_id: int, position: int) -> int:
+        """
+        由上一个 token 与位置确定的下一个 token，取值为 STUB_VOCAB 中的汉字
+        """
+        return self.tokenizer.vocab_size - len(STUB_VOCAB) + (token_id * 131 + position * 31) % len(STUB_VOCAB)
+
+    def reply_state(self, tokens: list[int], index: int) -> list[int]:
+        """
+        位于 index 的 <|assistant|> 处开始的回复的生成状态
+
+        :param tokens: 包含 KV 缓存在内的全部 token
+        :param index: <|assistant|> 在 tokens 中的位置
+        """
+        prompt: list[int] = tokens[:index]
+        user: int = self.tokenizer.get_command("<|user|>")
+        question_start: int = len(prompt) - prompt[::-1].index(user) if user in prompt else 0
+        question: list[int] = prompt[question_start:]
+        percent: int = self.copy_percent(question)
+        if not question or percent <= 0:
+            return [self.reply_tokens(question), 0, 0, 0, 0]
+        return [self.reply_tokens(question), index + 1 - question_start, len(question), percent, 0]
+
+    def output_token(self, token_id: int, position: int, state: list[int], tokens: list[int], index: int) -> int:
+        """
+        位于 index 的 token 之后生成的 token
+
+        :param token_id: 该位置的 token id
+        :param position: 下一个 token 的位置编码
+        :param state: 该位置的生成状态
+        :param tokens: 包含 KV 缓存在内的全部 token，只在复用提问时使用
+        :param index: 该位置在 tokens 中的下标
+        """
+        remaining, distance, question_length, percent, generated = state
+        if remaining <= 0:
+            return StubTokenizer.eos_token_id
+        # 回复中按序号确定的一部分 token 依次复用提问，与 KV 缓存左侧补齐的长度无关
+        if distance > 0 and generated * 2654435761 % 2**32 % 100 < percent:
+            return tokens[index + 1 - generated - distance + generated % question_length]
+        return self.next_token(token_id, position)
+
+    def forward(
+        self,
+        input_ids: torch.LongTensor,
+        past_key_values: Any = None,
+        position_ids: torch.LongTensor | None = None,
+        **kwargs: Any,  # pylint: disable=W0613
+    ) -> CausalLMOutputWithPast:
+        batch_size, length = input_ids.shape
+        past_length: int = 0 if past_key_values is None else past_key_values[0][0].shape[0]
+        if position_ids is None:
+            position_ids = torch.arange(past_length, past_length + length).expand(batch_size, -1)
+        assistant: int = self.tokenizer.get_command("<|assistant|>")
+        if past_key_values is None or bool((input_ids[:, -1] == assistant).all()):  # prefill
+            time.sleep(self.prefill_latency * batch_size * length)
+        else:
+            time.sleep(self.token_latency + self.prefill_latency * batch_size * (length - 1))
+
+        kv = torch.zeros(length, batch_size, 1, self.kv_dim)
+        kv[:, :, 0, 0] = input_ids.t().float()
+        if past_key_values is None:
+            previous: list[list[int]] = [[0] * self._state_size] * batch_size
+        else:
+            previous = past_key_values[0][0][-1, :, 0, 1 : 1 + self._state_size].long().tolist()
+            kv = torch.cat((past_key_values[0][0], kv))
+
+        logits = torch.zeros(batch_size, length, self.tokenizer.vocab_size)
+        for row, (row_ids, positions) in enumerate(zip(input_ids.tolist(), (position_ids + 1).tolist())):
+            tokens: list[int] = []  # 只在开始回复或复用提问时读取全部 token
+            state: list[int] = previous[row]
+            states: list[list[int]] = []
+            for i, token_id in enumerate(row_ids):
+                if token_id == assistant:
+                    tokens = tokens or kv[:, row, 0, 0].long().tolist()
+                    state = self.reply_state(tokens, past_length + i)
+                else:
+                    state = [state[0] - 1, state[1], state[2], state[3], state[4] + 1]
+                states.append(state)
+                if state[1] > 0 and state[0] > 0:
+                    tokens = tokens or kv[:, row, 0, 0].long().tolist()
+                next_id: int = self.output_token(token_id, positions[i], state, tokens, past_length + i)
+                logits[row, i, next_id] = 1e4
+            kv[past_length:, row, 0, 1 : 1 + self._state_size] = torch.tensor(states, dtype=torch.float)
+        return CausalLMOutputWithPast(logits=logits, past_key_values=((kv, kv),))
+
+
+class StubBackend(ModelBackend):
+    """
+    确定性的 CPU 替身后端，提示词格式与 KV 缓存布局与 ChatGLM3 一致，相同的提问与聊天记录总是得到相同的回复
+
+    提问中包含 [[tokens=N]] 时回复 N 个 token，否则回复 default_tokens 个 token；每个 token 为一个汉字，提问中包含
+    [[copy=P]] 时约 P% 的 token 按序逐字复用提问，用于测试投机解码
+    """
+
+    model_id: str = "stub"
+    kv_seq_dim: int = 0
+    kv_batch_dim: int = 1
+    incremental_prompt: bool = True
+
+    def __init__(
+        self,
+        prefill_latency: float = 0.0002,
+        token_latency: float = 0.02,
+        default_tokens: int = 64,
+        kv_dim: int = 256,
+    ) -> None:
+        """
+        :param prefill_latency: 每个需要 prefill 的 token 的耗时（秒），解码时每多输入一个 token 也增加同样的耗时
+        :param token_latency: 每个解码步骤的耗时（秒）
+        :param default_tokens: 提问中未指定长度时回复的 token 数量
+        :param kv_dim: 每个 token 的 KV 缓存元素数，用于模拟 KV 缓存占用的内存
+        """
+        super().__init__()
+        self.prefill_latency: float = prefill_latency
+        self.token_latency: float = token_latency
+        self.default_tokens: int = default_tokens
+        self.kv_dim: int = kv_dim
+
+    @property
+    def eos_token_ids(self) -> list[int]:
+        return [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.get_command("<|user|>"),
+            self.tokenizer.get_command("<|observation|>"),
+        ]
+
+    def load_tokenizer(self) -> None:
+        self.tokenizer = StubTokenizer()
+
+    def load(self) -> None:
+        self.load_tokenizer()
+        self.model = StubCausalLM(
+            self.tokenizer, self.prefill_latency, self.token_latency, self.default_tokens, self.kv_dim
+        ).eval()
+
+    def tokenize(self, query: str, history: list[dict[str, Any]], continuation: bool = False) -> list[int]:
+        messages: list[dict[str, Any]] = [*history, {"role": "user", "content": query}]
+        return self.build_prompt(self.message_tokens(message) for message in messages)
+
+    def build_prompt(  # pylint: disable=W0613
+        self, message_ids: Iterable[Sequence[int]], continuation: bool = False
+    ) -> list[int]:
+        input_ids: list[int] = []
+        for ids in message_ids:
+            input_ids.extend(ids)
+        input_ids.append(self.tokenizer.get_command("<|assistant|>"))
+        return input_ids
+
+    def message_tokens(self, message: dict[str, Any]) -> list[int]:
+        return [self.tokenizer.get_command(f"<|{message['role']}|>"), *self.tokenizer.encode(message["content"])]
+
+
+# 可通过名称创建的后端
+BACKENDS: dict[str, type[ModelBackend]] = {
+    "chatglm3": ChatGLM3Backend,
+    "minicpm": MiniCPMBackend,
+    "stub": StubBackend,
+}
+
+
+def backend_name(default: str = "chatglm3") -> str:
+    """
+    API 服务与基准测试使用的后端名称，环境变量 LLM_BACKEND 优先于默认值
+
+    :param default: 未设置环境变量时的后端名称
+    :return: 后端名称，见 BACKENDS
+    """
+    return os.environ.get("LLM_BACKEND") or default
+
+
+def create_backend(name: str = "chatglm3", load: bool = False, **kwargs: Any) -> ModelBackend:
+    """
+    按名称创建后端，只传入该后端支持的构造参数：不支持的参数为假值（不启用对应的功能）时忽略，否则抛出异常，
+    例如 MiniCPM 不支持 is_quantize=True
+
+    :param name: 后端名称，见 BACKENDS
+    :param load: 是否立即加载模型
+    :param kwargs: 构造参数
+    :return: 后端
+    :raises ValueError: 未知的后端名称，或启用了该后端不支持的功能
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"未知的模型后端：{name}，可选：{', '.join(BACKENDS)}")
+    backend_class: type[ModelBackend] = BACKENDS[name]
+    accepted = inspect.signature(backend_class.__init__).parameters
+    unsupported: list[str] = [key for key, value in kwargs.items() if key not in accepted and value]
+    if unsupported:
+        raise ValueError(f"模型后端 {name} 不支持参数：{', '.join(unsupported)}")
+    backend: ModelBackend = backend_class(**{key: value for key, value in kwargs.items() if key in accepted})
+    if load:
+        backend.load()
+    return backend
@@ -0,0 +1,225 @@
+"""
+面向大规模敏感词表的 logits processor
+
+敏感词的 token 序列预先编译为字典树：单 token 敏感词合并为一个词表大小的掩码，每个解码步骤只需一次张量操作；
+多 token 敏感词使用带失配跳转的字典树（Aho-Corasick），每个序列只需根据新生成的 token 更新一次状态
+"""
+
+import hashlib
+import json
+import os
+from collections import deque
+from typing import Any, Iterable
+
+import torch
+from transformers import LogitsProcessor
+
+# 编译结果的格式版本，格式改变后旧的磁盘缓存自动失效
+TRIE_FORMAT_VERSION: int = 1
+
+
+def tokenizer_fingerprint(tokenizer: Any) -> str:
+    """
+    分词器的指纹：类名、模型路径、词表大小与词表文件内容的哈希，同一个类、同样大小的分词器换用不同的词表文件后也会
+    改变；只读取文件而不遍历词表，计算耗时远小于对敏感词分词
+
+    :param tokenizer: 分词器，词表文件按 HuggingFace 分词器的 vocab_files_names 在构造参数与模型目录中查找，找不到的
+        文件（例如模型路径是 Hub 上的名称时）不计入
+    :return: 指纹
+    """
+    name_or_path: str = getattr(tokenizer, "name_or_path", "") or ""
+    digest = hashlib.sha256()
+    for name, filename in sorted(getattr(tokenizer, "vocab_files_names", {}).items()):
+        path: Any = getattr(tokenizer, "init_kwargs", {}).get(name) or getattr(tokenizer, name, None)
+        if not (isinstance(path, str) and os.path.isfile(path)) and os.path.isdir(name_or_path):
+            path = os.path.join(name_or_path, filename)
+        if isinstance(path, str) and os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(hashlib.file_digest(f, "sha256").digest())
+    return f"{type(tokenizer).__name__}:{name_or_path}:{len(tokenizer)}:{digest.hexdigest()}"
+
+
+class TokenTrie:
+    """
+    敏感词 token 序列编译后的字典树
+    """
+
+    def __init__(self, bad_words_ids: Iterable[Iterable[int]], eos_token_ids: Iterable[int] = ()) -> None:
+        """
+        :param bad_words_ids: 每个敏感词的 token id 序列
+        :param eos_token_ids: 结束 token，与内置的 NoBadWordsLogitsProcessor 一致，不禁止只由结束 token 构成的敏感词
+        """
+        eos: set[tuple[int, ...]] = {(token_id,) for token_id in eos_token_ids}
+        words: set[tuple[int, ...]] = {tuple(word) for word in bad_words_ids} - eos - {()}
+        # 单 token 敏感词在任意位置都禁止
+        self.single_token_ids: list[int] = sorted(word[0] for word in words if len(word) == 1)
+        self.goto: list[dict[int, int]] = [{}]  # 每个状态的转移
+        self.fail: list[int] = [0]  # 失配时跳转的状态
+        self.banned: list[list[int]] = [[]]  # 处于该状态时下一个 token 禁止的取值
+        for word in sorted(words):
+            if len(word) > 1:
+                self._add(word)
+        self._build()
+
+    def step(self, state: int, token_id: int) -> int:
+        """
+        读入一个 token 后的状态
+
+        :param state: 当前状态
+        :param token_id: token id
+        :return: 新状态
+        """
+        while state and token_id not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(token_id, 0)
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        序列化为可写入 JSON 的字典
+        """
+        return {
+            "version": TRIE_FORMAT_VERSION,
+            "single_token_ids": self.single_token_ids,
+            "goto": [list(transitions.items()) for transitions in self.goto],
+            "fail": self.fail,
+            "banned": self.banned,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "TokenTrie":
+        """
+        从 to_dict 的结果恢复，无需重新编译
+        """
+        trie: TokenTrie = cls.__new__(cls)
+        trie.single_token_ids = data["single_token_ids"]
+        trie.goto = [dict(transitions) for transitions in data["goto"]]
+        trie.fail = data["fail"]
+        trie.banned = data["banned"]
+        return trie
+
+    @classmethod
+    def from_words(
+        cls, tokenizer: Any, words: list[str], eos_token_ids: Iterable[int] = (), cache_path: str | None = None
+    ) -> "TokenTrie":
+        """
+        对敏感词分词并编译，可选地缓存到磁盘，词表与分词器不变时直接读取缓存
+
+        :param tokenizer: 分词器
+        :param words: 敏感词
+        :param eos_token_ids: 结束 token
+        :param cache_path: 磁盘缓存的 JSON 文件路径，为 None 时不缓存，缓存键见 tokenizer_fingerprint
+        :return: 字典树
+        """
+        eos_token_ids = list(eos_token_ids)
+        key: str = hashlib.sha256(
+            json.dumps([tokenizer_fingerprint(tokenizer), eos_token_ids, words], ensure_ascii=False).encode()
+        ).hexdigest()
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                data: dict[str, Any] = json.load(f)
+            if data.get("version") == TRIE_FORMAT_VERSION and data.get("key") == key:
+                return cls.from_dict(data)
+
+        bad_words_ids: list[list[int]] = [tokenizer.encode(word, add_special_tokens=False) for word in words]
+        trie = cls(bad_words_ids, eos_token_ids)
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({**trie.to_dict(), "key": key}, f)
+        return trie
+
+    def _add(self, word: tuple[int, ...]) -> None:
+        """
+        将多 token 敏感词除最后一个 token 外的前缀加入字典树，最后一个 token 记为前缀状态下禁止的取值
+        """
+        state: int = 0
+        for token_id in word[:-1]:
+            next_state: int | None = self.goto[state].get(token_id)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][token_id] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.banned.append([])
+            state = next_state
+        self.banned[state].append(word[-1])
+
+    def _build(self) -> None:
+        """
+        按广度优先顺序计算失配跳转，每个状态合并其后缀状态禁止的取值
+        """
+        queue: deque[int] = deque(self.goto[0].values())
+        while queue:
+            state: int = queue.popleft()
+            for token_id, next_state in self.goto[state].items():
+                queue.append(next_state)
+                if state == 0:  # 第一层状态失配时回到根状态
+                    continue
+                fail: int = self.fail[state]
+                while fail and token_id not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(token_id, 0)
+            # 父状态先于子状态出队，失配状态的深度更小，其禁止的取值已合并完成
+            if state:
+                self.banned[state] = sorted(set(self.banned[state]) | set(self.banned[self.fail[state]]))
+
+
+class BlocklistLogitsProcessor(LogitsProcessor):
+    """
+    禁止生成敏感词的 logits processor，支持批量解码
+
+    每个序列的字典树状态在相邻的解码步骤之间保留，一次生成应使用一个新的实例
+    """
+
+    def __init__(self, trie: TokenTrie) -> None:
+        """
+        :param trie: 敏感词字典树
+        """
+        self.trie: TokenTrie = trie
+        self._mask: torch.Tensor | None = None  # 单 token 敏感词的掩码，形状为 [vocab_size]
+        self._states: list[int] = []  # 每个序列的字典树状态
+        self._length: int = 0  # 上次调用时 input_ids 的长度
+        self._last_token_ids: list[int] = []  # 上次调用时每个序列的最后一个 token
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self._mask is None or self._mask.shape[0] != scores.shape[-1] or self._mask.device != scores.device:
+            self._mask = torch.zeros(scores.shape[-1], dtype=torch.bool, device=scores.device)
+            single_token_ids: list[int] = [i for i in self.trie.single_token_ids if i < scores.shape[-1]]
+            self._mask[single_token_ids] = True
+        self._advance(input_ids)
+
+        scores = scores.masked_fill(self._mask, -float("inf"))
+        rows: list[int] = []
+        cols: list[int] = []
+        for row, state in enumerate(self._states):
+            banned: list[int] = self.trie.banned[state]
+            if banned:
+                rows.extend([row] * len(banned))
+                cols.extend(banned)
+        if rows:
+            scores[rows, cols] = -float("inf")
+        return scores
+
+    def _advance(self, input_ids: torch.LongTensor) -> None:
+        """
+        更新每个序列的字典树状态，与上次调用相比只新增了一个 token 时只处理该 token，否则从头计算
+        """
+        trie: TokenTrie = self.trie
+        batch_size, length = input_ids.shape
+        if (
+            len(self._states) == batch_size
+            and length == self._length + 1
+            and input_ids[:, -2].tolist() == self._last_token_ids
+        ):
+            self._states = [
+                trie.step(state, token_id) for state, token_id in zip(self._states, input_ids[:, -1].tolist())
+            ]
+        else:
+            self._states = []
+            for row in input_ids.tolist():
+                state: int = 0
+                for token_id in row:
+                    state = trie.step(state, token_id)
+                self._states.append(state)
+        self._length = length
+        self._last_token_ids = input_ids[:, -1].tolist()
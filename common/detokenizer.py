@@ -0,0 +1,49 @@
+"""
+流式生成的增量解码
+
+每生成一个 token 都对完整的输出重新解码，耗时与已生成的长度成正比，整条回复为 O(n²)；增量解码每步只解码上次输出
+位置附近的少量 token，并暂缓输出末尾尚不完整的多字节字符，不会输出替换字符 �
+"""
+
+from typing import Callable
+
+# 不完整的 UTF-8 字节序列解码得到的替换字符
+REPLACEMENT_CHAR: str = "�"
+
+
+class IncrementalDetokenizer:
+    """
+    增量解码器
+
+    解码窗口从上一次输出之前的位置开始，窗口内已输出的 token 为之后的 token 提供上下文（例如 SentencePiece 的前导
+    空格），新增文本为窗口整体的解码结果去掉已输出部分；窗口末尾解码出替换字符时说明字节序列尚不完整，暂缓输出，
+    窗口随之变长直到字符完整
+    """
+
+    def __init__(self, decode: Callable[[list[int]], str]) -> None:
+        """
+        :param decode: 将 token id 解码为文本的函数，例如分词器的 decode
+        """
+        self.decode = decode
+        self.token_ids: list[int] = []
+        self.text: str = ""  # 已输出的文本
+        self._prefix_offset: int = 0  # 解码窗口的起点
+        self._read_offset: int = 0  # 已输出文本对应的 token 数量
+        self._prefix_text: str = ""  # 解码窗口中已输出部分的文本
+
+    def add(self, token_id: int) -> str:
+        """
+        追加一个生成的 token
+
+        :param token_id: token id
+        :return: 新增的完整字符，末尾的字符尚不完整或没有新增文本时为空字符串
+        """
+        self.token_ids.append(token_id)
+        new_text: str = self.decode(self.token_ids[self._prefix_offset :])
+        if len(new_text) <= len(self._prefix_text) or new_text.endswith(REPLACEMENT_CHAR):
+            return ""
+        delta: str = new_text[len(self._prefix_text) :]
+        self.text += delta
+        self._prefix_text = self.decode(self.token_ids[self._read_offset :])
+        self._prefix_offset, self._read_offset = self._read_offset, len(self.token_ids)
+        return delta
@@ -0,0 +1,147 @@
+"""
+带缓存的 Markdown/LaTeX 渲染（mdtex2html）
+
+Gradio 每次更新聊天框都会重新处理全部聊天记录，渲染结果按消息内容的哈希缓存，只有新增或改变的消息需要重新渲染；
+流式输出中不断增长的消息只渲染尚未稳定的末尾部分
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import mdtex2html
+
+
+class StablePrefix:
+    """
+    消息中渲染结果不会再随后续追加的内容而改变的前缀
+    """
+
+    def __init__(self, text: str, html: str, has_code: bool) -> None:
+        self.text: str = text
+        self.html: str = html
+        # mdtex2html 在文本含有 ``` 时不再按段落拆分，两种情况下稳定前缀的划分方式不同
+        self.has_code: bool = has_code
+
+
+class MarkdownRenderer:
+    """
+    渲染结果缓存，总大小超过预算时按 LRU 顺序淘汰
+
+    渲染结果与直接调用 mdtex2html.convert 完全一致
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024**2, max_prefixes: int = 16) -> None:
+        """
+        :param max_bytes: 缓存的渲染结果占用的最大字节数（按字符数估算）
+        :param max_prefixes: 保存的稳定前缀数量，即同时进行中的流式消息的数量上限
+        """
+        self.max_bytes: int = max_bytes
+        self.max_prefixes: int = max_prefixes
+        self.total_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.rendered_chars: int = 0  # 实际交给 mdtex2html 渲染的字符数
+        self._entries: OrderedDict[bytes, str] = OrderedDict()
+        self._prefixes: OrderedDict[str, StablePrefix] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict[str, int]:
+        """
+        缓存统计信息
+        """
+        return {
+            "entries": len(self._entries),
+            "total_bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rendered_chars": self.rendered_chars,
+        }
+
+    def render(self, text: str) -> str:
+        """
+        渲染一条消息
+
+        :param text: Markdown/LaTeX 文本
+        :return: HTML
+        """
+        key: bytes = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            html: str | None = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+            prefix: StablePrefix | None = self._find_prefix(text)
+
+        prefix = self._extend(text, prefix)
+        html = prefix.html + self._convert(text[len(prefix.text) :], split_paragraphs=False)
+
+        with self._lock:
+            if prefix.text:
+                self._prefixes[prefix.text] = prefix
+                self._prefixes.move_to_end(prefix.text)
+                while len(self._prefixes) > self.max_prefixes:
+                    self._prefixes.popitem(last=False)
+            if key not in self._entries:
+                self._entries[key] = html
+                self.total_bytes += len(html)
+            while self.total_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return html
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._entries.clear()
+            self._prefixes.clear()
+            self.total_bytes = 0
+
+    def _find_prefix(self, text: str) -> StablePrefix | None:
+        """
+        查找 text 最长的已渲染稳定前缀，文本从无代码块变为含有代码块时前缀不再有效
+        """
+        best: StablePrefix | None = None
+        for prefix in self._prefixes.values():
+            if (best is None or len(prefix.text) > len(best.text)) and text.startswith(prefix.text):
+                if prefix.has_code or "```" not in text:
+                    best = prefix
+        return best
+
+    def _extend(self, text: str, prefix: StablePrefix | None) -> StablePrefix:
+        """
+        从已有的稳定前缀开始，渲染 text 中新增的已稳定部分
+
+        不含代码块时 mdtex2html 按空行拆分段落分别渲染，除最后一段外的段落均已稳定；
+        含有代码块时以已闭合的代码块为界拆分，最后一个闭合代码块及之前的部分均已稳定
+        """
+        if prefix is None:
+            prefix = StablePrefix("", "", "```" in text)
+        stable_text, stable_html = prefix.text, prefix.html
+        rest: str = text[len(stable_text) :]
+        if prefix.has_code:
+            parts: list[str] = rest.split("```", 2)
+            while len(parts) == 3:
+                segment: str = f"{parts[0]}```{parts[1]}```"
+                stable_text += segment
+                stable_html += self._convert(segment, split_paragraphs=False)
+                parts = parts[2].split("```", 2)
+        else:
+            paragraphs: list[str] = rest.split("\n\n")
+            for paragraph in paragraphs[:-1]:
+                stable_text += paragraph + "\n\n"
+                stable_html += self._convert(paragraph, split_paragraphs=False)
+        if len(stable_text) == len(prefix.text):
+            return prefix
+        return StablePrefix(stable_text, stable_html, prefix.has_code)
+
+    def _convert(self, text: str, split_paragraphs: bool) -> str:
+        """
+        调用 mdtex2html 渲染
+        """
+        self.rendered_chars += len(text)
+        return mdtex2html.convert(text, splitParagraphs=split_paragraphs)
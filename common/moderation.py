@@ -0,0 +1,203 @@
+"""
+流式输出的敏感词审核
+
+敏感词预先编译为 Aho-Corasick 自动机，流式输出时只处理新增的文本并跨片段保留匹配状态，
+每个片段的审核耗时只与新增字符数有关，与敏感词数量及已生成的文本长度无关
+"""
+
+from collections import deque
+from typing import Iterable, Iterator, Literal
+
+# 停止生成时附加在回复末尾的提示
+BLOCKED_NOTICE: str = "（回复涉及敏感词，已停止生成）"
+
+
+class AhoCorasick:
+    """
+    多模式匹配自动机
+    """
+
+    def __init__(self, words: Iterable[str]) -> None:
+        """
+        :param words: 敏感词，空字符串会被忽略
+        """
+        self.goto: list[dict[str, int]] = [{}]  # 每个状态的转移
+        self.fail: list[int] = [0]  # 失配时跳转的状态
+        self.depth: list[int] = [0]  # 状态对应前缀的长度
+        self.match_length: list[int] = [0]  # 以该状态结尾的最长敏感词长度，0 表示没有匹配
+        for word in words:
+            if word:
+                self._add(word)
+        self._build()
+
+    @classmethod
+    def from_file(cls, path: str) -> "AhoCorasick":
+        """
+        从每行一个敏感词的文本文件构建
+
+        :param path: 文件路径
+        """
+        with open(path, encoding="utf-8") as f:
+            return cls(line.strip() for line in f)
+
+    def step(self, state: int, char: str) -> int:
+        """
+        读入一个字符后的状态
+
+        :param state: 当前状态
+        :param char: 字符
+        :return: 新状态
+        """
+        while state and char not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(char, 0)
+
+    def search(self, text: str) -> Iterator[tuple[int, int]]:
+        """
+        查找文本中的敏感词
+
+        :param text: 文本
+        :yield: (敏感词起始位置, 敏感词长度)，同一位置结束的多个敏感词只返回最长的一个
+        """
+        state: int = 0
+        for i, char in enumerate(text):
+            state = self.step(state, char)
+            if self.match_length[state]:
+                yield i + 1 - self.match_length[state], self.match_length[state]
+
+    def _add(self, word: str) -> None:
+        """
+        将敏感词加入字典树
+        """
+        state: int = 0
+        for char in word:
+            next_state: int | None = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[state] + 1)
+                self.match_length.append(0)
+            state = next_state
+        self.match_length[state] = len(word)
+
+    def _build(self) -> None:
+        """
+        按广度优先顺序计算失配跳转，并合并失配状态上的匹配
+        """
+        queue: deque[int] = deque(self.goto[0].values())
+        while queue:
+            state: int = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                if state == 0:  # 第一层状态失配时回到根状态
+                    continue
+                fail: int = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.match_length[next_state] = max(
+                    self.match_length[next_state], self.match_length[self.fail[next_state]]
+                )
+
+
+class StreamModerator:
+    """
+    流式审核器，可能是敏感词开头的文本会暂缓输出，直到确定不构成敏感词
+
+    - stop：出现敏感词时停止输出，敏感词及之后的文本均不输出
+    - redact：将敏感词替换为等长的掩码后继续输出
+    """
+
+    def __init__(self, automaton: AhoCorasick, mode: Literal["stop", "redact"] = "redact", mask: str = "*") -> None:
+        """
+        :param automaton: 敏感词自动机
+        :param mode: 出现敏感词时的处理方式
+        :param mask: redact 模式下替换敏感词的字符
+        """
+        self.automaton: AhoCorasick = automaton
+        self.mode: Literal["stop", "redact"] = mode
+        self.mask: str = mask
+        self.blocked: bool = False  # stop 模式下是否已出现敏感词
+        self.matches: list[str] = []  # 出现过的敏感词
+        self._state: int = 0
+        self._pending: list[str] = []  # 暂缓输出的字符，长度不超过当前状态的深度
+
+    def feed(self, text: str) -> str:
+        """
+        审核新增的文本
+
+        :param text: 新增的文本
+        :return: 可以输出的文本
+        """
+        if self.blocked:
+            return ""
+        automaton: AhoCorasick = self.automaton
+        output: list[str] = []
+        pending: list[str] = self._pending
+        state: int = self._state
+        for char in text:
+            state = automaton.step(state, char)
+            pending.append(char)
+            length: int = automaton.match_length[state]
+            if length:
+                self.matches.append("".join(pending[-length:]))
+                if self.mode == "stop":
+                    output.extend(pending[:-length])
+                    self.blocked = True
+                    self._pending, self._state = [], 0
+                    return "".join(output)
+                pending[-length:] = self.mask * length
+            # 超出当前状态深度的字符不可能再成为敏感词的一部分，可以输出
+            keep: int = automaton.depth[state]
+            if len(pending) > keep:
+                output.extend(pending[: len(pending) - keep])
+                del pending[: len(pending) - keep]
+        self._state = state
+        return "".join(output)
+
+    def flush(self) -> str:
+        """
+        输出结束，返回暂缓的文本
+        """
+        output: str = "".join(self._pending)
+        self._pending, self._state = [], 0
+        return output
+
+
+def moderate_replies(
+    replies: Iterable[str], automaton: AhoCorasick, mode: Literal["stop", "redact"] = "redact", notice: str = ""
+) -> Iterator[str]:
+    """
+    审核逐步返回完整回复的流式输出
+
+    :param replies: 每一步返回至今为止完整回复的流式输出
+    :param automaton: 敏感词自动机
+    :param mode: 出现敏感词时的处理方式，stop 模式下会关闭 replies 以停止生成
+    :param notice: stop 模式下停止时附加在回复末尾的提示
+    :yield: 审核后的完整回复
+    """
+    moderator = StreamModerator(automaton, mode)
+    seen: str = ""  # 已审核的原始回复
+    output: str = ""  # 已审核的输出
+    try:
+        for reply in replies:
+            previous: str = output
+            if not reply.startswith(seen):  # 回复被后处理修改时重新审核
+                moderator = StreamModerator(automaton, mode)
+                seen, output = "", ""
+            output += moderator.feed(reply[len(seen) :])
+            seen = reply
+            if moderator.blocked:
+                yield output + notice
+                return
+            if output != previous:  # 新增的文本全部暂缓输出时不重复返回
+                yield output
+        rest: str = moderator.flush()
+        if rest:
+            yield output + rest
+    finally:
+        close = getattr(replies, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,71 @@
+"""
+按 temperature 与 top p 采样下一个 token，以及投机采样中对草稿 token 的验证
+
+verify_draft 按投机采样（speculative sampling）验证草稿：草稿 token x 以 min(1, p(x)/q(x)) 的概率接受，拒绝时从
+max(0, p - q) 归一化后的分布重新采样，得到的 token 与直接从 p 采样同分布；确定性的草稿（例如从提示词中查找）
+相当于 q 为 one-hot
+"""
+
+import torch
+
+
+def sampling_probs(logits: torch.Tensor, top_p: float, temperature: float) -> torch.Tensor:
+    """
+    按 temperature 与 top p 参数调整后的采样分布，与 sample_token 的采样分布相同
+
+    :param logits: [..., vocab] logits
+    :param top_p: top p 参数
+    :param temperature: temperature 参数
+    :return: [..., vocab] 归一化的概率
+    """
+    sorted_probs, sorted_ids = _top_p_sorted(logits, top_p, temperature)
+    probs = torch.zeros_like(sorted_probs).scatter_(-1, sorted_ids, sorted_probs)
+    return probs / probs.sum(dim=-1, keepdim=True)
+
+
+def sample_token(logits: torch.Tensor, top_p: float, temperature: float) -> int:
+    """
+    按 temperature 与 top p 参数采样下一个 token
+
+    :param logits: [vocab] 最后一个位置的 logits
+    :param top_p: top p 参数
+    :param temperature: temperature 参数
+    :return: token id
+    """
+    sorted_probs, sorted_ids = _top_p_sorted(logits, top_p, temperature)
+    return int(sorted_ids[torch.multinomial(sorted_probs, num_samples=1)])
+
+
+def verify_draft(probs: torch.Tensor, token_id: int, draft_probs: torch.Tensor | None = None) -> tuple[bool, int]:
+    """
+    按投机采样验证一个草稿 token
+
+    :param probs: [vocab] 目标模型在该位置的采样分布（sampling_probs）
+    :param token_id: 草稿 token id
+    :param draft_probs: [vocab] 草稿的采样分布，为 None 时草稿是确定性的
+    :return: (是否接受, token id)，拒绝时 token id 为重新采样的 token
+    """
+    p: float = float(probs[token_id])
+    q: float = 1.0 if draft_probs is None else float(draft_probs[token_id])
+    if q > 0.0 and torch.rand(()).item() * q < p:
+        return True, token_id
+    if draft_probs is None:
+        residual = probs.clone()
+        residual[token_id] = 0.0
+    else:
+        residual = (probs - draft_probs).clamp(min=0.0)
+    if float(residual.sum()) <= 0.0:  # p 与 q 相同时不会拒绝，只在浮点误差下出现
+        return True, token_id
+    return False, int(torch.multinomial(residual, num_samples=1))
+
+
+def _top_p_sorted(logits: torch.Tensor, top_p: float, temperature: float) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    按概率降序排列的采样概率（未归一化）与对应的 token id
+    """
+    logits = torch.nan_to_num(logits.float(), nan=0.0, posinf=1e4, neginf=-1e4)
+    probs = torch.softmax(logits / max(temperature, 1e-5), dim=-1)
+    sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+    # 累计概率超过 top p 的 token 不参与采样，概率最高的 token 始终保留
+    sorted_probs[(sorted_probs.cumsum(dim=-1) - sorted_probs) > top_p] = 0.0
+    return sorted_probs, sorted_ids
@@ -0,0 +1,174 @@
+"""
+投机解码的草稿器：每轮提出若干候选 token，由 ModelBackend.stream 在一次前向计算中验证
+
+- PromptLookupDrafter：在聊天记录与已生成的 token 中查找与末尾相同的 n-gram，以其之后的 token 作为草稿，无需额外
+  的模型，适合回复大量引用提问或上文的场景（总结、改写、代码修改）
+- DraftModelDrafter：由与目标模型共享词表的小模型逐个采样草稿，保留自己的 KV 缓存，只丢弃被拒绝的部分
+
+验证按投机采样进行（见 common.sampling.verify_draft），草稿只影响速度，不改变输出的分布
+"""
+
+from typing import TYPE_CHECKING, Sequence
+
+import torch
+
+from .sampling import sampling_probs
+
+if TYPE_CHECKING:
+    from .backends import ModelBackend
+
+# 每轮默认提出的草稿 token 数量
+DEFAULT_DRAFT_TOKENS: int = 4
+
+
+class Drafter:
+    """
+    草稿器基类，同时累计草稿的接受情况
+
+    每个草稿器只用于一次生成；proposed 由 propose 累计，accepted 与 steps 由验证方累计
+    """
+
+    def __init__(self, num_tokens: int = DEFAULT_DRAFT_TOKENS) -> None:
+        """
+        :param num_tokens: 每轮最多提出的草稿 token 数量
+        """
+        self.num_tokens: int = num_tokens
+        self.proposed: int = 0  # 提出的草稿 token 数量
+        self.accepted: int = 0  # 被接受的草稿 token 数量
+        self.steps: int = 0  # 验证草稿的前向计算次数
+
+    def propose(
+        self, token_ids: list[int], num_tokens: int, top_p: float, temperature: float
+    ) -> tuple[list[int], torch.Tensor | None]:
+        """
+        提出接在 token_ids 之后的草稿
+
+        :param token_ids: 提示词与已生成的 token id，每次调用只在上一次的基础上追加
+        :param num_tokens: 最多提出的草稿 token 数量
+        :param top_p: top p 参数
+        :param temperature: temperature 参数
+        :return: 草稿 token id 与各草稿的采样分布 [len, vocab]，分布为 None 时草稿是确定性的
+        """
+        raise NotImplementedError
+
+    @property
+    def acceptance_rate(self) -> float:
+        """
+        草稿 token 的接受率
+        """
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        草稿的接受情况
+        """
+        return {
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "steps": self.steps,
+            "acceptance_rate": self.acceptance_rate,
+        }
+
+
+class PromptLookupDrafter(Drafter):
+    """
+    提示词查找（prompt lookup）草稿器：以末尾的 n-gram 在之前的 token 中最近一次出现之后的 token 作为草稿，
+    优先匹配更长的 n-gram
+
+    各 n-gram 最近一次出现的位置随 token 的追加增量登记，每轮查找的开销与序列长度无关
+    """
+
+    def __init__(
+        self,
+        num_tokens: int = DEFAULT_DRAFT_TOKENS,
+        max_ngram: int = 3,
+        min_ngram: int = 1,
+        context_ids: Sequence[int] = (),
+    ) -> None:
+        """
+        :param num_tokens: 每轮最多提出的草稿 token 数量
+        :param max_ngram: 匹配的最长 n-gram
+        :param min_ngram: 匹配的最短 n-gram
+        :param context_ids: 不在提示词中、但可供查找的 token id，例如复用 KV 缓存时之前的聊天记录
+        """
+        super().__init__(num_tokens)
+        self.max_ngram: int = max_ngram
+        self.min_ngram: int = min_ngram
+        self._context_length: int = len(context_ids)
+        self._tokens: list[int] = list(context_ids)
+        # n-gram -> 最近一次出现的结束位置（不含），只登记之后还有 token 的 n-gram
+        self._index: dict[tuple[int, ...], int] = {}
+        self._indexed: int = 0
+
+    def propose(  # pylint: disable=W0613
+        self, token_ids: list[int], num_tokens: int, top_p: float, temperature: float
+    ) -> tuple[list[int], torch.Tensor | None]:
+        tokens: list[int] = self._tokens
+        tokens.extend(token_ids[len(tokens) - self._context_length :])
+        for end in range(self._indexed + 1, len(tokens)):
+            for n in range(self.min_ngram, min(self.max_ngram, end) + 1):
+                self._index[tuple(tokens[end - n : end])] = end
+        self._indexed = max(self._indexed, len(tokens) - 1)
+
+        draft_ids: list[int] = []
+        if num_tokens > 0:
+            for n in range(min(self.max_ngram, len(tokens)), self.min_ngram - 1, -1):
+                match: int | None = self._index.get(tuple(tokens[-n:]))
+                if match is not None:
+                    draft_ids = tokens[match : match + num_tokens]
+                    break
+        self.proposed += len(draft_ids)
+        return draft_ids, None
+
+
+class DraftModelDrafter(Drafter):
+    """
+    草稿模型草稿器：小模型按与目标模型相同的 temperature 与 top p 逐个采样草稿
+
+    草稿模型必须与目标模型使用相同的词表；草稿模型的 KV 缓存在各轮之间保留，下一轮只输入新接受的 token
+    """
+
+    def __init__(
+        self, backend: "ModelBackend", num_tokens: int = DEFAULT_DRAFT_TOKENS, context_ids: Sequence[int] = ()
+    ) -> None:
+        """
+        :param backend: 已加载的草稿模型后端
+        :param num_tokens: 每轮最多提出的草稿 token 数量
+        :param context_ids: 接在提示词之前的 token id，例如复用 KV 缓存时之前的聊天记录
+        """
+        super().__init__(num_tokens)
+        self.backend: "ModelBackend" = backend
+        self._context: list[int] = list(context_ids)
+        self._tokens: list[int] = []  # 草稿模型 KV 缓存对应的 token id
+        self._synced: int = 0  # _tokens 中已确认为序列前缀的长度
+        self._past_key_values = None
+
+    @torch.inference_mode()
+    def propose(
+        self, token_ids: list[int], num_tokens: int, top_p: float, temperature: float
+    ) -> tuple[list[int], torch.Tensor | None]:
+        if num_tokens <= 0:
+            return [], None
+        sequence: list[int] = self._context + token_ids
+        # 上一轮的草稿中被接受的部分仍可复用，至少重新输入最后一个 token 以得到下一个位置的 logits
+        keep: int = self._synced
+        while keep < len(self._tokens) and keep < len(sequence) and self._tokens[keep] == sequence[keep]:
+            keep += 1
+        keep = min(keep, len(sequence) - 1)
+        past_key_values = self.backend.trim_kv(self._past_key_values, keep)
+        logits, past_key_values = self.backend.prefill(sequence[keep:], past_key_values)
+        self._tokens, self._synced = sequence, len(sequence)
+
+        draft_ids: list[int] = []
+        draft_probs: list[torch.Tensor] = []
+        while True:
+            probs: torch.Tensor = sampling_probs(logits, top_p, temperature)
+            draft_ids.append(int(torch.multinomial(probs, num_samples=1)))
+            draft_probs.append(probs)
+            if len(draft_ids) == num_tokens:
+                break
+            logits, past_key_values = self.backend.decode_step(draft_ids[-1], past_key_values)
+            self._tokens.append(draft_ids[-1])
+        self._past_key_values = past_key_values
+        self.proposed += len(draft_ids)
+        return draft_ids, torch.stack(draft_probs)
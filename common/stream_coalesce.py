@@ -0,0 +1,105 @@
+"""
+合并流式输出的 UI 更新
+
+流式回复的每个片段都是至今为止的完整回复，中间的片段可以跳过，
+按固定的时间间隔或片段数量只推送最新的一个，减少聊天框的序列化与浏览器的重新渲染
+"""
+
+import time
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# 默认每秒最多更新 20 次，与人眼阅读速度相比不会感到延迟
+DEFAULT_INTERVAL: float = 0.05
+
+
+class UpdateCoalescer:
+    """
+    判断收到的片段是否需要立即推送
+
+    第一个片段立即推送，之后距上次推送超过 interval 秒或累计 max_chunks 个片段时推送，结束时推送最后一个片段
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, max_chunks: int = 0) -> None:
+        """
+        :param interval: 两次推送之间的最短间隔（秒），为 0 时不按时间合并
+        :param max_chunks: 累计多少个片段后推送，为 0 时不按片段数量合并；与 interval 同时设置时满足任一条件即推送
+        """
+        self.interval: float = interval
+        self.max_chunks: int = max_chunks
+        self.received: int = 0  # 收到的片段数
+        self.emitted: int = 0  # 推送的次数
+        self._pending: int = 0  # 上次推送之后收到的片段数
+        self._last_emit: float | None = None
+
+    def push(self) -> bool:
+        """
+        收到一个新片段
+
+        :return: 是否应推送该片段
+        """
+        self.received += 1
+        self._pending += 1
+        now: float = time.monotonic()
+        if (
+            self._last_emit is None
+            or (self.interval > 0 and now - self._last_emit >= self.interval)
+            or (self.max_chunks > 0 and self._pending >= self.max_chunks)
+            or (self.interval <= 0 and self.max_chunks <= 0)
+        ):
+            self._emit(now)
+            return True
+        return False
+
+    def flush(self) -> bool:
+        """
+        输出结束
+
+        :return: 最后一个片段是否尚未推送
+        """
+        if self._pending == 0:
+            return False
+        self._emit(time.monotonic())
+        return True
+
+    def _emit(self, now: float) -> None:
+        """
+        记录一次推送
+        """
+        self.emitted += 1
+        self._pending = 0
+        self._last_emit = now
+
+
+def coalesce(chunks: Iterable[T], interval: float = DEFAULT_INTERVAL, max_chunks: int = 0) -> Iterator[T]:
+    """
+    合并同步的流式输出
+
+    :param chunks: 每个片段均为至今为止完整结果的流式输出
+    :param interval: 两次推送之间的最短间隔（秒）
+    :param max_chunks: 累计多少个片段后推送
+    :yield: 需要推送的片段，最后一个片段一定会被推送
+    """
+    coalescer = UpdateCoalescer(interval, max_chunks)
+    latest: T | None = None
+    for latest in chunks:
+        if coalescer.push():
+            yield latest
+    if coalescer.flush():
+        yield latest
+
+
+async def acoalesce(
+    chunks: AsyncIterable[T], interval: float = DEFAULT_INTERVAL, max_chunks: int = 0
+) -> AsyncIterator[T]:
+    """
+    合并异步的流式输出，参数与 coalesce 相同
+    """
+    coalescer = UpdateCoalescer(interval, max_chunks)
+    latest: T | None = None
+    async for latest in chunks:
+        if coalescer.push():
+            yield latest
+    if coalescer.flush():
+        yield latest
@@ -3,82 +3,30 @@ Gradio UI Demo
 """
 
 import gc
+import sys
+from pathlib import Path
 from typing import Any, LiteralString
 
 import gradio as gr
-import mdtex2html
 import torch
-from modelscope import AutoModelForCausalLM, AutoTokenizer, snapshot_download
 
-TOKENIZER = None
-MODEL = None
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # 仓库根目录，用于导入 common 模块
+from common.backends import create_backend  # pylint: disable=C0413
+from common.markdown_render import MarkdownRenderer  # pylint: disable=C0413
+from common.text_render import parse_text  # pylint: disable=C0413
+
+BACKEND = create_backend("minicpm")
 MESSAGES: list[dict[str, Any]] = []
+RENDERER = MarkdownRenderer()  # 聊天框每次更新只渲染新增或改变的消息
 torch.manual_seed(0)
 
 
 def init_model():
     """
-    初始化 ChatGLM3 模型
-    """
-    global TOKENIZER, MODEL  # pylint: disable=W0603
-
-    path: str = "OpenBMB/MiniCPM-2B-dpo-bf16"
-    # model_dir: str = snapshot_download(path, revision="master", local_files_only=True)
-    model_dir: str = snapshot_download(path, revision="master")
-
-    if TOKENIZER is None:
-        TOKENIZER = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
-
-    if MODEL is None:
-        MODEL = AutoModelForCausalLM.from_pretrained(
-            model_dir, torch_dtype=torch.bfloat16, device_map="cuda", trust_remote_code=True
-        )
-
-
-def parse_text(text: str) -> str:
-    """
-    解析用户输入的文本并转义文本内特殊字符
-
-    :param text: 输入文本
-    :return: 处理后的文本
+    初始化 MiniCPM 模型
     """
-    lines: list[str] = text.split("\n")
-    lines = [line for line in lines if line != ""]
-
-    in_code_block: bool = False
-    for i, line in enumerate(lines):
-        if "```" in line:  # 转换 Markdown 代码块
-            in_code_block = not in_code_block
-            items: list[str] = line.rstrip().split("`")
-            if in_code_block:
-                lines[i] = f'<pre><code class="language-{items[-1].strip()}">'
-            else:
-                lines[i] = f"{items[0].strip()}</code></pre>"
-        else:
-            # 空行
-            line: str = line.rstrip()  # 移除空行右侧的空格
-            # HTML 转义字符
-            line = (
-                line.replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace(" ", "&nbsp;")
-                .replace('"', "&quot;")
-                .replace("`", r"\`")
-                .replace("*", "&ast;")
-                .replace("_", "&lowbar;")
-                .replace("-", "&#45;")
-                .replace(".", "&#46;")
-                .replace("!", "&#33;")
-                .replace("(", "&#40;")
-                .replace(")", "&#41;")
-                .replace("$", "&#36;")
-                .replace("'", "&#x27;")
-                .replace("/", "&#x2F;")
-            )
-            lines[i] = line + "<br/>" if i + 1 != len(lines) else line
-    text = "".join(lines)
-    return text
+    if not BACKEND.loaded:
+        BACKEND.load()
 
 
 def llm_reply(chat_history: list[Any], top_p: float, temperature: float):
@@ -105,13 +53,7 @@ def llm_reply(chat_history: list[Any], top_p: float, temperature: float):
     else:
         user_question = chat_history[-1][0]
 
-    reply, MESSAGES = MODEL.chat(
-        TOKENIZER,
-        user_question,
-        history=MESSAGES,
-        top_p=top_p,
-        temperature=temperature,
-    )
+    reply, MESSAGES = BACKEND.chat(user_question, MESSAGES, top_p=top_p, temperature=temperature)
     chat_history[-1][1] = reply
     return chat_history
 
@@ -125,7 +67,7 @@ def query_user_input(input_text: str, chat_history: list[Any]) -> tuple[LiteralS
     :return: 第一个返回值为空，用于清空输入框内容；第二个返回值往聊天历史记录中插入用户文本
     """
     if input_text != "":
-        chat_history += [[parse_text(input_text), None]]  # None 代表不创建回复对话框
+        chat_history += [[parse_text(input_text, drop_empty_lines=True), None]]  # None 代表不创建回复对话框
     return "", chat_history
 
 
@@ -145,8 +87,8 @@ def postprocess(self, y):  # pylint: disable=C0116
         return []
     for i, (message, response) in enumerate(y):
         y[i] = (
-            None if message is None else mdtex2html.convert(message),
-            None if response is None else mdtex2html.convert(response),
+            None if message is None else RENDERER.render(message),
+            None if response is None else RENDERER.render(response),
         )
     return y
 